@@ -0,0 +1,63 @@
+"""
+Measures loading a year of made up events for a report from the database, and from archives of every month but the
+current one.
+
+Run with ``python -m benchmarks.bench_archive [days]``.
+"""
+import datetime
+import gc
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import timetracker.archive as archive
+import timetracker.models as models
+from benchmarks.bench_reports import populate
+
+
+def load(ses, directory: Path, read) -> tuple[float, int]:
+    """
+    :param read: What to do with each event, as a report would
+    :return: The seconds it took to load every event and read them, and the number of objects made along the way
+    """
+    gc.collect()
+    objects = len(gc.get_objects())
+    start = time.perf_counter()
+    events = archive.load_events(ses, directory=directory)
+    for e in events:
+        read(e)
+    elapsed = time.perf_counter() - start
+    made = len(gc.get_objects()) - objects
+    del events
+    ses.expunge_all()
+    return elapsed, made
+
+
+def main(days: float = 365):
+    reads = {'durations': lambda e: e.duration(), 'titles': lambda e: e.window_name}
+    with tempfile.TemporaryDirectory() as d:
+        engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(d, 'bench.db')}")
+        models.create_tables(engine)
+        print(f"{populate(engine, int(days)):,} events over {int(days)} days")
+        ses = sqlalchemy.orm.Session(bind=engine)
+        directory = Path(d) / 'archive'
+        for name, read in reads.items():
+            elapsed, made = load(ses, directory, read)
+            print(f"{'database, ' + name:>20}: {elapsed:.2f}s, {made:,} objects")
+        start = time.perf_counter()
+        n = archive.archive_months(ses, datetime.date.today(), directory)
+        size = sum(i.stat().st_size for i in directory.iterdir())
+        print(f"Archived {n:,} events in {time.perf_counter() - start:.1f} seconds, {size / n:.0f} bytes each")
+        for name, read in reads.items():
+            elapsed, made = load(ses, directory, read)
+            print(f"{'archive, ' + name:>20}: {elapsed:.2f}s, {made:,} objects")
+        ses.close()
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
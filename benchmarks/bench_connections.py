@@ -0,0 +1,77 @@
+"""
+Measures how long a report server's first request and its later ones take to get a connection and query, for a plain
+database and, if SQLCipher is available, for an encrypted one keyed by passphrase and by the raw key derived from it.
+Every request opens a new connection, as the engine of :py:mod:`timetracker.models` does.
+
+Run with ``python -m benchmarks.bench_connections [requests]``.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import timetracker.models as models
+
+THREADS = 8
+
+
+def request(factory) -> float:
+    start = time.perf_counter()
+    ses = factory()
+    ses.query(models.WindowEvent).limit(10).all()
+    ses.close()
+    return time.perf_counter() - start
+
+
+def measure(name: str, url, options: dict, requests: int) -> None:
+    engine = sqlalchemy.create_engine(url, **options)
+    models.use_profile(engine, 'report')
+    factory = sqlalchemy.orm.sessionmaker(bind=engine)
+    first = request(factory)
+    times = []
+
+    def serve():
+        for _ in range(requests // THREADS):
+            times.append(request(factory))
+
+    threads = [threading.Thread(target=serve) for _ in range(THREADS)]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    engine.dispose()
+    print(f"{name:>40}: first {1000 * first:.1f}ms, then {1000 * statistics.median(times):.2f}ms median, "
+          f"{1000 * max(times):.1f}ms worst")
+
+
+def main(requests: float = 400):
+    requests = int(requests)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'plain.db')
+        plain, options = models.database_url(False, path)
+        models.create_tables(sqlalchemy.create_engine(plain))
+        measure("plain", plain, options, requests)
+        if not models._ENCRYPTION:
+            print("SQLCipher is not available, skipping the encrypted database")
+            return
+        path = os.path.join(d, 'encrypted.db')
+        with mock.patch.dict(os.environ, {'TIMETRACKER_PASSWORD': 'benchmark'}):
+            keyed, _ = models.database_url(True, path)
+            models.create_tables(sqlalchemy.create_engine(keyed.set(password='benchmark')))
+            keyed, _ = models.database_url(True, path)
+        passphrase = keyed.set(password='benchmark')
+        measure("encrypted, passphrase", passphrase, options, requests)
+        if keyed.password != 'benchmark':
+            measure("encrypted, raw key", keyed, options, requests)
+        else:
+            print("The raw key could not be derived, check TIMETRACKER_KDF_ALGORITHM")
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
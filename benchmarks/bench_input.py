@@ -0,0 +1,55 @@
+"""
+Compares the cost of accumulating pointer motion per event, the way the tracker used to, with buffering the motion in an
+:py:class:`timetracker.inputs.Accumulator` and reducing it once per sample.
+
+Run with ``python -m benchmarks.bench_input``.
+"""
+import random
+import time
+from math import sqrt
+
+from timetracker.inputs import Accumulator
+
+EVENTS = 1_000_000
+REPEAT = 5
+PER_SAMPLE = 4000
+"A 1000Hz mouse moving for a whole 4 second sample"
+
+
+def make_events(n: int) -> list[tuple[float, float, float]]:
+    rng = random.Random(0)
+    return [(rng.uniform(-5, 5), rng.uniform(-5, 5), i / 1000) for i in range(n)]
+
+
+def per_event(events) -> float:
+    accumulated_motion = 0
+    for n, (dx, dy, t) in enumerate(events):
+        accumulated_motion += sqrt(sum(map(lambda x: x ** 2, (dx, dy))))
+        if n % PER_SAMPLE == PER_SAMPLE - 1:
+            accumulated_motion = 0
+    return accumulated_motion
+
+
+def buffered(events) -> float:
+    accumulator = Accumulator(PER_SAMPLE)
+    add_motion = accumulator.add_motion
+    for n, (dx, dy, t) in enumerate(events):
+        add_motion(dx, dy, t)
+        if n % PER_SAMPLE == PER_SAMPLE - 1:
+            accumulator.take()
+    return accumulator.take().motion
+
+
+def main():
+    events = make_events(EVENTS)
+    for name, f in [('per event', per_event), ('buffered', buffered)]:
+        elapsed = float('inf')
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            f(events)
+            elapsed = min(elapsed, time.perf_counter() - start)
+        print(f"{name:>10}: {EVENTS / elapsed:,.0f} events/s")
+
+
+if __name__ == '__main__':
+    main()
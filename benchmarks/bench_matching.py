@@ -0,0 +1,93 @@
+"""
+Measures tagging a month of made up events against 200 matchers, by asking each matcher in turn and compiled together,
+with and without the tags of the titles seen before, and with the titles matched in a pool of processes.
+
+Run with ``python -m benchmarks.bench_matching [days] [matchers]``.
+"""
+import os
+import random
+import re
+import sys
+import time
+from typing import NamedTuple
+
+import timetracker.sources as sources
+from timetracker.archive import ArchivedClass
+from timetracker.matching import CompiledMatchers, compiled, in_parallel
+from timetracker.report import AndMatcher, ClassMatcher, NameTagger, NotMatcher, OrMatcher, _ask_each, process_events
+
+WORDS = ['issue', 'github', 'pytest', 'emacs', 'notes', 'reddit', 'stack', 'gmail', 'vim', 'htop', 'telegram', 'git',
+         'docs', 'chat', 'models', 'readme', 'python', 'firefox', 'overflow', 'saved']
+
+
+class Event(NamedTuple):
+    window_name: str
+    classes: list
+
+
+def events(days: int, seed: int = 0) -> list[Event]:
+    "About as many events as a day of working from 9 to 5 with a minute or so per window has, for each day"
+    rng = random.Random(seed)
+    r = []
+    for _ in range(days * 480):
+        title, classes, subjects = rng.choice(sources._APPLICATIONS)
+        r.append(Event(title.format(rng.choice(subjects).format(rng.randint(1, 40))),
+                       [ArchivedClass(i, c) for i, c in enumerate(classes)]))
+    return r
+
+
+def matchers(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+
+    def leaf():
+        needles = [rng.choice(WORDS) + rng.choice(['', ' ', 's', str(rng.randint(1, 40))])
+                   for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.1:
+            needles.append(re.compile(rf'.*{rng.choice(WORDS)}\b'))
+        if rng.random() < 0.2:
+            return ClassMatcher(needles, [f'class{rng.randrange(20)}'])
+        return NameTagger(needles, [f'tag{rng.randrange(50)}'])
+
+    r = []
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.6:
+            r.append(leaf())
+        elif kind < 0.8:
+            r.append(OrMatcher([leaf() for _ in range(3)], [f'group{i}']))
+        elif kind < 0.95:
+            r.append(AndMatcher([leaf(), NotMatcher([leaf()], [])], [f'group{i}']))
+        else:
+            r.append(NotMatcher([leaf(), leaf()], [f'group{i}']))
+    return r
+
+
+def timed(name: str, f):
+    start = time.perf_counter()
+    result = f()
+    print(f"{name:>32}: {time.perf_counter() - start:.3f}s")
+    return result
+
+
+def main(days: float = 30, n: float = 200):
+    sample, rules = events(int(days)), matchers(int(n))
+    print(f"{len(sample):,} events, {int(n)} matchers")
+    expected = timed("asking each matcher", lambda: _ask_each(rules, sample))
+    matcher = timed("compiling", lambda: CompiledMatchers(rules))
+    matcher.titles.maxsize = 0
+    tags = timed("compiled, without the tag cache", lambda: [(e, matcher.tags(e)) for e in sample])
+    assert tags == expected
+    matcher = compiled(rules)
+    tags = timed("compiled, first report", lambda: [(e, matcher.tags(e)) for e in sample])
+    assert tags == expected
+    timed("compiled, next report", lambda: process_events(rules, sample))
+    print(f"tag cache: {matcher.titles.info()}")
+    workers = max(os.cpu_count() or 1, 2)
+    for run in ("starting the pool", "pool kept"):
+        matcher = CompiledMatchers(rules)
+        tags = timed(f"{workers} processes, {run}", lambda: in_parallel(matcher, sample, workers, threshold=0))
+        assert tags == expected
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
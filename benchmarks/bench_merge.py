@@ -0,0 +1,41 @@
+"""
+Measures merging events on a scratch database of several years of made up events, first over all of it and then
+continuing after a day's worth more.
+
+Run with ``python -m benchmarks.bench_merge [days]``.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import timetracker.models as models
+from benchmarks.bench_reports import populate
+from timetracker.models import WindowEvent
+
+
+def main(days: float = 3 * 365):
+    with tempfile.TemporaryDirectory() as d:
+        engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(d, 'bench.db')}")
+        models.create_tables(engine)
+        print(f"{populate(engine, int(days)):,} events over {int(days)} days")
+        ses = sqlalchemy.orm.Session(bind=engine)
+        for name in ['Full merge', 'Nothing new', 'Another day']:
+            if name == 'Another day':
+                start = ses.query(sqlalchemy.func.max(WindowEvent.time_end)).scalar()
+                with engine.begin() as connection:
+                    connection.execute(WindowEvent.__table__.insert(), [
+                        {'session_id': 1, 'title_id': i // 10, 'window_id': 1,
+                         'time_start': start + datetime.timedelta(seconds=60 * i),
+                         'time_end': start + datetime.timedelta(seconds=60 * i + 58)} for i in range(480)])
+            start = time.perf_counter()
+            removed = WindowEvent.merge_within(ses, 10 * 60)
+            print(f"{name:>12}: removed {removed:,} events in {time.perf_counter() - start:.3f} seconds")
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
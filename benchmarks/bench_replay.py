@@ -0,0 +1,28 @@
+"""
+Measures the throughput of the whole tracking pipeline, from input events to committed rows, by replaying a synthetic
+recording into a scratch database.
+
+Run with ``python -m benchmarks.bench_replay [hours]``.
+"""
+import datetime
+import os
+import sys
+import tempfile
+
+import timetracker.sources as sources
+import timetracker.stats
+import timetracker.tracker as tracker
+
+
+def main(hours: float = 8):
+    with tempfile.TemporaryDirectory() as d:
+        recording = os.path.join(d, 'recording')
+        with open(recording, 'wb') as f:
+            n = sources.write_records(f, sources.synthetic(hours), datetime.datetime(2021, 1, 1))
+        print(f"{hours} hours of synthetic activity, {n} records, {os.path.getsize(recording):,} bytes")
+        tracker.replay(recording, database=f"sqlite:///{os.path.join(d, 'bench.db')}")
+        print(timetracker.stats.report_stats(timetracker.stats.stats.as_json()))
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
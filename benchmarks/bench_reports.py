@@ -0,0 +1,93 @@
+"""
+Measures the queries reports make over a year of made up events, with and without the indexes on the events.
+
+Run with ``python -m benchmarks.bench_reports [days]``.
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import timetracker.models as models
+import timetracker.sources as sources
+from timetracker.models import WindowEvent
+
+
+def populate(engine, days: int, seed: int = 0) -> int:
+    """
+    Add working days of events, from 9 to 5 with a minute or so per window, ending today.
+
+    :return: The number of events added
+    """
+    rng = random.Random(seed)
+    names = sorted({title.format(subject.format(n)) for title, _, subjects in sources._APPLICATIONS
+                    for subject in subjects for n in range(1, 41)})
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    n = 0
+    with engine.begin() as connection:
+        connection.execute(models.SessionObject.__table__.insert(), [{'id': 1}])
+        connection.execute(models.WindowTitle.__table__.insert(), [{'id': n, 'name': i} for n, i in enumerate(names)])
+        for day in range(days, -1, -1):
+            t = today - datetime.timedelta(days=day, hours=-9)
+            end = t + datetime.timedelta(hours=8)
+            rows = []
+            while t < end:
+                finish = t + datetime.timedelta(seconds=rng.expovariate(1 / 60))
+                rows.append({'session_id': 1, 'title_id': rng.randrange(len(names)), 'window_id': 1,
+                             'time_start': t, 'time_end': finish})
+                t = finish
+            connection.execute(WindowEvent.__table__.insert(), rows)
+            n += len(rows)
+    return n
+
+
+def queries(ses):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    yield "today's events", lambda: ses.query(WindowEvent).where(WindowEvent.time_start >= today) \
+        .order_by(WindowEvent.time_start).all()
+    yield "the last 6 days", lambda: ses.query(WindowEvent).where(
+        WindowEvent.time_start >= WindowEvent.start_of_recent_days(ses, 6)).order_by(WindowEvent.time_start).all()
+    yield "a week in march", lambda: ses.query(WindowEvent).where(
+        WindowEvent.time_start.between(today.replace(month=3, day=1), today.replace(month=3, day=8))).all()
+    yield "a title's last use", lambda: ses.query(WindowEvent).join(WindowEvent.title).where(
+        models.WindowTitle.name == 'htop: ~/src').order_by(WindowEvent.time_start.desc()).first()
+
+
+def measure(engine) -> None:
+    ses = sqlalchemy.orm.Session(bind=engine)
+    for name, query in queries(ses):
+        best = float('inf')
+        for _ in range(5):
+            start = time.perf_counter()
+            query()
+            best = min(best, time.perf_counter() - start)
+            ses.expunge_all()
+        print(f"{name:>20}: {1000 * best:.1f}ms")
+    ses.close()
+
+
+def main(days: float = 365):
+    with tempfile.TemporaryDirectory() as d:
+        engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(d, 'bench.db')}")
+        models.create_tables(engine)
+        for index in WindowEvent.__table__.indexes:
+            index.drop(engine)
+        print(f"{populate(engine, int(days)):,} events over {int(days)} days")
+        print("Without indexes")
+        measure(engine)
+        start = time.perf_counter()
+        for index in WindowEvent.__table__.indexes:
+            index.create(engine)
+        with engine.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+        print(f"Indexed in {time.perf_counter() - start:.1f} seconds")
+        measure(engine)
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
@@ -0,0 +1,63 @@
+"""
+Measures summarizing a year of made up events by month and tag, by tagging every event and from the rollups.
+
+Run with ``python -m benchmarks.bench_rollup [days]``.
+"""
+import collections
+import datetime
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import timetracker.models as models
+import timetracker.rollup as rollup
+from benchmarks.bench_reports import populate
+from timetracker.report import NameTagger, OrMatcher, process_events
+
+MATCHERS = [NameTagger('vim', ['editing']), NameTagger('Firefox', ['browser']),
+            OrMatcher([NameTagger('.py', ['python']), NameTagger('pytest', ['python'])], ['programming'])]
+
+
+def from_events(ses) -> dict:
+    months = collections.Counter()
+    for event, tags in process_events(MATCHERS, ses.query(models.WindowEvent)):
+        for tag in set(tags):
+            months[event.time_start.replace(day=1).date(), tag] += event.duration().total_seconds()
+    return months
+
+
+def timed(name: str, f):
+    start = time.perf_counter()
+    result = f()
+    print(f"{name:>30}: {time.perf_counter() - start:.3f}s")
+    return result
+
+
+def main(days: float = 365):
+    with tempfile.TemporaryDirectory() as d:
+        engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(d, 'bench.db')}")
+        models.create_tables(engine)
+        print(f"{populate(engine, int(days)):,} events over {int(days)} days")
+        ses = sqlalchemy.orm.Session(bind=engine)
+        directory = Path(d) / 'archive'
+        timed("tagging every event", lambda: from_events(ses))
+        ses.expunge_all()
+        timed("first rollup", lambda: rollup.update(ses, MATCHERS, directory=directory))
+        with engine.begin() as connection:
+            connection.execute(models.WindowEvent.__table__.insert(), [
+                {'session_id': 1, 'title_id': 0, 'window_id': 1,
+                 'time_start': datetime.datetime.now() + datetime.timedelta(minutes=n),
+                 'time_end': datetime.datetime.now() + datetime.timedelta(minutes=n + 1)} for n in range(100)])
+        timed("rollup of 100 new events", lambda: rollup.update(ses, MATCHERS, directory=directory))
+        rows = timed("reading the year by month", lambda: rollup.totals(ses, 'tag', 'month'))
+        print(f"{len(rows)} rows")
+        ses.close()
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
@@ -0,0 +1,65 @@
+"""
+Measures title searches over a scratch database of made up events, against the scan they replace.
+
+Run with ``python -m benchmarks.bench_search [events]``.
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import timetracker.models as models
+import timetracker.sources as sources
+from timetracker.search import search_titles
+
+_QUERIES = ['timetracker/models.py', 'Issue #17', 'Stack Overflow', 'Saved Messages', 'htop', 'nonexistent']
+
+
+def populate(engine, events: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    names = sorted({title.format(subject.format(n)) for title, _, subjects in sources._APPLICATIONS
+                    for subject in subjects for n in range(1, 41)})
+    start = datetime.datetime(2018, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(models.SessionObject.__table__.insert(), [{'id': 1}])
+        connection.execute(models.WindowTitle.__table__.insert(), [{'id': n, 'name': i} for n, i in enumerate(names)])
+        rows = []
+        for i in range(events):
+            end = start + datetime.timedelta(seconds=rng.randint(4, 300))
+            rows.append({'session_id': 1, 'title_id': rng.randrange(len(names)), 'window_id': 1,
+                         'time_start': start, 'time_end': end})
+            start = end
+            if len(rows) == 10000:
+                connection.execute(models.WindowEvent.__table__.insert(), rows)
+                rows = []
+        if rows:
+            connection.execute(models.WindowEvent.__table__.insert(), rows)
+
+
+def main(events: int = 1000000):
+    with tempfile.TemporaryDirectory() as d:
+        engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(d, 'bench.db')}")
+        models.create_tables(engine)
+        start = time.perf_counter()
+        populate(engine, int(events))
+        print(f"Inserted {int(events):,} events in {time.perf_counter() - start:.1f} seconds, through the index triggers")
+        ses = sqlalchemy.orm.Session(bind=engine)
+        for query in _QUERIES:
+            start = time.perf_counter()
+            days = search_titles(ses, query)
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            ses.execute(sqlalchemy.text('SELECT count(*) FROM "WindowEvent" JOIN "WindowTitle" ON title_id = '
+                                        '"WindowTitle".id WHERE name LIKE :q'),
+                        {'q': f'%{query}%'}).scalar()
+            scan = time.perf_counter() - start
+            print(f"{query!r:>26}: {len(days)} days in {1000 * elapsed:.1f}ms, LIKE scan {1000 * scan:.1f}ms")
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
@@ -0,0 +1,48 @@
+"""
+Measures tagging a year of made up events for a report, by loading the events and tagging them in python, by tagging
+them in sqlite, and by adding up the time of each tag in sqlite.
+
+Run with ``python -m benchmarks.bench_sqlmatching [days] [matchers]``.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import timetracker.models as models
+from benchmarks.bench_matching import matchers
+from benchmarks.bench_reports import populate
+from timetracker.report import process_events
+from timetracker.sqlmatching import tag_totals, tagged_events
+
+
+def timed(name: str, f):
+    start = time.perf_counter()
+    result = f()
+    print(f"{name:>30}: {time.perf_counter() - start:.3f}s")
+    return result
+
+
+def main(days: float = 365, n: float = 50):
+    rules = matchers(int(n))
+    with tempfile.TemporaryDirectory() as d:
+        engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(d, 'bench.db')}")
+        models.create_tables(engine)
+        print(f"{populate(engine, int(days)):,} events over {int(days)} days, {int(n)} matchers")
+        ses = sqlalchemy.orm.Session(bind=engine)
+        expected = timed("loading and tagging in python",
+                         lambda: process_events(rules, ses.query(models.WindowEvent).order_by(
+                             models.WindowEvent.time_start)))
+        ses.expunge_all()
+        tagged = timed("tagging in sqlite", lambda: tagged_events(ses, rules))
+        assert [sorted(tags) for _, tags in tagged] == [sorted(set(tags)) for _, tags in expected]
+        totals = timed("adding up each tag in sqlite", lambda: tag_totals(ses, rules))
+        print(f"{len(totals)} tags")
+        ses.close()
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
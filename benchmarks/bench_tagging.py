@@ -0,0 +1,53 @@
+"""
+Measures keeping the tags of a year of made up events, and reports that read them back, against tagging the events in
+sqlite for each report.
+
+Run with ``python -m benchmarks.bench_tagging [days] [matchers]``.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import timetracker.models as models
+from benchmarks.bench_matching import matchers
+from benchmarks.bench_reports import populate
+from timetracker import sqlmatching, tagging
+
+
+def timed(name: str, f):
+    start = time.perf_counter()
+    result = f()
+    print(f"{name:>36}: {time.perf_counter() - start:.3f}s")
+    return result
+
+
+def main(days: float = 365, n: float = 50):
+    rules = matchers(int(n))
+    with tempfile.TemporaryDirectory() as d:
+        engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(d, 'bench.db')}")
+        models.create_tables(engine)
+        print(f"{populate(engine, int(days)):,} events over {int(days)} days, {int(n)} matchers")
+        ses = sqlalchemy.orm.Session(bind=engine)
+        timed("tagging every event", lambda: tagging.update(ses, rules))
+        week = datetime.datetime.combine(datetime.date.today(), datetime.time()) - datetime.timedelta(days=6)
+        for name, start in [("the whole year", None), ("the last week", week)]:
+            expected = timed(f"{name}, tagged in sqlite", lambda: sqlmatching.tagged_events(ses, rules, start))
+            kept = timed(f"{name}, from the tags kept", lambda: tagging.tagged_events(ses, rules, start))
+            assert kept == expected
+        last = ses.query(models.WindowEvent).order_by(models.WindowEvent.id.desc()).first()
+        ses.add_all(models.WindowEvent(session_id=1, title_id=last.title_id, window_id=1,
+                                       time_start=last.time_end + datetime.timedelta(seconds=i),
+                                       time_end=last.time_end + datetime.timedelta(seconds=i + 1)) for i in range(30))
+        ses.commit()
+        timed("the last week, 30 events untagged", lambda: tagging.tagged_events(ses, rules, week))
+        timed("tagging 30 new events", lambda: tagging.update(ses, rules))
+        ses.close()
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
@@ -0,0 +1,100 @@
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from timetracker.archive import Archive, archive_months, archive_path, load_events, start_of_recent_days
+from timetracker.models import EventClass, SessionObject, WindowClass, WindowEvent, create_tables
+from timetracker.report import ClassMatcher, NameTagger, process_events
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        self.ses = sessionmaker(bind=engine)()
+        self.session = SessionObject(id=1)
+        self.kitty = WindowClass(name='kitty')
+        self.firefox = WindowClass(name='firefox')
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add(self, start, name, classes, keys=3):
+        self.ses.add(WindowEvent(window_name=name, window_id=7, time_start=start,
+                                 time_end=start + datetime.timedelta(seconds=90, microseconds=5),
+                                 keystrokes=keys, mouse_motion=1.5, session=self.session, classes=classes))
+
+    def fill(self):
+        for day in [datetime.date(2021, 1, 30), datetime.date(2021, 2, 3), datetime.date(2021, 3, 1)]:
+            start = datetime.datetime.combine(day, datetime.time(9))
+            self.add(start, 'vim — notes', [self.kitty])
+            self.add(start + datetime.timedelta(hours=1), 'Ωmega', [self.kitty, self.firefox], keys=0)
+            self.add(start + datetime.timedelta(hours=2), 'untitled', [])
+        self.ses.commit()
+
+    def summary(self, events):
+        return [(e.window_name, e.window_id, e.time_start, e.time_end, e.keystrokes, e.mouse_motion,
+                 sorted(c.name for c in e.classes)) for e in events]
+
+    def test_round_trip(self):
+        self.fill()
+        expected = self.summary(self.ses.query(WindowEvent).order_by(WindowEvent.time_start))
+        self.assertEqual(archive_months(self.ses, datetime.date(2021, 3, 15), self.path), 6)
+        self.assertEqual(sorted(i.name for i in self.path.iterdir()), ['2021-01.tta', '2021-02.tta'])
+        self.assertEqual(self.ses.query(WindowEvent).count(), 3)
+        self.assertEqual(self.ses.query(EventClass).count(), 3)
+        events = load_events(self.ses, directory=self.path)
+        self.assertEqual(self.summary(events), expected)
+        with Archive(archive_path(self.path, datetime.date(2021, 2, 1))) as archive:
+            self.assertEqual(len(archive), 3)
+            self.assertEqual(archive[1].duration(), datetime.timedelta(seconds=90, microseconds=5))
+            self.assertEqual(archive[0].date_of, (2021, 2, 3))
+        tags = process_events([NameTagger('vim', ['editing']), ClassMatcher('firefox', ['web'])], events)
+        self.assertEqual([t for _, t in tags[:3]], [['editing'], ['web'], ['unlabelled']])
+
+    def test_load_from(self):
+        self.fill()
+        archive_months(self.ses, datetime.date(2021, 3, 1), self.path)
+        events = load_events(self.ses, datetime.datetime(2021, 2, 3, 10), self.path)
+        self.assertEqual([e.window_name for e in events], ['Ωmega', 'untitled', 'vim — notes', 'Ωmega', 'untitled'])
+        self.assertEqual(start_of_recent_days(self.ses, 2, self.path), datetime.datetime(2021, 2, 3))
+        self.assertIsNone(start_of_recent_days(self.ses, 3, self.path))
+
+    def test_untitled_event(self):
+        # Events of windows that never had a title are written without one
+        self.ses.add(WindowEvent(window_id=7, time_start=datetime.datetime(2021, 1, 5, 9),
+                                 time_end=datetime.datetime(2021, 1, 5, 10), session=self.session))
+        self.ses.commit()
+        self.assertIsNone(self.ses.query(WindowEvent).one().title_id)
+        self.assertEqual(archive_months(self.ses, datetime.date(2021, 3, 1), self.path), 1)
+        events = load_events(self.ses, directory=self.path)
+        self.assertEqual([(e.window_name, e.duration()) for e in events], [('', datetime.timedelta(hours=1))])
+
+    def test_rearchive(self):
+        self.fill()
+        archive_months(self.ses, datetime.date(2021, 3, 1), self.path)
+        kept = self.ses.query(WindowEvent).order_by(WindowEvent.time_start).first().id
+        # An event written late into a month that was archived already, and one left behind by an interrupted archive
+        self.add(datetime.datetime(2021, 2, 20), 'late', [self.firefox])
+        with Archive(archive_path(self.path, datetime.date(2021, 1, 1))) as archive:
+            interrupted = archive[0]
+            self.ses.add(WindowEvent(id=interrupted.id, title_id=interrupted.title_id, time_start=interrupted.time_start,
+                                     time_end=interrupted.time_end, session=self.session))
+        self.ses.commit()
+        self.assertEqual(archive_months(self.ses, datetime.date(2021, 3, 1), self.path), 2)
+        with Archive(archive_path(self.path, datetime.date(2021, 2, 1))) as archive:
+            self.assertEqual([e.window_name for e in archive], ['vim — notes', 'Ωmega', 'untitled', 'late'])
+        with Archive(archive_path(self.path, datetime.date(2021, 1, 1))) as archive:
+            self.assertEqual(len(archive), 3)
+        self.assertEqual(self.ses.query(WindowEvent).count(), 3)
+        self.assertEqual(self.ses.query(WindowEvent).order_by(WindowEvent.time_start).first().id, kept)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import os
+import stat
+import sys
+import tempfile
+import time
+import unittest
+from collections import deque
+from types import SimpleNamespace
+
+from timetracker.focus import FocusWatcher, XpropWatcher, parse_xprop
+
+PROPERTY_NOTIFY = 28
+
+
+class FakeProperty:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeWindow:
+    """
+    Just enough of an Xlib window for the watcher.
+    """
+
+    def __init__(self, display, window_id, name=b'', classes=()):
+        self.display = display
+        self.id = window_id
+        self.properties = {display.intern_atom('_NET_WM_NAME'): name}
+        self.classes = classes
+        self.event_mask = 0
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return self.id
+
+    def change_attributes(self, event_mask):
+        self.event_mask = event_mask
+
+    def get_full_property(self, atom, kind):
+        value = self.properties.get(atom)
+        return FakeProperty(value) if value is not None else None
+
+    def get_wm_class(self):
+        return self.classes
+
+
+class FakeDisplay:
+    """
+    A headless X display whose events and windows are set up by the test.
+    """
+
+    def __init__(self):
+        self.atoms = {}
+        self.windows = {}
+        self.events = deque()
+        self.root = FakeWindow(self, 1)
+
+    def intern_atom(self, name):
+        return self.atoms.setdefault(name, len(self.atoms) + 1)
+
+    def screen(self):
+        return SimpleNamespace(root=self.root)
+
+    def create_resource_object(self, kind, window_id):
+        return self.windows[window_id]
+
+    def pending_events(self):
+        return len(self.events)
+
+    def next_event(self):
+        return self.events.popleft()
+
+    def add_window(self, window_id, name, classes):
+        self.windows[window_id] = FakeWindow(self, window_id, name, classes)
+        return self.windows[window_id]
+
+    def focus(self, window_id):
+        self.root.properties[self.intern_atom('_NET_ACTIVE_WINDOW')] = [window_id]
+        self.notify(self.root, '_NET_ACTIVE_WINDOW')
+
+    def notify(self, window, atom):
+        self.events.append(SimpleNamespace(type=PROPERTY_NOTIFY, window=window, atom=self.intern_atom(atom)))
+
+
+class FocusWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.display = FakeDisplay()
+        self.terminal = self.display.add_window(10, b'vim', ('kitty', 'kitty'))
+        self.browser = self.display.add_window(20, b'Mozilla Firefox', ('Navigator', 'firefox'))
+        self.display.focus(10)
+        self.watcher = FocusWatcher(self.display)
+        self.display.events.clear()
+
+    def test_initial_state(self):
+        self.assertEqual(self.watcher.state.window_id, 10)
+        self.assertEqual(self.watcher.state.window_name, 'vim')
+        self.assertEqual(self.watcher.state.classes, frozenset(['kitty']))
+
+    def test_focus_change(self):
+        self.display.focus(20)
+        self.watcher.pump()
+        self.assertEqual(self.watcher.state.window_name, 'Mozilla Firefox')
+        self.assertEqual(self.terminal.event_mask, 0)
+        self.assertNotEqual(self.browser.event_mask, 0)
+
+    def test_title_change(self):
+        before = self.watcher.state.since
+        self.terminal.properties[self.display.intern_atom('_NET_WM_NAME')] = b'emacs'
+        self.display.notify(self.terminal, '_NET_WM_NAME')
+        self.display.notify(self.browser, '_NET_WM_NAME')
+        self.watcher.pump()
+        self.assertEqual(self.watcher.state.window_name, 'emacs')
+        self.assertGreaterEqual(self.watcher.state.since, before)
+        self.assertEqual(self.display.pending_events(), 0)
+
+
+XPROP_STUB = """#!{python}
+import sys, time
+with open({log!r}, 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n')
+def say(*lines):
+    for line in lines:
+        print(line, flush=True)
+if '-root' in sys.argv:
+    say('_NET_ACTIVE_WINDOW(WINDOW): window id # 0x10')
+    time.sleep(0.2)
+    say('_NET_ACTIVE_WINDOW(WINDOW): window id # 0x20')
+elif '0x10' in sys.argv:
+    say('_NET_WM_NAME(UTF8_STRING) = "vim"', 'WM_NAME:  not found.', 'WM_CLASS(STRING) = "kitty", "kitty"')
+else:
+    say('_NET_WM_NAME:  not found.', 'WM_NAME(STRING) = "Mozilla \\\\"Firefox\\\\""',
+        'WM_CLASS(STRING) = "Navigator", "firefox"')
+    time.sleep(0.1)
+    say('WM_NAME(STRING) = "Mozilla Firefox - tab"')
+time.sleep(60)
+"""
+
+
+class XpropWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.dir.name, 'calls')
+        self.xprop = os.path.join(self.dir.name, 'xprop')
+        with open(self.xprop, 'w') as f:
+            f.write(XPROP_STUB.format(python=sys.executable, log=self.log))
+        os.chmod(self.xprop, stat.S_IRWXU)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def wait_for(self, watcher, name):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if watcher.state is not None and watcher.state.window_name == name:
+                return watcher.state
+            time.sleep(0.01)
+        self.fail(f"{name} never showed up, last state was {watcher.state}")
+
+    def test_parse(self):
+        self.assertEqual(parse_xprop('WM_CLASS(STRING) = "kitty", "kitty"'), ('WM_CLASS', ['kitty', 'kitty']))
+        self.assertEqual(parse_xprop('_NET_WM_NAME:  not found.'), ('_NET_WM_NAME', []))
+        self.assertEqual(parse_xprop('_NET_ACTIVE_WINDOW(WINDOW): window id # 0x3a00007'),
+                         ('_NET_ACTIVE_WINDOW', ['0x3a00007']))
+
+    def test_follows_focus_and_titles(self):
+        watcher = XpropWatcher(self.xprop)
+        watcher.start()
+        try:
+            state = self.wait_for(watcher, 'Mozilla "Firefox"')
+            self.assertEqual(state.window_id, 0x20)
+            self.assertEqual(state.classes, frozenset(['Navigator', 'firefox']))
+            self.wait_for(watcher, 'Mozilla Firefox - tab')
+        finally:
+            watcher.close()
+        with open(self.log) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from timetracker.inputs import Accumulator
+
+
+class AccumulatorTest(unittest.TestCase):
+    def test_totals(self):
+        a = Accumulator(capacity=2)
+        # Spread over more than one buffer's worth, so that the partial reductions are added up too
+        a.add_motion(3, 4, 0.0)
+        a.add_motion(3, 4, 0.01)
+        a.add_motion(0, 1, 0.02)
+        a.add_motion(0, 1, 1.02)
+        a.add_keys(2)
+        activity = a.take()
+        self.assertAlmostEqual(activity.motion, 12)
+        self.assertEqual(activity.keys, 2)
+        self.assertAlmostEqual(activity.peak_speed, 500)
+        self.assertAlmostEqual(activity.active_seconds, 0.02)
+
+    def test_take_resets(self):
+        a = Accumulator()
+        a.add_motion(3, 4, 0.0)
+        a.add_keys(1)
+        a.take()
+        a.add_motion(0, 1, 0.1)
+        activity = a.take()
+        self.assertEqual((activity.motion, activity.keys), (1, 0))
+        self.assertAlmostEqual(activity.active_seconds, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
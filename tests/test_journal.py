@@ -0,0 +1,95 @@
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+
+from timetracker.journal import JournalWriter, read_segment, segment_path
+from timetracker.models import JournalSegment, WindowEvent
+from timetracker.writer import Sample
+from tests.test_writer import memory_session
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.dir.name)
+        self.factory = memory_session()
+        self.now = datetime.datetime(2021, 1, 1, 12)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def writer(self, **kwargs):
+        writer = JournalWriter(self.path, self.factory, flush_interval=60, flush_size=100, session_id=7, **kwargs)
+        writer.start()
+        return writer
+
+    def sample(self, name, start, end, **kwargs):
+        return Sample(name, 1, ['kitty'], self.now + datetime.timedelta(seconds=start),
+                      self.now + datetime.timedelta(seconds=end), **kwargs)
+
+    def events(self):
+        return self.factory().query(WindowEvent).order_by(WindowEvent.time_start).all()
+
+    def test_compacted_on_close(self):
+        writer = self.writer()
+        a = self.sample('a', 0, 4)
+        writer.submit(a)
+        a.time_end += datetime.timedelta(seconds=4)
+        a.keystrokes = 3
+        writer.submit(a)
+        writer.submit(self.sample('b', 8, 12, mouse_motion=2.5))
+        writer.close()
+        events = self.events()
+        self.assertEqual([(e.window_name, e.duration().total_seconds()) for e in events], [('a', 8), ('b', 4)])
+        self.assertEqual((events[0].keystrokes, events[1].mouse_motion), (3, 2.5))
+        self.assertEqual(events[0].session_id, 7)
+        self.assertEqual(list(self.path.iterdir()), [])
+
+    def test_runs_are_merged_across_segments(self):
+        # Every batch fills a segment, so each of these ends up in its own one
+        writer = self.writer(segment_size=1)
+        for i in range(3):
+            writer.submit(self.sample('a', 4 * i, 4 * i + 4, keystrokes=1))
+            writer.flush()
+        writer.close()
+        events = self.events()
+        self.assertEqual(len(events), 1)
+        self.assertEqual((events[0].duration().total_seconds(), events[0].keystrokes), (12, 3))
+        self.assertEqual(self.factory().query(JournalSegment).count(), 3)
+
+    def test_sample_spanning_segments(self):
+        writer = self.writer(segment_size=1)
+        a = self.sample('a', 0, 4, keystrokes=10, mouse_motion=1.5)
+        writer.submit(a)
+        writer.flush()
+        # The same sample goes on into the next segment with its running totals
+        a.time_end += datetime.timedelta(seconds=4)
+        a.keystrokes, a.mouse_motion = 20, 4.0
+        writer.submit(a)
+        writer.flush()
+        writer.submit(self.sample('a', 9, 10, keystrokes=1))
+        writer.close()
+        events = self.events()
+        self.assertEqual(len(events), 1)
+        self.assertEqual((events[0].duration().total_seconds(), events[0].keystrokes, events[0].mouse_motion),
+                         (10, 21, 4.0))
+
+    def test_recovers_torn_segment(self):
+        writer = self.writer()
+        writer.submit(self.sample('a', 0, 4))
+        writer.submit(self.sample('b', 4, 8))
+        writer.flush()
+        data = segment_path(self.path, 1).read_bytes()
+        writer.close()
+        # Pretend the tracker died halfway through writing its last record, and start again on a fresh database
+        segment_path(self.path, 1).write_bytes(data[:-5])
+        self.assertEqual([i.window_name for i in read_segment(segment_path(self.path, 1))[1]], ['a'])
+        self.factory = memory_session()
+        self.writer().close()
+        self.assertEqual([e.window_name for e in self.events()], ['a'])
+        self.assertEqual(list(self.path.iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
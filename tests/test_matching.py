@@ -0,0 +1,182 @@
+import os
+import pickle
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from typing import NamedTuple
+
+from timetracker.archive import ArchivedClass
+from timetracker.matching import Automaton, CompiledMatchers, TagCache, compiled, fingerprint, in_parallel
+from timetracker.report import AndMatcher, ClassMatcher, NameTagger, NotMatcher, OrMatcher, _ask_each, from_json, \
+    process_events
+
+
+class Event(NamedTuple):
+    window_name: str
+    classes: list
+
+
+def event(name, *classes):
+    return Event(name, [ArchivedClass(i, c) for i, c in enumerate(classes)])
+
+
+class AutomatonTest(unittest.TestCase):
+    def test_finds_every_needle(self):
+        rng = random.Random(3)
+        for _ in range(200):
+            needles = {''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 8))}
+            bits = {n: 1 << i for i, n in enumerate(needles)}
+            text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 20)))
+            expected = 0
+            for n, b in bits.items():
+                if n in text:
+                    expected |= b
+            self.assertEqual(Automaton(bits).search(text), expected, (needles, text))
+
+    def test_empty_needle(self):
+        self.assertEqual(Automaton({'': 1, 'x': 2}).search('abc'), 1)
+
+
+class CompiledMatchersTest(unittest.TestCase):
+    matchers = [
+        NameTagger('vim', ['editing']),
+        NameTagger(['Firefox', re.compile(r'.*mozilla')], ['browser']),
+        NameTagger('README', ['docs'], case_sensitive=True),
+        NameTagger(re.compile(r'(\w+) - \1'), ['repeated']),
+        NameTagger(re.compile('IRC', re.IGNORECASE), ['chat']),
+        ClassMatcher('kitty', ['terminal']),
+        ClassMatcher(re.compile('Code'), None),
+        OrMatcher([NameTagger('.py', ['python']), ClassMatcher(re.compile('jet'), ['ide'])], ['programming']),
+        AndMatcher([NameTagger('pytest', ['tests']), ClassMatcher('kitty', ['terminal'])], ['testing']),
+        NotMatcher([NameTagger('vim', [])], ['not vim']),
+        AndMatcher([NotMatcher([ClassMatcher('firefox', [])], []), OrMatcher([NameTagger('a', ['a'])], [])], ['and']),
+    ]
+    events = [event('vim — notes.py', 'kitty'), event('Mozilla Firefox', 'firefox'), event('README.md', 'Code'),
+              event('readme', 'code'), event('foo - foo', 'jetbrains'), event('pytest -x', 'kitty', 'xterm'),
+              event('irc chat'), event(None), event('', 'a')]
+
+    def test_same_tags_as_each_matcher(self):
+        compiled = CompiledMatchers(self.matchers)
+        expected = _ask_each(self.matchers, [e._replace(window_name=e.window_name or '') for e in self.events])
+        for e, (_, tags) in zip(self.events, expected):
+            self.assertEqual(compiled.tags(e), tags, e)
+            # Again, from the tags kept for the same matches
+            self.assertEqual(compiled.tags(e), tags, e)
+
+    def test_config(self):
+        matchers = [from_json({'type': 'or', 'tags': ['work'], 'matcher': [
+            {'type': 'name', 'matcher': ['jira', {'type': 'regex', 'value': 'confluence'}], 'tags': ['tickets']},
+            {'type': 'not', 'matcher': [{'type': 'class', 'matcher': ['steam'], 'tags': []}], 'tags': []}]}),
+            from_json({'type': 'class', 'matcher': ['steam'], 'tags': ['games']})]
+        events = [event('Jira board', 'firefox'), event('confluence page'), event('game', 'steam')]
+        self.assertEqual([tags for _, tags in process_events(matchers, events)],
+                         [['work', 'tickets'], ['work', 'tickets'], ['games']])
+        self.assertEqual(process_events(matchers, events), _ask_each(matchers, events))
+
+    def test_bits_dont_depend_on_shared_matchers(self):
+        vim = NameTagger('vim', ['editing'])
+        shared = [vim, NotMatcher([ClassMatcher('kitty', [])], ['gui']), vim]
+        separate = [NameTagger('vim', ['editing']), NotMatcher([ClassMatcher('kitty', [])], ['gui']),
+                    NameTagger('vim', ['editing'])]
+        self.assertEqual(fingerprint(shared), fingerprint(separate))
+        # As when a process tags titles with the matchers it was sent, for matchers compiled from the others
+        e = event('vim', 'emacs')
+        hits = CompiledMatchers(shared).hits(e)
+        self.assertEqual(CompiledMatchers(separate)._tags(hits), ['editing', 'gui', 'editing'])
+
+    def test_other_matchers_are_asked(self):
+        class Everything:
+            def matches(self, e):
+                return True, ['everything']
+
+        self.assertRaises(TypeError, CompiledMatchers, [Everything()])
+        self.assertEqual(process_events([Everything()], self.events[:1])[0][1], ['everything'])
+
+
+class TagCacheTest(unittest.TestCase):
+    def test_least_recently_used_are_discarded(self):
+        cache = TagCache(2)
+        cache.put(('a', frozenset()), ('x',))
+        cache.put(('b', frozenset()), ('y',))
+        self.assertEqual(cache.get(('a', frozenset())), ('x',))
+        cache.put(('c', frozenset()), ('z',))
+        self.assertIsNone(cache.get(('b', frozenset())))
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 1, 'size': 2, 'maxsize': 2})
+
+    def test_titles_are_tagged_once(self):
+        matchers = [NameTagger('vim', ['editing']), ClassMatcher('kitty', ['terminal'])]
+        c = compiled(matchers)
+        events = [event('vim', 'kitty'), event('vim', 'kitty'), event('vim'), event('vim', 'kitty')]
+        self.assertEqual([c.tags(e) for e in events], [['editing', 'terminal']] * 2 + [['editing']] +
+                         [['editing', 'terminal']])
+        self.assertEqual((c.titles.hits, c.titles.misses), (2, 2))
+        # The tags returned can be changed without changing the ones kept
+        c.tags(events[0]).append('changed')
+        self.assertEqual(c.tags(events[0]), ['editing', 'terminal'])
+
+    def test_alike_matchers_share_a_cache(self):
+        c = compiled([NameTagger(['vim', re.compile('x')], ['editing'])])
+        self.assertIs(compiled([NameTagger(['vim', re.compile('x')], ['editing'])]), c)
+        self.assertIsNot(compiled([NameTagger(['vim', re.compile('x')], ['editing'], case_sensitive=True)]), c)
+        self.assertNotEqual(fingerprint([NameTagger('vim', ['editing'])]),
+                            fingerprint([NameTagger('vim', ['edit'])]))
+        self.assertNotEqual(fingerprint([NameTagger('vim', ['editing'])]),
+                            fingerprint([ClassMatcher('vim', ['editing'])]))
+
+
+class InParallelTest(unittest.TestCase):
+    def test_same_tags_as_each_matcher(self):
+        matchers = CompiledMatchersTest.matchers
+        events = CompiledMatchersTest.events * 3
+        c = CompiledMatchers(matchers)
+        c.tags(events[0])
+        tagged = in_parallel(c, events, workers=2, threshold=0, chunk_size=2)
+        expected = _ask_each(matchers, [e._replace(window_name=e.window_name or '') for e in events])
+        self.assertEqual([tags for _, tags in tagged], [tags for _, tags in expected])
+        self.assertEqual([e for e, _ in tagged], events)
+        # The titles are kept for the next report, the first one was already tagged
+        self.assertEqual((len(c.titles), c.titles.hits), (len(CompiledMatchersTest.events), 1))
+
+    def test_few_titles_are_tagged_here(self):
+        c = CompiledMatchers(CompiledMatchersTest.matchers)
+        events = CompiledMatchersTest.events
+        self.assertEqual(in_parallel(c, events, workers=2), [(e, c.tags(e)) for e in events])
+
+    def test_processes_dont_open_the_database(self):
+        # What a spawned process imports to tag titles, unpickling the matchers it is sent
+        script = ('import pickle, sys, timetracker.matching; '
+                  f'pickle.loads({pickle.dumps(CompiledMatchersTest.matchers)!r}); '
+                  'print("timetracker.models" in sys.modules)')
+        r = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+        self.assertEqual(r.stdout, 'False\n')
+
+    def test_workers_of_the_report_server_dont_open_the_database(self):
+        # Spawned processes run the main module again, here one that imports what the report server does
+        script = textwrap.dedent('''
+            import sys
+            import timetracker.examplereport
+            from timetracker.matching import _processes
+
+            def engine_made():
+                models = sys.modules.get('timetracker.models')
+                return models is not None and models._engine is not None
+
+            if __name__ == '__main__':
+                print(_processes(1).submit(engine_made).result())
+        ''')
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'server.py')
+            with open(path, 'w') as f:
+                f.write(script)
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            r = subprocess.run([sys.executable, path], capture_output=True, text=True, check=True,
+                               env={**os.environ, 'PYTHONPATH': root})
+        self.assertEqual(r.stdout, 'False\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from timetracker.models import EventClass, SessionObject, WindowClass, WindowEvent, create_tables
+
+
+class MergeWithinTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        self.ses = sessionmaker(bind=engine)()
+        self.session = SessionObject(id=1)
+        self.kitty = WindowClass(name='kitty')
+        self.t = datetime.datetime(2021, 1, 1, 9)
+
+    def add(self, name, seconds, gap=0, keys=1):
+        self.t += datetime.timedelta(seconds=gap)
+        end = self.t + datetime.timedelta(seconds=seconds)
+        self.ses.add(WindowEvent(window_name=name, time_start=self.t, time_end=end, keystrokes=keys,
+                                 session=self.session, classes=[self.kitty]))
+        self.t = end
+
+    def events(self):
+        return [(e.window_name, e.duration().total_seconds(), e.keystrokes)
+                for e in self.ses.query(WindowEvent).order_by(WindowEvent.time_start)]
+
+    def test_merge(self):
+        for name, seconds, gap in [('a', 4, 0), ('a', 4, 2), ('a', 4, 30), ('b', 4, 0), ('b', 4, 0), ('a', 4, 0)]:
+            self.add(name, seconds, gap)
+        self.ses.commit()
+        self.assertEqual(WindowEvent.merge_within(self.ses, 10, chunk_size=2), 2)
+        self.ses.expire_all()
+        self.assertEqual(self.events(), [('a', 10, 2), ('a', 4, 1), ('b', 8, 2), ('a', 4, 1)])
+        self.assertEqual(self.ses.query(EventClass).count(), 4)
+
+    def test_incremental(self):
+        for _ in range(3):
+            self.add('a', 4)
+        self.ses.commit()
+        self.assertEqual(WindowEvent.merge_within(self.ses, 10), 2)
+        # Later events continue the last one the previous merge saw
+        for _ in range(2):
+            self.add('a', 4)
+        self.add('b', 4, 60)
+        self.ses.commit()
+        self.assertEqual(WindowEvent.merge_within(self.ses, 10, until=self.t - datetime.timedelta(seconds=10)), 2)
+        self.ses.expire_all()
+        self.assertEqual(self.events(), [('a', 20, 5), ('b', 4, 1)])
+        self.assertEqual(WindowEvent.merge_within(self.ses, 10), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
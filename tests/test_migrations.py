@@ -0,0 +1,58 @@
+import datetime
+import unittest
+
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from timetracker.migrations import MIGRATIONS, migrate, version
+from timetracker.models import SessionObject, WindowEvent, WindowTitle
+
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+
+    def test_old_database(self):
+        # The tables as the first versions of the tracker created them
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('CREATE TABLE "Session" (id INTEGER PRIMARY KEY, date DATETIME)')
+            connection.exec_driver_sql('CREATE TABLE "WindowEvent" (id INTEGER PRIMARY KEY, '
+                                       'session_id INTEGER NOT NULL, window_name VARCHAR, window_id INTEGER, time_start DATETIME, '
+                                       'time_end DATETIME, mouse_motion FLOAT, keystrokes INTEGER)')
+            connection.exec_driver_sql('INSERT INTO "Session" VALUES (1, "2021-01-01 09:00:00.000000")')
+            for n, name in enumerate(['a', 'b', 'a']):
+                connection.exec_driver_sql(f'INSERT INTO "WindowEvent" (session_id, window_name, time_start, time_end) '
+                                           f'VALUES (1, "{name}", "2021-01-01 09:0{n}:00.000000", '
+                                           f'"2021-01-01 09:0{n}:30.000000")')
+        self.assertEqual(migrate(self.engine, verbose=False), len(MIGRATIONS))
+        inspector = sqlalchemy.inspect(self.engine)
+        self.assertIn('ix_WindowEvent_time', {i['name'] for i in inspector.get_indexes('WindowEvent')})
+        self.assertNotIn('window_name', {i['name'] for i in inspector.get_columns('WindowEvent')})
+        ses = sessionmaker(bind=self.engine)()
+        self.assertEqual(ses.get(SessionObject, 1).date, datetime.datetime(2021, 1, 1, 9))
+        ses.get(SessionObject, 1).samples = 3
+        self.assertEqual([e.window_name for e in ses.query(WindowEvent).order_by(WindowEvent.id)], ['a', 'b', 'a'])
+        self.assertEqual(ses.query(WindowTitle).count(), 2)
+        ses.commit()
+        self.assertEqual(migrate(self.engine, verbose=False), 0)
+
+    def test_new_database(self):
+        self.assertEqual(migrate(self.engine, verbose=False), 0)
+        with self.engine.begin() as connection:
+            self.assertEqual(version(connection), len(MIGRATIONS))
+
+    def test_recent_days(self):
+        migrate(self.engine, verbose=False)
+        ses = sessionmaker(bind=self.engine)()
+        session = SessionObject(id=1)
+        for day, hour in [(1, 9), (1, 17), (3, 12), (4, 8), (4, 20)]:
+            start = datetime.datetime(2021, 1, day, hour)
+            ses.add(WindowEvent(window_name='a', time_start=start, time_end=start, session=session))
+        ses.commit()
+        self.assertEqual(WindowEvent.start_of_recent_days(ses, 2), datetime.datetime(2021, 1, 3))
+        self.assertIsNone(WindowEvent.start_of_recent_days(ses, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import datetime
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import sqlalchemy.exc
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from timetracker.models import SessionObject, WindowEvent, create_tables, database_url, derive_key, pragmas, \
+    use_profile
+
+
+class ProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.url = f"sqlite:///{os.path.join(self.directory.name, 'test.db')}"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def engines(self, profile: bool):
+        writer, reader = create_engine(self.url), create_engine(self.url)
+        if profile:
+            use_profile(writer, 'tracker')
+            use_profile(reader, 'report')
+        create_tables(writer)
+        with writer.begin() as connection:
+            connection.execute(SessionObject.__table__.insert(), [{'id': 1}])
+            connection.execute(WindowEvent.__table__.insert(), [
+                {'session_id': 1, 'time_start': datetime.datetime(2021, 1, 1, 9, n),
+                 'time_end': datetime.datetime(2021, 1, 1, 9, n + 1)} for n in range(50)])
+        return writer, reader
+
+    def write_while_reading(self, writer, reader) -> float:
+        """
+        Commit an event while the reader is part way through reading all of them.
+
+        :return: How long the commit took
+        """
+        reading = reader.raw_connection()
+        cursor = reading.cursor()
+        cursor.execute('SELECT * FROM "WindowEvent"')
+        cursor.fetchone()
+        try:
+            start = time.perf_counter()
+            with writer.begin() as connection:
+                connection.exec_driver_sql('PRAGMA busy_timeout = 200')
+                connection.execute(WindowEvent.__table__.insert(), {'session_id': 1,
+                                                                    'time_start': datetime.datetime(2021, 1, 2),
+                                                                    'time_end': datetime.datetime(2021, 1, 2, 0, 1)})
+            return time.perf_counter() - start
+        finally:
+            cursor.close()
+            reading.close()
+
+    def test_pragmas(self):
+        writer, reader = self.engines(True)
+        with reader.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+            self.assertEqual(connection.exec_driver_sql('PRAGMA cache_size').scalar(),
+                             pragmas('report')['cache_size'])
+            self.assertEqual(connection.exec_driver_sql('PRAGMA synchronous').scalar(), 1)
+
+    def test_readers_stall_writers_without_wal(self):
+        writer, reader = self.engines(False)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            self.write_while_reading(writer, reader)
+
+    def test_readers_do_not_stall_writers(self):
+        writer, reader = self.engines(True)
+        self.assertLess(self.write_while_reading(writer, reader), 0.1)
+        results = []
+        reads = [threading.Thread(target=lambda: results.append(self.write_while_reading(writer, reader)))
+                 for _ in range(4)]
+        for i in reads:
+            i.start()
+        for i in reads:
+            i.join()
+        self.assertEqual(len(results), 4)
+        with reader.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('SELECT count(*) FROM "WindowEvent"').scalar(), 55)
+
+
+class DatabaseUrlTest(unittest.TestCase):
+    def url(self, **environment):
+        with mock.patch.dict(os.environ, environment, clear=True):
+            return database_url(True, 'missing.db')
+
+    def test_plain(self):
+        url, options = database_url(False, 'timetracker.db')
+        self.assertEqual(str(url), 'sqlite:///timetracker.db')
+        # Connections stay on the thread that opened them
+        self.assertIs(options['poolclass'], NullPool)
+        self.assertEqual(self.url()[0].password, None)
+
+    def test_passphrase(self):
+        url, options = self.url(TIMETRACKER_PASSWORD='secret', TIMETRACKER_KDF='1000')
+        self.assertEqual((url.drivername, url.password, url.database), ('sqlite+pysqlcipher', 'secret', 'missing.db'))
+        self.assertEqual(dict(url.query), {'cipher': 'aes-256', 'kdf_iter': '1000'})
+        self.assertIs(options['poolclass'], NullPool)
+
+    def test_raw_key(self):
+        url, options = self.url(TIMETRACKER_RAW_KEY='ab' * 32)
+        self.assertEqual(url.password, "x'" + 'ab' * 32 + "'")
+        self.assertIs(options['poolclass'], NullPool)
+
+    def test_no_database_to_derive_from(self):
+        self.assertIsNone(derive_key('secret', 'missing.db', 64000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from timetracker import rollup
+from timetracker.archive import archive_months
+from timetracker.models import SessionObject, WindowClass, WindowEvent, create_tables
+from timetracker.report import NameTagger
+
+
+class RollupTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        self.ses = sessionmaker(bind=engine)()
+        self.session = SessionObject(id=1)
+        self.kitty = WindowClass(name='kitty')
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        self.matchers = [NameTagger('vim', ['editing'])]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add(self, start, minutes, name='vim', keys=1):
+        self.ses.add(WindowEvent(window_name=name, time_start=start, time_end=start + datetime.timedelta(minutes=minutes),
+                                 keystrokes=keys, mouse_motion=0.5, session=self.session, classes=[self.kitty]))
+        self.ses.commit()
+
+    def update(self, until=None):
+        return rollup.update(self.ses, self.matchers, until, directory=self.path)
+
+    def totals(self, kind='tag', period='hour'):
+        return [(i.bucket, i.key, i.duration.total_seconds() / 60, i.keystrokes, i.events)
+                for i in rollup.totals(self.ses, kind, period)]
+
+    def test_incremental(self):
+        nine = datetime.datetime(2021, 1, 1, 9)
+        self.add(nine + datetime.timedelta(minutes=50), 20, keys=4)
+        self.add(nine + datetime.timedelta(hours=1, minutes=30), 10, name='firefox')
+        # The latest event may still grow
+        self.assertEqual(self.update(), 1)
+        self.assertEqual(self.totals(), [(nine, 'editing', 10, 4, 1), (nine.replace(hour=10), 'editing', 10, 0, 0)])
+        self.add(nine + datetime.timedelta(hours=2), 5)
+        self.assertEqual(self.update(), 1)
+        self.assertEqual(self.update(), 0)
+        self.assertEqual(self.totals(period='day'), [(nine.replace(hour=0), 'editing', 20, 4, 1),
+                                                     (nine.replace(hour=0), 'unlabelled', 10, 1, 1)])
+        self.assertEqual(self.totals('class', 'month'), [(nine.replace(hour=0), 'kitty', 30, 5, 2)])
+        self.assertEqual(self.totals('class', 'year'), [(nine.replace(hour=0), 'kitty', 30, 5, 2)])
+
+    def test_matchers_changed(self):
+        nine = datetime.datetime(2021, 1, 1, 9)
+        for i in range(3):
+            self.add(nine + datetime.timedelta(hours=i), 10)
+        self.update()
+        self.matchers = [NameTagger('vim', ['vim'])]
+        self.assertEqual(self.update(), 2)
+        self.assertEqual([i[1] for i in self.totals(period='month')], ['vim'])
+        self.assertEqual(self.totals('class', 'month'), [(nine.replace(hour=0), 'kitty', 20, 2, 2)])
+
+    def test_invalidate(self):
+        start = datetime.datetime(2021, 1, 31, 23, 50)
+        self.add(start, 20, name='firefox')
+        self.add(start + datetime.timedelta(days=1), 10)
+        self.add(start + datetime.timedelta(days=2), 10)
+        self.update()
+        WindowEvent.merge_within(self.ses, 86400 * 2)
+        rollup.invalidate(self.ses, start + datetime.timedelta(days=1))
+        self.assertEqual(self.update(datetime.datetime(2021, 3, 1)), 1)
+        self.assertEqual(self.totals('tag', 'month'), [(datetime.datetime(2021, 1, 1), 'unlabelled', 10, 1, 1),
+                                                       (datetime.datetime(2021, 2, 1), 'editing', 1450, 2, 1),
+                                                       (datetime.datetime(2021, 2, 1), 'unlabelled', 10, 0, 0)])
+
+    def test_archived(self):
+        self.add(datetime.datetime(2021, 1, 5), 10)
+        self.add(datetime.datetime(2021, 2, 5), 10)
+        self.add(datetime.datetime(2021, 3, 5), 10)
+        archive_months(self.ses, datetime.date(2021, 3, 1), self.path)
+        self.assertEqual(self.update(), 2)
+        self.assertEqual([i[2] for i in self.totals(period='year')], [20])
+
+
+if __name__ == '__main__':
+    unittest.main()
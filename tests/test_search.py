@@ -0,0 +1,59 @@
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from timetracker.models import SessionObject, WindowEvent, create_tables
+from timetracker.search import fts_query, index_exists, search_titles
+
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        self.ses = sessionmaker(bind=engine)()
+        self.session = SessionObject(id=1)
+        self.start = datetime.datetime(2021, 3, 1, 9)
+
+    def add(self, name, day, minute, minutes=1):
+        start = self.start + datetime.timedelta(days=day, minutes=minute)
+        self.ses.add(WindowEvent(window_name=name, window_id=1, time_start=start,
+                                 time_end=start + datetime.timedelta(minutes=minutes), session=self.session))
+
+    def test_query_quotes_words(self):
+        self.assertEqual(fts_query('models.py  ABC-1*'), '"models.py" "ABC-1"*')
+
+    def test_days_and_ranges(self):
+        self.assertTrue(index_exists(self.ses))
+        self.add('models.py - Emacs', 0, 0)
+        self.add('models.py - Emacs', 0, 1)
+        self.add('Reddit — Mozilla Firefox', 0, 2)
+        self.add('models.py - Emacs', 0, 3, 2)
+        self.add('tracker.py - Emacs', 1, 0)
+        self.add('models.py - Emacs', 2, 0, 5)
+        self.ses.commit()
+        days = search_titles(self.ses, 'models.py')
+        self.assertEqual([i.day for i in days], [datetime.date(2021, 3, 3), datetime.date(2021, 3, 1)])
+        first = days[1]
+        self.assertEqual(first.total, datetime.timedelta(minutes=4))
+        self.assertEqual([(i.time_start.minute, i.time_end.minute) for i in first.ranges], [(0, 2), (3, 5)])
+        self.assertEqual([i.day for i in search_titles(self.ses, 'models.py', page=1, per_page=1)],
+                         [datetime.date(2021, 3, 1)])
+        self.assertEqual(search_titles(self.ses, 'pycharm'), [])
+
+    def test_index_follows_changes(self):
+        self.add('notes.org - Emacs', 0, 0)
+        self.ses.commit()
+        event = self.ses.query(WindowEvent).one()
+        event.window_name = 'todo.org - Emacs'
+        self.ses.commit()
+        self.assertEqual(search_titles(self.ses, 'notes'), [])
+        self.assertEqual(len(search_titles(self.ses, 'todo')), 1)
+        self.ses.delete(event)
+        self.ses.commit()
+        self.assertEqual(search_titles(self.ses, 'todo'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import datetime
+import gc
+import random
+import unittest
+
+from timetracker.models import WindowEvent
+from timetracker.writer import Sample, SampleWriter
+from tests.test_writer import memory_session
+
+_INTERVAL = 4
+_DAY = 24 * 3600 // _INTERVAL
+
+
+class SoakTest(unittest.TestCase):
+    def test_memory_is_flat_over_a_week(self):
+        """
+        Write a week of samples the way the tracker does, and check that the writer's memory doesn't grow after the
+        first day, by counting the objects that are alive.
+        """
+        factory = memory_session()
+        sessions = []
+        writer = SampleWriter(lambda: sessions.append(factory()) or sessions[-1], flush_interval=60, flush_size=8)
+        writer.start()
+        rng = random.Random(0)
+        now = datetime.datetime(2021, 1, 1)
+        step = datetime.timedelta(seconds=_INTERVAL)
+        sample = None
+        try:
+            for i in range(7 * _DAY):
+                if sample is None or rng.random() < 0.05:
+                    window = rng.randrange(200)
+                    sample = Sample(f'window {window}', window, [f'class {window % 20}'], now, now + step)
+                else:
+                    sample.time_end += step
+                sample.keystrokes += rng.randrange(10)
+                writer.submit(sample)
+                now += step
+                if i == _DAY:
+                    writer.flush()
+                    gc.collect()
+                    after_a_day = len(gc.get_objects())
+            writer.flush()
+            gc.collect()
+            after_a_week = len(gc.get_objects())
+        finally:
+            writer.close()
+        self.assertLessEqual(len(sessions[0].identity_map), 2 + 20)
+        self.assertLess(after_a_week - after_a_day, 1000)
+        self.assertGreater(factory().query(WindowEvent).count(), 7 * _DAY * 0.04)
+
+
+if __name__ == '__main__':
+    unittest.main()
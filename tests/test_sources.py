@@ -0,0 +1,96 @@
+import datetime
+import io
+import unittest
+
+from timetracker.models import WindowEvent
+from timetracker.sources import Focus, Keys, Motion, Recorder, Replayer, read_records, synthetic, write_records
+from timetracker.tracker import Tracker
+from timetracker.writer import SampleWriter
+from tests.test_writer import memory_session
+
+EPOCH = datetime.datetime(2021, 1, 1)
+
+
+class RecordingTest(unittest.TestCase):
+    def test_round_trip(self):
+        records = [Focus(0.0, 42, 'ünïcode — title', frozenset(['kitty', 'Kitty'])),
+                   Motion(0.5, 1.5, -2.0),
+                   Keys(1.0, 3)]
+        f = io.BytesIO()
+        self.assertEqual(write_records(f, records, EPOCH), 3)
+        f.seek(0)
+        epoch, read = read_records(f)
+        self.assertEqual(epoch, EPOCH)
+        self.assertEqual(list(read), records)
+
+    def test_recorder_uses_one_clock(self):
+        class Accumulator:
+            def add_motion(self, dx, dy, t):
+                pass
+
+            def add_keys(self, count):
+                pass
+
+        f = io.BytesIO()
+        epoch = datetime.datetime.now() - datetime.timedelta(days=1)
+        recorder = Recorder(f, Accumulator(), epoch)
+        recorder.focus(1, 'editor', frozenset(['emacs']), datetime.datetime.now())
+        # Motion is timed by the input library's own clock, which the recording doesn't use
+        recorder.add_motion(1.0, 2.0, 5.0)
+        recorder.add_keys(2)
+        f.seek(0)
+        _, read = read_records(f)
+        times = [i.t for i in read]
+        self.assertEqual(times, sorted(times))
+        self.assertLess(abs(times[0] - 86400), 60)
+        self.assertLess(times[-1] - times[0], 60)
+
+    def test_synthetic_is_reproducible(self):
+        a = list(synthetic(0.25, seed=3))
+        self.assertEqual(a, list(synthetic(0.25, seed=3)))
+        self.assertTrue(any(isinstance(i, Keys) for i in a))
+        self.assertTrue(any(isinstance(i, Motion) for i in a))
+        self.assertEqual([i.t for i in a], sorted(i.t for i in a))
+
+
+class ReplayTest(unittest.TestCase):
+    def test_replay(self):
+        factory = memory_session()
+        writer = SampleWriter(factory)
+        writer.start()
+        records = [Focus(0.0, 1, 'editor', frozenset(['emacs'])),
+                   *(Keys(i / 10, 1) for i in range(1, 100)),
+                   Focus(10.0, 2, 'browser', frozenset(['firefox'])),
+                   *(Motion(10 + i / 10, 3, 4) for i in range(1, 100)),
+                   # Long enough after the last input for the tracker to consider the user idle
+                   Keys(500.0, 1)]
+        replayer = Replayer(records)
+        tracker = Tracker(None, writer, replayer, sample_interval=4, idle_times=30, epoch=EPOCH, verbose=False)
+        self.assertEqual(replayer.replay(tracker), len(records))
+        writer.close()
+        events = factory().query(WindowEvent).order_by(WindowEvent.time_start).all()
+        self.assertEqual([e.window_name for e in events], ['editor', 'browser', 'browser'])
+        # Input is credited to the window focused when the sample is taken, the keys after 8 seconds go to the browser
+        self.assertEqual((events[0].keystrokes, events[1].keystrokes), (79, 20))
+        self.assertEqual(events[1].time_start, EPOCH + datetime.timedelta(seconds=10))
+        self.assertAlmostEqual(events[1].mouse_motion, 99 * 5, places=3)
+        self.assertEqual(events[2].time_start, EPOCH + datetime.timedelta(seconds=504))
+
+
+class TrackerTest(unittest.TestCase):
+    def test_samples_are_dated_by_the_wall_clock(self):
+        class Watcher:
+            state = 1, 'editor', {'emacs'}, None
+
+        tracker = Tracker(None, SampleWriter(memory_session()), Watcher(), verbose=False)
+        # As if the machine had been suspended for a day, which the monotonic clock doesn't count
+        tracker.epoch -= datetime.timedelta(days=1)
+        tracker.last_input = 100.0
+        before = datetime.datetime.now()
+        tracker.sample(101.0)
+        self.assertLessEqual(before, tracker.last.time_start)
+        self.assertLessEqual(tracker.last.time_start, datetime.datetime.now())
+
+
+if __name__ == '__main__':
+    unittest.main()
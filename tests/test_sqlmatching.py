@@ -0,0 +1,78 @@
+import datetime
+import re
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from timetracker.models import SessionObject, WindowClass, WindowEvent, create_tables
+from timetracker.report import AndMatcher, ClassMatcher, NameTagger, NotMatcher, OrMatcher, process_events
+from timetracker.sqlmatching import SqlMatchers, tag_totals, tagged_events
+
+
+class SqlMatchersTest(unittest.TestCase):
+    matchers = [
+        NameTagger('vim', ['editing']),
+        NameTagger(['Firefox', re.compile(r'.*mozilla')], ['browser']),
+        NameTagger('README', ['docs'], case_sensitive=True),
+        NameTagger('ωmega', ['greek']),
+        NameTagger(re.compile('IRC', re.IGNORECASE), ['chat']),
+        ClassMatcher('kitty', ['terminal']),
+        ClassMatcher(re.compile('Code'), None),
+        OrMatcher([NameTagger('.py', ['python']), ClassMatcher(re.compile('jet'), ['ide'])], ['programming']),
+        AndMatcher([NameTagger('pytest', ['tests']), ClassMatcher('kitty', ['terminal'])], ['testing']),
+        NotMatcher([NameTagger('vim', [])], ['not vim']),
+        AndMatcher([NotMatcher([ClassMatcher('firefox', [])], []), OrMatcher([NameTagger('a', ['a'])], [])], ['and']),
+        OrMatcher([], ['never']),
+    ]
+    events = [('vim — notes.py', ['kitty']), ('Mozilla Firefox', ['firefox']), ('README.md', ['Code']),
+              ('readme', ['code']), ('ΩMEGA', []), ('foo', ['jetbrains']), ('pytest -x', ['kitty', 'xterm']),
+              ('irc chat', []), (None, []), ('', ['a'])]
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        self.ses = sessionmaker(bind=engine)()
+        session, classes = SessionObject(id=1), {}
+        start = datetime.datetime(2021, 1, 1, 9)
+        for n, (name, names) in enumerate(self.events):
+            self.ses.add(WindowEvent(window_name=name, session=session, keystrokes=n,
+                                     time_start=start + datetime.timedelta(minutes=n),
+                                     time_end=start + datetime.timedelta(minutes=n, seconds=30),
+                                     classes=[classes.setdefault(i, WindowClass(name=i)) for i in names]))
+        self.ses.commit()
+
+    def expected(self):
+        events = self.ses.query(WindowEvent).order_by(WindowEvent.time_start).all()
+        for e in events:
+            if e.window_name is None:
+                e.window_name = ''
+        return [sorted(set(tags)) for _, tags in process_events(self.matchers, events)]
+
+    def test_same_tags_as_process_events(self):
+        tagged = tagged_events(self.ses, self.matchers)
+        self.assertEqual([sorted(tags) for _, tags in tagged], self.expected())
+        self.assertEqual([e.window_name for e, _ in tagged], [i or '' for i, _ in self.events])
+        self.assertEqual(tagged[0][0].duration(), datetime.timedelta(seconds=30))
+
+    def test_totals(self):
+        totals = tag_totals(self.ses, self.matchers, end=datetime.datetime(2021, 1, 1, 9, 5))
+        expected = {}
+        for n, tags in enumerate(self.expected()[:5]):
+            for t in tags:
+                seconds, keystrokes = expected.get(t, (0.0, 0))
+                expected[t] = (seconds + 30, keystrokes + n)
+        self.assertEqual(totals.keys(), expected.keys())
+        for tag, (seconds, keystrokes) in expected.items():
+            self.assertAlmostEqual(totals[tag][0], seconds, places=3)
+            self.assertEqual(totals[tag][1], keystrokes)
+
+    def test_other_matchers(self):
+        class Everything:
+            tags = ['everything']
+
+        self.assertRaises(TypeError, SqlMatchers, [Everything()])
+
+
+if __name__ == '__main__':
+    unittest.main()
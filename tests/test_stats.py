@@ -0,0 +1,32 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from timetracker.stats import Histogram, Stats, report
+
+
+class StatsTest(unittest.TestCase):
+    def test_histogram(self):
+        h = Histogram()
+        for i in range(99):
+            h.record(0.001)
+        h.record(0.5)
+        self.assertEqual(h.count, 100)
+        self.assertLess(h.quantile(0.5), 0.002)
+        self.assertEqual(h.quantile(1), 0.5)
+
+    def test_report(self):
+        s = Stats()
+        s.count('input_events', 10)
+        with s.timed('commit'):
+            pass
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / 'stats.json'
+            s.dump(path)
+            text = report(path)
+        self.assertIn('input_events: 10', text)
+        self.assertIn('commit: 1 times', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
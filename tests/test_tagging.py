@@ -0,0 +1,112 @@
+import datetime
+import re
+import tempfile
+import unittest
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import timetracker.sqlmatching as sqlmatching
+from timetracker.archive import archive_months, archived_events
+from timetracker.models import EventTag, SessionObject, TagState, WindowClass, WindowEvent, create_tables
+from timetracker.report import AndMatcher, ClassMatcher, NameTagger, NotMatcher, OrMatcher, process_events
+from timetracker.tagging import arrange, tagged_events, update
+
+
+class TaggingTest(unittest.TestCase):
+    matchers = [
+        NameTagger('vim', ['editing']),
+        NameTagger(['Firefox', re.compile(r'.*mozilla')], ['browser']),
+        ClassMatcher('kitty', ['terminal']),
+        OrMatcher([NameTagger('.py', ['python']), ClassMatcher(re.compile('jet'), ['ide'])], ['programming']),
+        AndMatcher([NameTagger('pytest', ['tests']), ClassMatcher('kitty', ['terminal'])], ['testing']),
+        NotMatcher([NameTagger('vim', [])], ['not vim']),
+    ]
+    events = [('vim — notes.py', ['kitty']), ('Mozilla Firefox', ['firefox']), ('foo', ['jetbrains']),
+              ('pytest -x', ['kitty', 'xterm']), (None, []), ('vim', [])]
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        self.ses = sessionmaker(bind=engine)()
+        self.session, self.classes = SessionObject(id=1), {}
+        self.start = datetime.datetime(2021, 1, 1, 9)
+        for name, names in self.events:
+            self.add(name, names)
+
+    def add(self, name, names):
+        n = self.ses.query(WindowEvent).count()
+        self.ses.add(WindowEvent(window_name=name, session=self.session, window_id=1,
+                                 time_start=self.start + datetime.timedelta(minutes=n),
+                                 time_end=self.start + datetime.timedelta(minutes=n, seconds=30),
+                                 classes=[self.classes.setdefault(i, WindowClass(name=i)) for i in names]))
+        self.ses.commit()
+
+    def assertTagged(self, matchers):
+        self.assertEqual(tagged_events(self.ses, matchers), sqlmatching.tagged_events(self.ses, matchers))
+
+    def test_only_new_events_are_tagged(self):
+        self.assertEqual(update(self.ses, self.matchers), len(self.events))
+        self.assertTagged(self.matchers)
+        self.assertEqual(update(self.ses, self.matchers), 0)
+        self.add('pytest', ['kitty'])
+        self.assertEqual(update(self.ses, self.matchers), 1)
+        self.assertTagged(self.matchers)
+        self.assertEqual(self.ses.query(TagState.event_id).scalar(), len(self.events) + 1)
+
+    def test_events_not_tagged_yet(self):
+        update(self.ses, self.matchers)
+        self.add('pytest', ['kitty'])
+        self.add(None, ['jetbrains'])
+        self.assertTagged(self.matchers)
+        tagged = tagged_events(self.ses, self.matchers, start=self.start + datetime.timedelta(minutes=len(self.events)))
+        self.assertEqual([tags for _, tags in tagged], [['terminal', 'testing', 'tests', 'not vim'],
+                                                        ['programming', 'ide', 'not vim']])
+
+    def test_changed_matchers(self):
+        update(self.ses, self.matchers)
+        other = [NameTagger('vim', ['vim'])]
+        # The tags kept are of the old matchers until the events are tagged again
+        self.assertTagged(other)
+        self.assertEqual(update(self.ses, other), len(self.events))
+        self.assertTagged(other)
+        self.assertEqual(self.ses.query(EventTag).count(), len(self.events))
+
+    def test_old_tags_are_cleared_in_chunks(self):
+        update(self.ses, self.matchers)
+        deletes = []
+        event.listen(self.ses.get_bind(), 'before_cursor_execute', lambda conn, cursor, statement, *args:
+                     deletes.append(statement) if statement.startswith('DELETE FROM "EventTag"') else None)
+        other = [NameTagger('vim', ['vim'])]
+        self.assertEqual(update(self.ses, other, chunk_size=2), len(self.events))
+        # Each tagged event has a few tags, a statement removes those of at most two events
+        self.assertGreaterEqual(len(deletes), len(self.events) // 2 + 1)
+        self.assertTagged(other)
+
+    def test_archived_events_are_tagged_alike(self):
+        # The order the matchers give these tags in isn't the order they first appear in, and one is given twice
+        matchers = [NameTagger('vim', ['vim']), OrMatcher([NameTagger('emacs', ['editing'])], ['programming']),
+                    NameTagger('notes', ['editing', 'programming', 'vim'])]
+        with tempfile.TemporaryDirectory() as d:
+            archive_months(self.ses, datetime.date(2021, 2, 1), Path(d))
+            archived = arrange(matchers, process_events(matchers, archived_events(directory=Path(d))))
+        self.start = datetime.datetime(2021, 3, 1)
+        self.add('vim — notes.py', ['kitty'])
+        update(self.ses, matchers)
+        live = tagged_events(self.ses, matchers)
+        self.assertEqual([tags for e, tags in archived if e.window_name == 'vim — notes.py'],
+                         [tags for _, tags in live])
+        self.assertEqual([tags for _, tags in live], [['vim', 'programming', 'editing']])
+
+    def test_merged_events_lose_their_tags(self):
+        self.add('vim', [])
+        update(self.ses, self.matchers)
+        self.assertEqual(WindowEvent.merge_within(self.ses, 60, incremental=False), 1)
+        self.assertEqual(self.ses.query(EventTag).where(EventTag.event_id.not_in(
+            self.ses.query(WindowEvent.id))).count(), 0)
+        self.assertTagged(self.matchers)
+
+
+if __name__ == '__main__':
+    unittest.main()
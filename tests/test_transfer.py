@@ -0,0 +1,97 @@
+import datetime
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from timetracker.models import SessionObject, WindowClass, WindowEvent, create_tables
+from timetracker.transfer import export_events, import_events, read_records
+
+
+class TransferTest(unittest.TestCase):
+    def setUp(self):
+        self.source = self.database()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        session, kitty, firefox = SessionObject(id=1), WindowClass(name='kitty'), WindowClass(name='firefox')
+        for n, day in enumerate([datetime.date(2021, 1, 30), datetime.date(2021, 2, 3)]):
+            start = datetime.datetime.combine(day, datetime.time(9, 0, 0, 250))
+            for i, (name, classes) in enumerate([('vim — notes', [kitty]), ('Ωmega, "quoted"', [kitty, firefox]),
+                                                 (None, [])]):
+                self.source.add(WindowEvent(window_name=name, window_id=7 + i, session=session, classes=classes,
+                                            time_start=start + datetime.timedelta(hours=i),
+                                            time_end=start + datetime.timedelta(hours=i, seconds=90),
+                                            keystrokes=n + i, mouse_motion=1.5 * i))
+        self.source.commit()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def database():
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        return sessionmaker(bind=engine)()
+
+    @staticmethod
+    def events(ses) -> list:
+        return [(e.window_id, e.window_name, e.time_start, e.time_end, e.keystrokes, e.mouse_motion,
+                 sorted(i.name for i in e.classes))
+                for e in ses.query(WindowEvent).order_by(WindowEvent.time_start)]
+
+    def round_trip(self, name: str) -> None:
+        path = str(self.path / name)
+        self.assertEqual(export_events(self.source, path), 6)
+        target = self.database()
+        self.assertEqual(import_events(target, read_records(path), batch_size=4), (6, 0))
+        self.assertEqual(self.events(target), self.events(self.source))
+        # Importing again adds nothing
+        self.assertEqual(import_events(target, read_records(path)), (0, 6))
+        self.assertEqual(target.query(WindowEvent).count(), 6)
+
+    def test_jsonl(self):
+        self.round_trip('events.jsonl')
+
+    def test_csv(self):
+        self.round_trip('events.csv')
+
+    def test_archive(self):
+        self.round_trip('events.tta')
+        self.assertEqual(sorted(i.name for i in (self.path / 'events.tta').iterdir()), ['2021-01.tta', '2021-02.tta'])
+
+    def test_sessions_are_new(self):
+        path = str(self.path / 'events.jsonl')
+        export_events(self.source, path)
+        # The target has a session of its own with the same id as the one the events were exported from
+        target = self.database()
+        target.add(SessionObject(id=1, date=datetime.datetime(2022, 5, 1)))
+        target.commit()
+        import_events(target, read_records(path), batch_size=4)
+        session = target.query(SessionObject).filter(SessionObject.id != 1).one()
+        self.assertEqual(target.query(WindowEvent).filter(WindowEvent.session_id != session.id).count(), 0)
+        self.assertEqual((session.date, session.end), (datetime.datetime(2021, 1, 30, 9, 0, 0, 250),
+                                                       datetime.datetime(2021, 2, 3, 11, 1, 30, 250)))
+        self.assertEqual(target.get(SessionObject, 1).date, datetime.datetime(2022, 5, 1))
+
+    def test_merge_into_existing(self):
+        output = io.StringIO()
+        export_events(self.source, '-', 'jsonl', since=datetime.datetime(2021, 2, 1), output=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        # Events repeated in the same file are only added once, and the titles and classes are reused
+        self.assertEqual(import_events(self.source, read_records('-', 'jsonl', io.StringIO('\n'.join(lines * 2)))),
+                         (0, 6))
+        for i in self.source.query(WindowEvent).filter(WindowEvent.time_start >= datetime.datetime(2021, 2, 1)):
+            self.source.delete(i)
+        self.source.commit()
+        self.assertEqual(import_events(self.source, read_records('-', 'jsonl', io.StringIO('\n'.join(lines * 2)))),
+                         (3, 3))
+        self.assertEqual(self.source.query(WindowClass).count(), 2)
+        self.assertEqual(len(self.events(self.source)), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
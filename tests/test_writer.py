@@ -0,0 +1,188 @@
+import datetime
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from timetracker.models import Base, SessionObject, WindowClass, WindowClassCache, WindowEvent, WindowTitle, \
+    create_tables
+from timetracker.stats import stats
+from timetracker.writer import Sample, SampleWriter
+
+
+def memory_session():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+class SampleWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.factory = memory_session()
+        self.now = datetime.datetime.now()
+
+    def sample(self, name, seconds, **kwargs):
+        return Sample(name, 1, ['kitty'], self.now, self.now + datetime.timedelta(seconds=seconds), **kwargs)
+
+    def test_updates_share_a_row(self):
+        writer = SampleWriter(self.factory, flush_interval=60, flush_size=100)
+        writer.start()
+        s = self.sample('a', 4)
+        writer.submit(s)
+        s.time_end += datetime.timedelta(seconds=4)
+        s.keystrokes = 10
+        writer.submit(s)
+        writer.submit(self.sample('b', 4))
+        writer.close()
+        ses = self.factory()
+        events = ses.query(WindowEvent).order_by(WindowEvent.id).all()
+        self.assertEqual([e.window_name for e in events], ['a', 'b'])
+        self.assertEqual(events[0].keystrokes, 10)
+        self.assertEqual(events[0].duration(), datetime.timedelta(seconds=8))
+        self.assertEqual(events[0].classes[0].id, events[1].classes[0].id)
+
+    def test_flush_interval(self):
+        import time
+        writer = SampleWriter(self.factory, flush_interval=0.05, flush_size=100)
+        writer.start()
+        writer.submit(self.sample('a', 4))
+        deadline = time.monotonic() + 5
+        while self.factory().query(WindowEvent).count() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.factory().query(WindowEvent).count(), 1)
+        writer.close()
+
+    def test_session_boundaries(self):
+        from sqlalchemy import event
+        writer = SampleWriter(self.factory, flush_interval=60, flush_size=100, session_id=5)
+        writer.start()
+        writer.flush()
+        started = self.factory().get(SessionObject, 5)
+        self.assertIsNotNone(started.date)
+        self.assertIsNone(started.end)
+        statements = []
+        event.listen(self.factory.kw['bind'], 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        for i in range(3):
+            writer.submit(self.sample(str(i), 4 + i))
+        writer.close()
+        self.assertFalse([i for i in statements if 'FROM "Session"' in i])
+        ended = self.factory().get(SessionObject, 5)
+        self.assertEqual((ended.samples, ended.end), (3, self.now + datetime.timedelta(seconds=6)))
+        self.assertEqual(len(ended.events), 3)
+
+    def failing(self, *failures):
+        "A session factory whose sessions fail the commits numbered in `failures`, counting from the session's start"
+        def factory():
+            ses = self.factory()
+            commit = ses.commit
+            calls = iter(range(1000))
+
+            def failing_commit():
+                if next(calls) in failures:
+                    raise OperationalError('COMMIT', {}, Exception('database is locked'))
+                commit()
+
+            ses.commit = failing_commit
+            return ses
+
+        return factory
+
+    def test_failed_batch_is_retried(self):
+        writer = SampleWriter(self.failing(2), flush_interval=60, flush_size=100)
+        writer.start()
+        s = self.sample('a', 4)
+        writer.submit(s)
+        writer.flush()
+        # This update of the event can't be committed, and is kept until it can
+        s.time_end += datetime.timedelta(seconds=4)
+        writer.submit(s)
+        writer.submit(self.sample('b', 4))
+        writer.flush()
+        self.assertEqual(self.factory().query(WindowEvent).count(), 1)
+        writer.close()
+        events = self.factory().query(WindowEvent).order_by(WindowEvent.id).all()
+        self.assertEqual([e.window_name for e in events], ['a', 'b'])
+        self.assertEqual(events[0].duration(), datetime.timedelta(seconds=8))
+
+    def test_failed_batch_is_dropped_eventually(self):
+        dropped = stats.counters.get('samples_dropped', 0)
+        with mock.patch('timetracker.writer._WRITE_ATTEMPTS', 2):
+            writer = SampleWriter(self.failing(1, 2), flush_interval=60, flush_size=100)
+            writer.start()
+            writer.submit(self.sample('a', 4))
+            writer.flush()
+            writer.flush()
+            writer.submit(self.sample('b', 4))
+            writer.close()
+        self.assertEqual([e.window_name for e in self.factory().query(WindowEvent)], ['b'])
+        self.assertEqual(stats.counters['samples_dropped'] - dropped, 1)
+
+    def test_create_tables_adds_missing_columns(self):
+        engine = create_engine('sqlite://')
+        with engine.begin() as connection:
+            connection.exec_driver_sql('CREATE TABLE "Session" (id INTEGER PRIMARY KEY, date DATETIME)')
+        create_tables(engine)
+        ses = sessionmaker(bind=engine)()
+        ses.add(SessionObject(id=1, samples=2))
+        ses.commit()
+        self.assertEqual(ses.get(SessionObject, 1).samples, 2)
+
+
+class WindowTitleTest(unittest.TestCase):
+    def test_titles_are_stored_once(self):
+        ses = memory_session()()
+        session = SessionObject(id=1)
+        now = datetime.datetime.now()
+        for name in ['a', 'b', 'a']:
+            ses.add(WindowEvent(window_name=name, time_start=now, time_end=now, session=session))
+        ses.commit()
+        ses.add(WindowEvent(window_name='a', time_start=now, time_end=now, session=session))
+        ses.commit()
+        self.assertEqual(sorted(i.name for i in ses.query(WindowTitle)), ['a', 'b'])
+        self.assertEqual(ses.query(WindowEvent).where(WindowEvent.window_name == 'a').count(), 3)
+        event = ses.query(WindowEvent).where(WindowEvent.window_name == 'b').one()
+        event.window_name = 'a'
+        ses.commit()
+        self.assertEqual(ses.query(WindowTitle).count(), 2)
+        self.assertEqual({i.title_id for i in ses.query(WindowEvent)},
+                         {ses.query(WindowTitle.id).filter_by(name='a').scalar()})
+
+
+class WindowClassCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.ses = memory_session()()
+        self.ses.add(WindowClass(name='kitty'))
+        self.ses.commit()
+
+    def test_preloaded_classes_are_not_queried(self):
+        from sqlalchemy import event
+        cache = WindowClassCache()
+        cache.preload(self.ses)
+        statements = []
+        event.listen(self.ses.get_bind(), 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        self.assertEqual(cache.lookup(self.ses, 'kitty').name, 'kitty')
+        self.assertEqual(statements, [])
+
+    def test_rollback_forgets_new_classes(self):
+        cache = WindowClassCache()
+        firefox = cache.lookup(self.ses, 'firefox')
+        self.assertIs(cache.lookup(self.ses, 'firefox'), firefox)
+        self.ses.rollback()
+        cache.rollback()
+        self.assertNotIn('firefox', cache.rows)
+        self.assertIsNot(cache.lookup(self.ses, 'firefox'), firefox)
+
+    def test_bounded(self):
+        cache = WindowClassCache(maxsize=2)
+        for i in ['a', 'b', 'c']:
+            cache.lookup(self.ses, i)
+        self.assertEqual(list(cache.rows), ['b', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,122 @@
-import timetracker.tracker as tracker
-import threading
-tracker.track()
\ No newline at end of file
+import argparse
+import datetime
+import sys
+
+parser = argparse.ArgumentParser(prog='python -m timetracker', description='Track what windows you spend time on')
+commands = parser.add_subparsers(dest='command')
+track = commands.add_parser('track', help='Start tracking, this is the default')
+track.add_argument('--record', metavar='FILE', help='Also record the input and focus changes to a file')
+commands.add_parser('stats', help="Show how much work the running tracker is doing")
+replay = commands.add_parser('replay', help='Track the input and focus changes of a recording')
+replay.add_argument('file', help='The recording')
+replay.add_argument('--speed', type=float, default=None,
+                    help='How many times faster than real time to replay, as fast as possible by default')
+replay.add_argument('--database', default=None,
+                    help='The sqlalchemy url of the database to write to, rather than the usual one')
+merge = commands.add_parser('merge', help='Merge events of the same window that are close together')
+merge.add_argument('--threshold', type=float, default=10,
+                   help='The number of seconds apart two events may be to be merged')
+merge.add_argument('--full', action='store_true', help='Go over every event rather than continuing the last merge')
+archive = commands.add_parser('archive', help='Move the events of past months out of the database into archives')
+archive.add_argument('--keep', type=int, default=1, help='The number of the latest months to keep in the database')
+export = commands.add_parser('export', help='Write the events to a file')
+export.add_argument('file', help='The file to write, - for the standard output, or for archives a directory')
+export.add_argument('--format', choices=['jsonl', 'csv', 'tta'], help='By default the extension of the file')
+export.add_argument('--since', type=datetime.datetime.fromisoformat, help='The earliest start of the events to export')
+export.add_argument('--until', type=datetime.datetime.fromisoformat, help='The start of the events not to export')
+load = commands.add_parser('import', help='Add the events of an export, skipping the ones already in the database')
+load.add_argument('file', help='The file to read, - for the standard input')
+load.add_argument('--format', choices=['jsonl', 'csv', 'tta'], help='By default the extension of the file')
+load.add_argument('--batch-size', type=int, default=5000, help='The number of events to add at once')
+commands.add_parser('derive-key', help='Print the raw key of the encrypted database, to put in TIMETRACKER_RAW_KEY '
+                                        'so that the tracker does not derive it from TIMETRACKER_PASSWORD')
+search = commands.add_parser('search', help='Find when windows with matching titles were used')
+search.add_argument('words', nargs='+', help='The words the titles should contain, end one with * to match a prefix')
+search.add_argument('--page', type=int, default=0, help='The page of days to show, from 0')
+search.add_argument('--per-page', type=int, default=10, help='The number of days on a page')
+synthesize = commands.add_parser('synthesize', help='Generate a recording of made up activity')
+synthesize.add_argument('hours', type=float, help='The length of the recording')
+synthesize.add_argument('file', help='Where to write the recording')
+synthesize.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+if args.command == 'stats':
+    import timetracker.stats
+
+    print(timetracker.stats.report())
+elif args.command == 'merge':
+    import sqlalchemy
+    import timetracker.models as models
+    import timetracker.rollup as rollup
+
+    models.create_tables()
+    ses = models.session()
+    # A running tracker may still be extending the latest event
+    latest = ses.query(models.WindowEvent.time_start).order_by(models.WindowEvent.time_start.desc()).limit(1).scalar()
+    watermark = None if args.full else ses.get(models.MergeWatermark, args.threshold)
+    if watermark:
+        since = watermark.time_start
+    else:
+        since = ses.query(sqlalchemy.func.min(models.WindowEvent.time_start)).scalar()
+    removed = models.WindowEvent.merge_within(ses, args.threshold, incremental=not args.full, until=latest)
+    if removed:
+        # The totals of the merged events have changed
+        rollup.invalidate(ses, since)
+    print(f"Removed {removed} events")
+elif args.command == 'archive':
+    import timetracker.archive
+    import timetracker.models as models
+
+    models.create_tables()
+    before = datetime.date.today().replace(day=1)
+    for _ in range(args.keep - 1):
+        before = (before - datetime.timedelta(days=1)).replace(day=1)
+    n = timetracker.archive.archive_months(models.session(), before)
+    print(f"Archived {n} events into {timetracker.archive.ARCHIVE_DIR}")
+elif args.command == 'export':
+    import timetracker.models as models
+    import timetracker.transfer as transfer
+
+    models.create_tables()
+    n = transfer.export_events(models.session(), args.file, args.format, args.since, args.until,
+                               sys.stdout if args.file == '-' else None)
+    print(f"Exported {n} events", file=sys.stderr)
+elif args.command == 'import':
+    import timetracker.models as models
+    import timetracker.transfer as transfer
+
+    models.create_tables()
+    events = transfer.read_records(args.file, args.format, sys.stdin if args.file == '-' else None)
+    added, skipped = transfer.import_events(models.session(), events, args.batch_size)
+    print(f"Imported {added} events, skipped {skipped} already in the database")
+elif args.command == 'derive-key':
+    import os
+    import timetracker.models as models
+
+    key = models.derive_key(os.environ['TIMETRACKER_PASSWORD'], models.DATABASE,
+                            int(os.getenv('TIMETRACKER_KDF', 64000)), os.getenv('TIMETRACKER_CIPHER', 'aes-256'))
+    if key is None:
+        sys.exit("The key could not be derived, check TIMETRACKER_KDF_ALGORITHM")
+    print(key)
+elif args.command == 'search':
+    import timetracker.models as models
+    from timetracker.search import search_titles
+
+    for day in search_titles(models.session, ' '.join(args.words), args.page, args.per_page):
+        print(f"{day.day}: {day.total} in {len(day.ranges)} ranges")
+        for i in day.ranges:
+            print(f"    {i.time_start:%H:%M:%S}-{i.time_end:%H:%M:%S} {i.window_name}")
+elif args.command == 'synthesize':
+    import timetracker.sources as sources
+
+    with open(args.file, 'wb') as f:
+        n = sources.write_records(f, sources.synthetic(args.hours, args.seed), datetime.datetime(2021, 1, 1))
+    print(f"Wrote {n} records")
+elif args.command == 'replay':
+    import timetracker.tracker as tracker
+
+    tracker.replay(args.file, args.speed, args.database)
+else:
+    import timetracker.tracker as tracker
+
+    tracker.track(getattr(args, 'record', None))
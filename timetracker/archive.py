@@ -0,0 +1,380 @@
+"""
+A compact, columnar archive of the events of past months, read by memory mapping it.
+
+Reports over months of history would otherwise load every event of those months as a
+:py:class:`timetracker.models.WindowEvent`. Instead, :py:func:`archive_months` moves the events of the months that are
+over into one file per month, and :py:func:`load_events` reads them back together with the recent events that are
+still in the database. An archive is a set of fixed-width arrays, one per attribute, which are memory mapped and viewed
+in place, so only the pages of the attributes a report actually looks at are read.
+
+A file starts with a header giving the number of events, class links and strings, then holds, each aligned to 8 bytes,
+
+* the event ids, start and end times in microseconds, and window ids as int64,
+* the mouse motion as float64,
+* the title ids and keystrokes as uint32,
+* the offsets into the class ids of each event's classes, one more than there are events, and those class ids, as
+  uint32,
+* the titles and classes the events refer to, as their ids, the offsets of their text and the utf-8 text itself.
+"""
+from __future__ import annotations
+
+import datetime
+import mmap
+import os
+import struct
+from array import array
+from functools import cached_property
+from pathlib import Path
+from typing import *
+
+import sqlalchemy
+import sqlalchemy.orm
+from xdg import xdg_data_home
+
+import timetracker.common
+from timetracker.models import EventClass, EventTag, WindowEvent
+
+ARCHIVE_DIR = Path(timetracker.common.Config.get('archive_dir', str(xdg_data_home() / 'timetracker' / 'archive')))
+
+_MAGIC = b'TTA1'
+_HEADER = struct.Struct('<4sIII')
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_COLUMNS = [('id', 'q'), ('time_start', 'q'), ('time_end', 'q'), ('window_id', 'q'), ('mouse_motion', 'd'),
+            ('title_id', 'I'), ('keystrokes', 'I')]
+
+
+def _micros(t: datetime.datetime) -> int:
+    return (t - _EPOCH) // _MICROSECOND
+
+
+def _datetime(micros: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(microseconds=micros)
+
+
+def _pad(n: int) -> int:
+    return -n % 8
+
+
+def archive_path(directory: Path, month: datetime.date) -> Path:
+    return directory / f'{month:%Y-%m}.tta'
+
+
+class ArchivedClass(NamedTuple):
+    id: int
+    name: str
+
+
+class Archive:
+    """
+    A memory mapped archive file.
+
+    The columns are :py:class:`memoryview` objects over the file's pages, one item per event, in order of start.
+
+    :ivar titles: The text of the titles the events refer to, by id
+    :ivar classes: The classes the events refer to, by id
+    """
+    titles: dict[int, str]
+    classes: dict[int, ArchivedClass]
+
+    def __init__(self, path: Path):
+        """
+        :param path: The archive file
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        magic, n, links, strings = _HEADER.unpack_from(view)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a timetracker archive")
+        offset = _HEADER.size
+        self._views = [view]
+
+        def column(kind: str, length: int) -> memoryview:
+            nonlocal offset
+            size = struct.calcsize(kind) * length
+            result = view[offset:offset + size].cast(kind)
+            offset += size + _pad(size)
+            self._views.append(result)
+            return result
+
+        for name, kind in _COLUMNS:
+            setattr(self, name, column(kind, n))
+        self.class_offsets = column('I', n + 1)
+        self.class_ids = column('I', links)
+        string_ids = column('q', strings)
+        string_kinds = column('I', strings)
+        string_offsets = column('I', strings + 1)
+        text = view[offset:offset + (string_offsets[strings] if strings else 0)]
+        self.titles = {}
+        self.classes = {}
+        for i in range(strings):
+            s = str(text[string_offsets[i]:string_offsets[i + 1]], 'utf-8')
+            if string_kinds[i]:
+                self.classes[string_ids[i]] = ArchivedClass(string_ids[i], s)
+            else:
+                self.titles[string_ids[i]] = s
+        self._views.append(text)
+        self.length = n
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, i: int) -> ArchivedEvent:
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return ArchivedEvent(self, i)
+
+    def __iter__(self) -> Iterator[ArchivedEvent]:
+        return map(ArchivedEvent, [self] * self.length, range(self.length))
+
+    def between(self, start: Optional[datetime.datetime] = None,
+                end: Optional[datetime.datetime] = None) -> Iterator[ArchivedEvent]:
+        """
+        The events that start within a range, found by bisecting the start times.
+        """
+        lo = 0 if start is None else self._bisect(_micros(start))
+        hi = self.length if end is None else self._bisect(_micros(end))
+        return map(ArchivedEvent, [self] * (hi - lo), range(lo, hi))
+
+    def _bisect(self, t: int) -> int:
+        lo, hi = 0, self.length
+        starts = self.time_start
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if starts[mid] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def close(self) -> None:
+        for i in reversed(self._views):
+            i.release()
+        self._map.close()
+
+    def __enter__(self) -> Archive:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class ArchivedEvent:
+    """
+    An event in an archive, with the attributes of a :py:class:`timetracker.models.WindowEvent` that reports use.
+
+    Attributes are read from the archive's columns when they are asked for.
+    """
+    __slots__ = ['archive', 'index', '__dict__']
+
+    def __init__(self, archive: Archive, index: int):
+        self.archive = archive
+        self.index = index
+
+    @property
+    def id(self) -> int:
+        return self.archive.id[self.index]
+
+    @property
+    def window_id(self) -> int:
+        return self.archive.window_id[self.index]
+
+    @property
+    def title_id(self) -> int:
+        return self.archive.title_id[self.index]
+
+    @property
+    def window_name(self) -> str:
+        return self.archive.titles[self.archive.title_id[self.index]]
+
+    @cached_property
+    def time_start(self) -> datetime.datetime:
+        return _datetime(self.archive.time_start[self.index])
+
+    @cached_property
+    def time_end(self) -> datetime.datetime:
+        return _datetime(self.archive.time_end[self.index])
+
+    @property
+    def keystrokes(self) -> int:
+        return self.archive.keystrokes[self.index]
+
+    @property
+    def mouse_motion(self) -> float:
+        return self.archive.mouse_motion[self.index]
+
+    @property
+    def classes(self) -> list[ArchivedClass]:
+        offsets = self.archive.class_offsets
+        return [self.archive.classes[i] for i in self.archive.class_ids[offsets[self.index]:offsets[self.index + 1]]]
+
+    @property
+    def date_of(self) -> tuple[int, int, int]:
+        return self.time_start.year, self.time_start.month, self.time_start.day
+
+    def duration(self) -> datetime.timedelta:
+        return self.time_end - self.time_start
+
+
+def write_archive(path: Path, events: Iterable[Union[WindowEvent, ArchivedEvent]]) -> int:
+    """
+    Write an archive, replacing the file in one step once it is complete and synced.
+
+    :param path: The file to write
+    :param events: The events to archive, which are sorted by their start
+    :return: The number of events written
+    """
+    events = sorted(events, key=lambda x: (x.time_start, x.id))
+    columns = {name: array(kind) for name, kind in _COLUMNS}
+    offsets, links = array('I', [0]), array('I')
+    titles, classes = {}, {}
+    for e in events:
+        columns['id'].append(e.id)
+        columns['time_start'].append(_micros(e.time_start))
+        columns['time_end'].append(_micros(e.time_end))
+        columns['window_id'].append(e.window_id or 0)
+        columns['mouse_motion'].append(e.mouse_motion or 0.0)
+        # Titles are numbered from 1, 0 stands for an event without one
+        columns['title_id'].append(e.title_id or 0)
+        columns['keystrokes'].append(e.keystrokes or 0)
+        titles[e.title_id or 0] = e.window_name or ''
+        for c in e.classes:
+            classes[c.id] = c.name
+            links.append(c.id)
+        offsets.append(len(links))
+    strings = [(i, 0, s) for i, s in titles.items()] + [(i, 1, s) for i, s in classes.items()]
+    encoded = [s.encode('utf-8') for _, _, s in strings]
+    text_offsets = array('I', [0])
+    for i in encoded:
+        text_offsets.append(text_offsets[-1] + len(i))
+    parts = [_HEADER.pack(_MAGIC, len(events), len(links), len(strings))]
+    for data in [*columns.values(), offsets, links, array('q', [i for i, _, _ in strings]),
+                 array('I', [k for _, k, _ in strings]), text_offsets]:
+        data = data.tobytes()
+        parts.append(data + bytes(_pad(len(data))))
+    parts.extend(encoded)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(b''.join(parts))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(events)
+
+
+def _months(directory: Path) -> list[datetime.date]:
+    return sorted(datetime.datetime.strptime(i.stem, '%Y-%m').date() for i in directory.glob('*.tta'))
+
+
+def _next_month(month: datetime.date) -> datetime.date:
+    return (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def archive_months(ses: sqlalchemy.orm.Session, before: datetime.date, directory: Path = ARCHIVE_DIR) -> int:
+    """
+    Move the events of the months before the one a date falls in out of the database and into archives.
+
+    A month that already has an archive has its new events added to it. Events are only deleted from the database once
+    their archive is on disk, and events that are in both are only archived once.
+
+    :param ses: The session to read and delete the events with
+    :param before: A date in the first month to leave in the database
+    :param directory: Where the archives are kept
+    :return: The number of events archived
+    """
+    end = datetime.datetime.combine(before.replace(day=1), datetime.time())
+    first = ses.query(sqlalchemy.func.min(WindowEvent.time_start)).where(WindowEvent.time_start < end).scalar()
+    if first is None:
+        return 0
+    month = first.date().replace(day=1)
+    total = 0
+    while month < before.replace(day=1):
+        start = datetime.datetime.combine(month, datetime.time())
+        stop = datetime.datetime.combine(_next_month(month), datetime.time())
+        events = ses.query(WindowEvent).where(WindowEvent.time_start >= start, WindowEvent.time_start < stop).all()
+        if events:
+            path = archive_path(directory, month)
+            ids = [e.id for e in events]
+            if path.exists():
+                with Archive(path) as old:
+                    archived = set(ids)
+                    write_archive(path, events + [e for e in old if e.id not in archived])
+            else:
+                write_archive(path, events)
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                ses.execute(EventClass.__table__.delete().where(EventClass.__table__.c.event_id.in_(chunk)))
+                ses.execute(EventTag.__table__.delete().where(EventTag.__table__.c.event_id.in_(chunk)))
+                ses.execute(WindowEvent.__table__.delete().where(WindowEvent.__table__.c.id.in_(chunk)))
+            ses.commit()
+            for e in events:
+                ses.expunge(e)
+            total += len(ids)
+        month = _next_month(month)
+    return total
+
+
+def archived_events(start: Optional[datetime.datetime] = None, directory: Path = ARCHIVE_DIR) -> list[ArchivedEvent]:
+    """
+    Get the events from a point on that have been archived.
+
+    :param start: The earliest start of the events to get, None for all of them
+    :param directory: Where the archives are kept
+    :return: The events, in order of their start
+    """
+    result = []
+    if directory.exists():
+        for month in _months(directory):
+            if start is not None and _next_month(month) <= start.date():
+                continue
+            # The archive's pages stay mapped for as long as the events are used
+            result.extend(Archive(archive_path(directory, month)).between(start))
+    return result
+
+
+def load_events(ses: sqlalchemy.orm.Session, start: Optional[datetime.datetime] = None,
+                directory: Path = ARCHIVE_DIR) -> list[Union[WindowEvent, ArchivedEvent]]:
+    """
+    Get the events from a point on, from the archives of the months they cover and from the database.
+
+    :param ses: The session to query the recent events with
+    :param start: The earliest start of the events to get, None for all of them
+    :param directory: Where the archives are kept
+    :return: The events, in order of their start
+    """
+    result = archived_events(start, directory)
+    q = ses.query(WindowEvent).order_by(WindowEvent.time_start)
+    if start is not None:
+        q = q.where(WindowEvent.time_start >= start)
+    result.extend(q)
+    return result
+
+
+def start_of_recent_days(ses: sqlalchemy.orm.Session, days: int,
+                         directory: Path = ARCHIVE_DIR) -> Optional[datetime.datetime]:
+    """
+    Find where the most recent days with events begin, like :py:meth:`timetracker.models.WindowEvent.start_of_recent_days`
+    but reading on into the archives when the database doesn't have enough days.
+
+    :param ses: The session to query the recent events with
+    :param days: The number of days with events to include
+    :param directory: Where the archives are kept
+    :return: The midnight at the start of the earliest of those days, or None if there are no more days than that
+    """
+    start = WindowEvent.start_of_recent_days(ses, days)
+    if start is not None or not directory.exists():
+        return start
+    seen = {i.date() for i, in ses.query(WindowEvent.time_start)}
+    for month in reversed(_months(directory)):
+        with Archive(archive_path(directory, month)) as archive:
+            starts = archive.time_start
+            for i in range(len(archive) - 1, -1, -1):
+                day = _datetime(starts[i]).date()
+                if day not in seen:
+                    if len(seen) >= days:
+                        return datetime.datetime.combine(min(seen), datetime.time())
+                    seen.add(day)
+    return None
@@ -150,6 +150,13 @@ class ChartPart(ChartPartBase):
                 key=lambda x: x[0].mouse_motion if x[
                 0].mouse_motion else 0.0)[
                 0].mouse_motion
+        # The seconds and keystrokes of each tag, added up in one pass rather than once per tag
+        totals = {}
+        for event, event_tags in self.data:
+            for i in set(event_tags):
+                seconds, strokes = totals.get(i, (0.0, 0))
+                totals[i] = (seconds + (event.time_end - event.time_start).total_seconds(),
+                             strokes + (event.keystrokes or 0))
         for index, value in enumerate(self.data):
             for i in value[1]:
                 if i in pos.keys():
@@ -168,11 +175,7 @@ class ChartPart(ChartPartBase):
                                 (1 + height_offset + (0.5 + v) * vscale) * cm),
                             stroke=annotation_color,
                             stroke_dasharray="5", stroke_width=".2mm"))
-                    f = list(filter(lambda x: i in x[1], self.data))
-                    s = sum(
-                        map(lambda x: (x[0].time_end - x[0].time_start).total_seconds(), f))
-                    total_strokes = sum(
-                        map(lambda x: x[0].keystrokes if x[0].keystrokes else 0, f))
+                    s, total_strokes = totals[i]
                     l = labels.add(
                         svgwrite.text.Text("", x=[horizontal_offset * cm],
                                            y=[(v * vscale + vscale / 2.0 +
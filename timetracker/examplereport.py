@@ -12,8 +12,9 @@ import timetracker.chart.data_colorer as data_colorer
 
 import svgwrite
 
-from timetracker import models as models
+from timetracker import archive, matching, rollup, tagging, models as models
 from timetracker.report import NameTagger, OrMatcher, AndMatcher, ClassMatcher, process_events
+from timetracker.search import search_titles
 
 from itertools import groupby
 from typing import *
@@ -86,13 +87,22 @@ def example(width: int = 25, height: int = 20, show_titles: bool = False, max_ch
              NameTagger('LyX', ['writing'])]
     if v:
         Config.set("matchers", m)
-    q = models.session.query(models.WindowEvent)
+    # Events of past months may have been moved into archives, which are read along with the database
+    start = None
     if max_charts == 1:
-        from sqlalchemy.sql import func
-        from sqlalchemy import cast, Integer
-        q = q.where(
-            cast(func.julianday(func.now()), Integer) == cast(func.julianday(models.WindowEvent.time_start), Integer))
-    r = process_events(m, q)
+        import datetime
+        start = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    elif max_charts > 1:
+        start = archive.start_of_recent_days(models.session, max_charts)
+    try:
+        matching.fingerprint(m)
+    except TypeError:
+        # Matchers that can't be compiled are asked about every event in turn, there are no tags kept for them
+        r = process_events(m, archive.load_events(models.session, start))
+    else:
+        # The tags of the database's events are mostly kept already, only the archived ones are tagged here
+        r = tagging.arrange(m, process_events(m, archive.archived_events(start))) + \
+            tagging.tagged_events(models.session, m, start)
 
     eg = svgwrite.Drawing('example.svg', debug=False)
     x = group_by(r, lambda z: z[0].date_of)
@@ -142,6 +152,49 @@ class Hoster:
             k = f.read().replace('%%REPLACE%%', json.dumps(Config.data['matchers']))
             return k
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def search(self, q: str = '', page: int = 0, per_page: int = 10):
+        """
+        Find the days on which windows with matching titles were used, see :py:func:`timetracker.search.search_titles`.
+
+        :param q: The words to look for
+        :param page: The number of the page of days to return, from 0
+        :param per_page: The number of days on a page
+        :return: The days on the page with their matching time ranges, best matches first
+        """
+        return [i.as_json() for i in search_titles(models.session, q, int(page), int(per_page))]
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def summary(self, kind: str = 'tag', period: str = 'month', start: str = None, end: str = None):
+        """
+        The time, keystrokes and motion of each tag or window class over each period, see
+        :py:func:`timetracker.rollup.totals`. The events written since the last request are added to the totals first.
+
+        :param kind: Either 'tag' or 'class'
+        :param period: Either 'hour', 'day', 'month' or 'year'
+        :param start: The earliest period to include, in iso format
+        :param end: Where to stop, exclusive, in iso format
+        :return: The totals, in order of their periods
+        """
+        import datetime
+        if kind not in rollup.KINDS or period not in rollup.PERIODS + ['year']:
+            raise cherrypy.HTTPError(400, f"No totals of {kind} by {period}")
+        rollup.update(models.session, Config.get("matchers", None) or [])
+        return [i.as_json() for i in rollup.totals(models.session, kind, period,
+                                                   start and datetime.datetime.fromisoformat(start),
+                                                   end and datetime.datetime.fromisoformat(end))]
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def tag_cache(self):
+        """
+        How often the tags of events were found already worked out for the current matchers, see
+        :py:class:`timetracker.matching.TagCache`.
+        """
+        return matching.compiled(Config.get("matchers", None) or []).titles.info()
+
     @cherrypy.expose
     def save_matchers(self, patterns):
         thing = list(timetracker.report.from_json(i) for i in json.loads(patterns))
@@ -150,7 +203,21 @@ class Hoster:
         return "Settings saved!"
 
 
+def tag_new_events():
+    "Keep the tags of the events up to date for the next reports, see :py:func:`timetracker.tagging.update`"
+    matchers = Config.get("matchers", None) or []
+    try:
+        matching.fingerprint(matchers)
+    except TypeError:
+        # Matchers that can't be compiled tag the events of each report as it is made
+        return
+    tagging.update(models.session, matchers)
+
+
 def host():
+    models.use_profile(models.engine, 'report')
+    cherrypy.process.plugins.Monitor(cherrypy.engine, tag_new_events, frequency=tagging.INTERVAL,
+                                     name='tagging').subscribe()
     cherrypy.quickstart(Hoster(), '',
                         {
                             'global': {'server.socket_host': '127.0.0.1',
@@ -0,0 +1,274 @@
+"""
+Keeps track of the focused window by listening for X property changes instead of asking the X server on every sample.
+
+The :py:class:`FocusWatcher` subscribes to ``PropertyNotify`` on the root window, to learn when ``_NET_ACTIVE_WINDOW``
+changes, and on the focused window, to learn when its title changes. Reading the current state is then just a matter of
+looking at :py:attr:`FocusWatcher.state`.
+
+When python-xlib isn't available, :py:class:`XpropWatcher` gets the same information from ``xprop -spy``.
+"""
+from __future__ import annotations
+
+import datetime
+import os
+import re
+import selectors
+import subprocess
+import threading
+from typing import *
+
+from timetracker.stats import stats
+
+try:
+    from Xlib.error import XError
+except ImportError:
+    XError = Exception
+
+# From X.h, so that the watcher can be driven by a fake display without python-xlib being installed
+_PROPERTY_NOTIFY = 28
+_PROPERTY_CHANGE_MASK = 1 << 22
+_NO_EVENT_MASK = 0
+
+
+class FocusState(NamedTuple):
+    """
+    The focused window as last seen by the watcher.
+    """
+    window_id: int
+    window_name: str
+    classes: frozenset[str]
+    since: datetime.datetime
+    "When the window gained focus or last changed its title"
+
+
+class FocusWatcher(threading.Thread):
+    """
+    Follows the focused window and its title through X events.
+
+    The watcher uses its own display connection, either from a thread started with :py:meth:`start` or by calling
+    :py:meth:`pump` whenever the connection has events ready.
+
+    :ivar state: The focused window, or None before it is known
+    """
+    state: Optional[FocusState]
+
+    def __init__(self, display):
+        """
+        :param display: The display connection, an :py:class:`Xlib.display.Display` or something that behaves like one
+        """
+        super().__init__(name='timetracker-focus', daemon=True)
+        self.display = display
+        self.root = display.screen().root
+        self.NET_ACTIVE_WINDOW = display.intern_atom('_NET_ACTIVE_WINDOW')
+        self.NET_WM_NAME = display.intern_atom('_NET_WM_NAME')
+        self.WM_NAME = display.intern_atom('WM_NAME')
+        self.state = None
+        self._window = None
+        self.root.change_attributes(event_mask=_PROPERTY_CHANGE_MASK)
+        self.refresh()
+
+    def run(self) -> None:
+        while True:
+            self.handle(self.display.next_event())
+
+    def pump(self) -> None:
+        """
+        Handle every event that has already arrived without waiting for more.
+        """
+        while self.display.pending_events():
+            self.handle(self.display.next_event())
+
+    def handle(self, event) -> None:
+        """
+        Update the state according to a single X event.
+
+        :param event: The event, events other than property changes of the watched windows are ignored
+        """
+        if event.type != _PROPERTY_NOTIFY:
+            return
+        if event.atom == self.NET_ACTIVE_WINDOW and event.window == self.root:
+            with stats.timed('x_query'):
+                self.refresh()
+        elif event.atom in (self.NET_WM_NAME, self.WM_NAME) and self._window is not None and \
+                event.window == self._window:
+            with stats.timed('x_query'):
+                self._retitle()
+
+    def refresh(self) -> None:
+        """
+        Read the active window from the root window, and watch it if it has changed.
+        """
+        try:
+            active = self.root.get_full_property(self.NET_ACTIVE_WINDOW, 0)
+        except XError:
+            return
+        if not active or not active.value:
+            return
+        window_id = int(active.value[0])
+        if self.state is not None and self.state.window_id == window_id:
+            return
+        if self._window is not None:
+            try:
+                self._window.change_attributes(event_mask=_NO_EVENT_MASK)
+            except XError:
+                pass
+        window = self.display.create_resource_object('window', window_id)
+        try:
+            window.change_attributes(event_mask=_PROPERTY_CHANGE_MASK)
+            classes = frozenset(window.get_wm_class() or ())
+            name = self._title(window)
+        except XError:
+            # The window went away before we could look at it, the next focus change will replace it.
+            self._window = None
+            return
+        self._window = window
+        self.state = FocusState(window_id, name, classes, datetime.datetime.now())
+        stats.count('focus_changes')
+
+    def _retitle(self) -> None:
+        try:
+            name = self._title(self._window)
+        except XError:
+            return
+        if self.state is not None:
+            self.state = self.state._replace(window_name=name, since=datetime.datetime.now())
+
+    def _title(self, window) -> str:
+        for atom in (self.NET_WM_NAME, self.WM_NAME):
+            prop = window.get_full_property(atom, 0)
+            if prop and prop.value:
+                value = prop.value
+                return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+        return ''
+
+
+_XPROP_LINE = re.compile(r'^(\w+)(?:\([^)]*\))?\s*[:=]\s*(.*)$')
+_XPROP_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+_XPROP_ESCAPE = re.compile(r'\\(.)')
+_XPROP_WINDOW = re.compile(r'0x[0-9a-fA-F]+')
+
+
+def parse_xprop(line: str) -> Optional[tuple[str, list[str]]]:
+    """
+    Split a line of xprop output into the property name and its values.
+
+    :param line: A line such as ``WM_CLASS(STRING) = "kitty", "kitty"``
+    :return: The name and the list of values, which is empty if the property is not set, or None if the line isn't a
+             property
+    """
+    m = _XPROP_LINE.match(line)
+    if not m:
+        return None
+    name, rest = m.groups()
+    strings = _XPROP_STRING.findall(rest)
+    if strings:
+        return name, [_XPROP_ESCAPE.sub(r'\1', i) for i in strings]
+    return name, _XPROP_WINDOW.findall(rest)
+
+
+class XpropWatcher(threading.Thread):
+    """
+    Follows the focused window by reading the output of long-running ``xprop -spy`` processes.
+
+    One process watches ``_NET_ACTIVE_WINDOW`` on the root window for as long as the watcher runs, and whenever the
+    focus moves another one is started to watch the title and classes of the newly focused window.
+
+    :ivar state: The focused window, or None before it is known
+    """
+    state: Optional[FocusState]
+
+    def __init__(self, xprop: str = 'xprop'):
+        """
+        :param xprop: The xprop executable
+        """
+        super().__init__(name='timetracker-xprop', daemon=True)
+        self.xprop = xprop
+        self.state = None
+        self._selector = selectors.DefaultSelector()
+        self._buffers = {}
+        self._root = self._spawn('-root', '_NET_ACTIVE_WINDOW')
+        self._window = None
+        self._window_id = None
+        self._since = None
+        self._properties = {}
+
+    def run(self) -> None:
+        while self._root is not None:
+            for key, _ in self._selector.select():
+                if key.data is not self._root and key.data is not self._window:
+                    # Replaced by a newer window while this batch was being handled
+                    continue
+                chunk = os.read(key.fd, 4096)
+                if not chunk:
+                    self._forget(key.data)
+                    continue
+                *lines, self._buffers[key.fd] = (self._buffers[key.fd] + chunk).split(b'\n')
+                for line in lines:
+                    self.handle(key.data, line.decode('utf-8', 'replace'))
+
+    def close(self) -> None:
+        """
+        Stop the xprop processes, which also ends the thread.
+        """
+        for proc in (self._window, self._root):
+            if proc is not None:
+                proc.kill()
+                proc.wait()
+
+    def handle(self, proc: subprocess.Popen, line: str) -> None:
+        """
+        Update the state according to a line of output.
+
+        :param proc: The process that printed the line
+        :param line: The line, without its line ending
+        """
+        parsed = parse_xprop(line)
+        if parsed is None:
+            return
+        name, values = parsed
+        if proc is self._root and name == '_NET_ACTIVE_WINDOW' and values:
+            window_id = int(values[0], base=16)
+            if window_id and window_id != self._window_id:
+                self._follow(window_id)
+        elif proc is self._window:
+            self._properties[name] = values
+            self._publish()
+
+    def _follow(self, window_id: int) -> None:
+        if self._window is not None:
+            old = self._window
+            self._forget(old)
+            old.kill()
+            old.wait()
+        self._window_id = window_id
+        self._since = datetime.datetime.now()
+        stats.count('focus_changes')
+        self._properties = {}
+        self._window = self._spawn('-id', hex(window_id), '_NET_WM_NAME', 'WM_NAME', 'WM_CLASS')
+
+    def _publish(self) -> None:
+        # xprop prints every property once when it starts, wait for all of them before reporting the new window.
+        if len(self._properties) < 3:
+            return
+        names = self._properties.get('_NET_WM_NAME') or self._properties.get('WM_NAME') or ['']
+        classes = frozenset(self._properties.get('WM_CLASS', ()))
+        if self.state is not None and self.state.window_id == self._window_id:
+            if self.state.window_name != names[0]:
+                self.state = self.state._replace(window_name=names[0], since=datetime.datetime.now())
+            return
+        self.state = FocusState(self._window_id, names[0], classes, self._since)
+
+    def _spawn(self, *args: str) -> subprocess.Popen:
+        proc = subprocess.Popen([self.xprop, '-spy', *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._buffers[proc.stdout.fileno()] = b''
+        self._selector.register(proc.stdout, selectors.EVENT_READ, proc)
+        return proc
+
+    def _forget(self, proc: subprocess.Popen) -> None:
+        self._selector.unregister(proc.stdout)
+        del self._buffers[proc.stdout.fileno()]
+        proc.stdout.close()
+        if proc is self._root:
+            self._root = None
+        elif proc is self._window:
+            self._window = None
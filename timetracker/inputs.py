@@ -0,0 +1,185 @@
+"""
+Reads keyboard and pointer activity for the tracker.
+
+Input is read in batches whenever the source has something ready, and collected in an :py:class:`Accumulator` until the
+tracker takes the totals for a sample.
+"""
+from __future__ import annotations
+
+from array import array
+from itertools import compress, repeat
+from math import hypot
+from operator import le, sub, truediv
+from typing import *
+
+_ACTIVE_GAP = 0.25
+"The longest pause, in seconds, between two motion events for the pointer to be considered still moving"
+_MIN_GAP = 0.001
+"The shortest time between two motion events that speeds are computed over, to avoid dividing by zero"
+
+
+class Activity(NamedTuple):
+    """
+    The input seen over one sample.
+    """
+    motion: float
+    "The distance the pointer travelled"
+    keys: int
+    "The number of keypresses"
+    peak_speed: float
+    "The fastest the pointer moved between two motion events, in distance per second"
+    active_seconds: float
+    "The time spent moving the pointer"
+
+
+class Accumulator:
+    """
+    Collects the input seen between two samples.
+
+    Pointer motion is only stored as it arrives, into preallocated buffers, and is reduced in a single pass over the
+    buffers when the totals are needed or the buffers fill up.
+
+    :ivar keys: The number of keypresses
+    """
+    __slots__ = ['dx', 'dy', 't', 'n', 'capacity', 'keys', '_motion', '_peak_speed', '_active_seconds', '_last_t']
+    keys: int
+
+    def __init__(self, capacity: int = 4096):
+        """
+        :param capacity: The number of motion events to hold before reducing them
+        """
+        self.dx = array('d', bytes(8 * capacity))
+        self.dy = array('d', bytes(8 * capacity))
+        self.t = array('d', bytes(8 * capacity))
+        self.n = 0
+        self.capacity = capacity
+        self.keys = 0
+        self._motion = self._peak_speed = self._active_seconds = 0.0
+        self._last_t = None
+
+    def add_motion(self, dx: float, dy: float, t: float) -> None:
+        """
+        Record a pointer motion event.
+
+        :param dx: The horizontal movement
+        :param dy: The vertical movement
+        :param t: When the event happened, in seconds
+        """
+        n = self.n
+        self.dx[n] = dx
+        self.dy[n] = dy
+        self.t[n] = t
+        n += 1
+        self.n = n
+        if n == self.capacity:
+            self.reduce()
+
+    def add_keys(self, count: int) -> None:
+        self.keys += count
+
+    def reduce(self) -> None:
+        """
+        Fold the buffered motion events into the running totals, emptying the buffers.
+        """
+        n = self.n
+        if not n:
+            return
+        t = memoryview(self.t)[:n]
+        distances = list(map(hypot, memoryview(self.dx)[:n], memoryview(self.dy)[:n]))
+        self._motion += sum(distances)
+        # The first event ever seen has nothing to measure a speed or pause against
+        previous = self._last_t if self._last_t is not None else float('-inf')
+        gaps = list(map(sub, t, [previous, *t[:-1]]))
+        self._peak_speed = max(self._peak_speed,
+                               max(map(truediv, distances, map(max, gaps, repeat(_MIN_GAP)))))
+        self._active_seconds += sum(compress(gaps, map(le, gaps, repeat(_ACTIVE_GAP))))
+        self._last_t = t[-1]
+        self.n = 0
+
+    @property
+    def motion(self) -> float:
+        """
+        The distance the pointer has travelled so far.
+        """
+        self.reduce()
+        return self._motion
+
+    def take(self) -> Activity:
+        """
+        Get the totals and start counting from zero again.
+
+        :return: The activity since the last time this was called
+        """
+        self.reduce()
+        r = Activity(self._motion, self.keys, self._peak_speed, self._active_seconds)
+        self.keys = 0
+        self._motion = self._peak_speed = self._active_seconds = 0.0
+        return r
+
+
+class LibinputSource:
+    """
+    Reads events from a libinput udev context without blocking.
+
+    python-libinput only offers a blocking generator that builds an object for every event, so this talks to the
+    context's library handle directly, dispatching and reading whatever is queued whenever its file descriptor is
+    readable.
+    """
+
+    def __init__(self, seat: str = 'seat0'):
+        """
+        :param seat: The seat to read the devices of
+        """
+        import libinput
+        from ctypes import c_void_p, c_double, c_int, c_uint32, c_uint64
+        self.context = libinput.LibInput(context_type=libinput.constant.ContextType.UDEV)
+        self.context.assign_seat(seat)
+        lib = self._lib = self.context._libinput
+        self._li = self.context._li
+        for name, restype in [('libinput_event_get_type', c_int),
+                              ('libinput_event_get_pointer_event', c_void_p),
+                              ('libinput_event_pointer_get_dx_unaccelerated', c_double),
+                              ('libinput_event_pointer_get_dy_unaccelerated', c_double),
+                              ('libinput_event_pointer_get_time_usec', c_uint64),
+                              ('libinput_event_get_keyboard_event', c_void_p),
+                              ('libinput_event_keyboard_get_key_state', c_int),
+                              ('libinput_event_keyboard_get_seat_key_count', c_uint32),
+                              ('libinput_event_destroy', None)]:
+            getattr(lib, name).argtypes = (c_void_p,)
+            getattr(lib, name).restype = restype
+        EventType = libinput.constant.EventType
+        self._MOTION = EventType.POINTER_MOTION.value
+        self._KEY = EventType.KEYBOARD_KEY.value
+        self._PRESSED = libinput.constant.KeyState.PRESSED.value
+        self._ACTIVITY = frozenset(i.value for i in EventType if i.is_pointer() or i.is_keyboard())
+
+    def fileno(self) -> int:
+        return self._lib.libinput_get_fd(self._li)
+
+    def read(self, accumulator: Accumulator) -> int:
+        """
+        Add every queued event to the accumulator.
+
+        :param accumulator: Where to add the motion and keypresses
+        :return: The number of pointer and keyboard events read
+        """
+        lib, li = self._lib, self._li
+        lib.libinput_dispatch(li)
+        count = 0
+        event = lib.libinput_get_event(li)
+        while event:
+            kind = lib.libinput_event_get_type(event)
+            if kind == self._MOTION:
+                pointer = lib.libinput_event_get_pointer_event(event)
+                accumulator.add_motion(lib.libinput_event_pointer_get_dx_unaccelerated(pointer),
+                                       lib.libinput_event_pointer_get_dy_unaccelerated(pointer),
+                                       lib.libinput_event_pointer_get_time_usec(pointer) / 1e6)
+            elif kind == self._KEY:
+                keyboard = lib.libinput_event_get_keyboard_event(event)
+                if lib.libinput_event_keyboard_get_key_state(keyboard) == self._PRESSED:
+                    accumulator.add_keys(1 + lib.libinput_event_keyboard_get_seat_key_count(keyboard))
+            if kind in self._ACTIVITY:
+                count += 1
+            lib.libinput_event_destroy(event)
+            event = lib.libinput_get_event(li)
+        return count
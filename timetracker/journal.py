@@ -0,0 +1,244 @@
+"""
+An append-only journal of samples that is folded into the database in the background.
+
+In journal mode the tracker's samples are appended to a segment file as fixed-size records, and the file is synced
+once per batch, rather than being written to SQLite as they arrive. Once a segment is big or old enough it is closed
+and compacted: the last state of every sample in it becomes a :py:class:`timetracker.models.WindowEvent`, merging runs
+of the same window the way :py:meth:`timetracker.models.WindowEvent.merge` does. Segments left behind by a tracker that
+crashed are compacted the next time one starts, up to the last complete record.
+"""
+from __future__ import annotations
+
+import datetime
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import *
+
+import sqlalchemy.exc
+import sqlalchemy.orm
+from xdg import xdg_data_home
+
+import timetracker.common
+import timetracker.models as models
+from timetracker.models import JournalSegment, SessionObject, WindowEvent
+from timetracker.stats import stats
+from timetracker.writer import Sample, SampleWriter, _FLUSH_INTERVAL, _FLUSH_SIZE
+
+JOURNAL_DIR = Path(timetracker.common.Config.get('journal_dir', str(xdg_data_home() / 'timetracker' / 'journal')))
+_SEGMENT_SIZE = timetracker.common.Config.get('journal_segment_size', 1 << 20)
+_SEGMENT_AGE = timetracker.common.Config.get('journal_segment_age', 300)
+_MERGE_THRESHOLD = timetracker.common.Config.get('merge_threshold', 10)
+
+_MAGIC = b'TTJ1'
+_HEADER = struct.Struct('<Q')
+_SAMPLE = struct.Struct('<BQQdddIII')
+_STRING = struct.Struct('<BII')
+_CRC = struct.Struct('<I')
+_SAMPLE_KIND, _STRING_KIND = 1, 2
+_CLASS_SEPARATOR = '\x1f'
+
+
+def segment_path(directory: Path, number: int) -> Path:
+    return directory / f'segment-{number:010d}.log'
+
+
+def segment_number(path: Path) -> int:
+    return int(path.stem.split('-')[1])
+
+
+def read_segment(path: Path) -> tuple[int, list[Sample]]:
+    """
+    Read the samples from a segment, stopping at the first incomplete or damaged record.
+
+    :param path: The segment file
+    :return: The id of the session the samples were taken during, and the samples in the order they were written
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(_MAGIC)] != _MAGIC or len(data) < len(_MAGIC) + _HEADER.size:
+        return models.current_time, []
+    session_id, = _HEADER.unpack_from(data, len(_MAGIC))
+    strings = {}
+    samples = []
+    offset = len(_MAGIC) + _HEADER.size
+    while offset < len(data):
+        kind = data[offset]
+        if kind == _SAMPLE_KIND:
+            end = offset + _SAMPLE.size
+        elif kind == _STRING_KIND and offset + _STRING.size <= len(data):
+            end = offset + _STRING.size + _STRING.unpack_from(data, offset)[2]
+        else:
+            break
+        if end + _CRC.size > len(data) or _CRC.unpack_from(data, end)[0] != zlib.crc32(data[offset:end]):
+            break
+        if kind == _SAMPLE_KIND:
+            _, key, window_id, start, finish, motion, keys, name, classes = _SAMPLE.unpack_from(data, offset)
+            samples.append(Sample(strings[name], window_id, filter(None, strings[classes].split(_CLASS_SEPARATOR)),
+                                  datetime.datetime.fromtimestamp(start), datetime.datetime.fromtimestamp(finish),
+                                  motion, keys, key=key))
+        else:
+            _, string_id, length = _STRING.unpack_from(data, offset)
+            strings[string_id] = data[offset + _STRING.size:end].decode('utf-8')
+        offset = end + _CRC.size
+    return session_id, samples
+
+
+class JournalWriter(SampleWriter):
+    """
+    A :py:class:`timetracker.writer.SampleWriter` that appends samples to a journal and compacts it into the database.
+
+    Each batch of samples is appended to the current segment and synced to disk in one go. Titles and classes are
+    written once per segment and referred to by number from then on, which keeps the sample records a fixed size.
+    """
+
+    def __init__(self, directory: Path = JOURNAL_DIR,
+                 session_factory: Callable[[], sqlalchemy.orm.Session] = models.session,
+                 flush_interval: float = _FLUSH_INTERVAL, flush_size: int = _FLUSH_SIZE,
+                 segment_size: int = _SEGMENT_SIZE, segment_age: float = _SEGMENT_AGE,
+                 threshold: float = _MERGE_THRESHOLD, session_id: int = models.current_time):
+        """
+        :param directory: Where the segments are kept
+        :param session_factory: Called from the writer thread to get the session to compact into
+        :param flush_interval: The longest time in seconds a sample may wait before being synced to the journal
+        :param flush_size: The number of samples that causes a sync regardless of the time
+        :param segment_size: The size in bytes after which a segment is compacted
+        :param segment_age: The age in seconds after which a segment is compacted
+        :param threshold: The number of seconds apart two events of the same window may be to be merged
+        :param session_id: The id of the tracker session the samples are taken during
+        """
+        super().__init__(session_factory, flush_interval, flush_size, session_id)
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.threshold = threshold
+        self._file = None
+        self._number = 0
+        self._opened = 0.0
+        self._strings = {}
+        self._carried: Optional[tuple[tuple[int, int], int, Sample]] = None
+        "The session and key of the last sample compacted, the id of the event it went into and the sample as it was"
+
+    def run(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        ses = self._session()
+        # Anything still here was left by a tracker that didn't get to compact it
+        existing = sorted(self.directory.glob('segment-*.log'), key=segment_number)
+        for path in existing:
+            self.compact(ses, path)
+        last = ses.query(sqlalchemy.func.max(JournalSegment.id)).scalar() or 0
+        self._number = max([last, *map(segment_number, existing)])
+        self._batch(ses)
+        if self._file is not None:
+            self._file.close()
+            self.compact(ses, segment_path(self.directory, self._number))
+        self._end_session(ses)
+        ses.close()
+
+    def _write(self, ses: sqlalchemy.orm.Session, pending: list[Sample]) -> None:
+        if not pending:
+            return
+        if self._file is None:
+            self._open_segment()
+        with stats.timed('journal_append'):
+            self._file.write(b''.join(map(self._encode, pending)))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        stats.count('samples_journaled', len(pending))
+        pending.clear()
+        if self._file.tell() >= self.segment_size or time.monotonic() - self._opened >= self.segment_age:
+            self._file.close()
+            self._file = None
+            self.compact(ses, segment_path(self.directory, self._number))
+
+    def _open_segment(self) -> None:
+        self._number += 1
+        self._file = open(segment_path(self.directory, self._number), 'wb')
+        self._file.write(_MAGIC + _HEADER.pack(self.session_id))
+        self._opened = time.monotonic()
+        self._strings = {}
+
+    def _encode(self, sample: Sample) -> bytes:
+        records = []
+
+        def string(s: str) -> int:
+            if s not in self._strings:
+                self._strings[s] = len(self._strings)
+                encoded = s.encode('utf-8')
+                record = _STRING.pack(_STRING_KIND, self._strings[s], len(encoded)) + encoded
+                records.append(record + _CRC.pack(zlib.crc32(record)))
+            return self._strings[s]
+
+        record = _SAMPLE.pack(_SAMPLE_KIND, sample.key, sample.window_id, sample.time_start.timestamp(),
+                              sample.time_end.timestamp(), sample.mouse_motion or 0.0, sample.keystrokes or 0,
+                              string(sample.window_name or ''), string(_CLASS_SEPARATOR.join(sorted(sample.classes))))
+        records.append(record + _CRC.pack(zlib.crc32(record)))
+        return b''.join(records)
+
+    def compact(self, ses: sqlalchemy.orm.Session, path: Path) -> int:
+        """
+        Fold a closed segment into the database and remove it.
+
+        The segment is marked as compacted in the same transaction that adds its events, so a segment is never added
+        twice even if the tracker stops before it is removed.
+
+        :param ses: The session to write the events with
+        :param path: The segment
+        :return: The number of events added
+        """
+        number = segment_number(path)
+        if ses.get(JournalSegment, number) is not None:
+            path.unlink()
+            return 0
+        session_id, samples = read_segment(path)
+        # Later records of a sample replace the earlier ones
+        latest = {i.key: i for i in samples}
+        added = []
+        try:
+            with stats.timed('compact'):
+                previous = ses.query(WindowEvent).order_by(WindowEvent.time_start.desc()).first()
+                session = ses.get(SessionObject, session_id) or SessionObject(id=session_id)
+                carried = self._carried
+                last = None
+                for sample in sorted(latest.values(), key=lambda x: x.time_start):
+                    last = sample
+                    if carried is not None and previous is not None and previous.id == carried[1] and \
+                            carried[0] == (session_id, sample.key):
+                        # The sample went on from the last segment, and its totals include what was added from there
+                        before = carried[2]
+                        previous.time_end = sample.time_end
+                        previous.keystrokes = (previous.keystrokes or 0) + (sample.keystrokes or 0) - \
+                                              (before.keystrokes or 0)
+                        previous.mouse_motion = (previous.mouse_motion or 0.0) + (sample.mouse_motion or 0.0) - \
+                                                (before.mouse_motion or 0.0)
+                        continue
+                    event = WindowEvent(title=self.titles.lookup(ses, sample.window_name), window_id=sample.window_id,
+                                        time_start=sample.time_start, time_end=sample.time_end,
+                                        mouse_motion=sample.mouse_motion, keystrokes=sample.keystrokes)
+                    if previous is not None and previous.should_merge(event, self.threshold):
+                        previous.merge(event, self.threshold)
+                        continue
+                    event.classes = [self.classes.lookup(ses, i) for i in sorted(sample.classes)]
+                    event.session = session
+                    ses.add(event)
+                    previous = event
+                    added.append(event)
+                ses.add(JournalSegment(id=number))
+                ses.commit()
+                if last is not None:
+                    self._carried = (session_id, last.key), previous.id, last
+            self.classes.commit()
+            self.titles.commit()
+            count = len(added)
+            self._release(ses, added)
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            print(f"Unable to compact {path}, leaving it for later: {e}")
+            ses.rollback()
+            self.classes.rollback()
+            self.titles.rollback()
+            return 0
+        path.unlink()
+        stats.count('samples_written', len(latest))
+        return count
@@ -0,0 +1,480 @@
+"""
+Tags events against a whole tree of matchers at once, rather than asking each matcher in turn.
+
+:py:func:`timetracker.report.process_events` would otherwise walk every matcher for every event, lowercasing the title
+again for each needle. :py:class:`CompiledMatchers` instead gives each name and class matcher of the tree a bit, and
+finds every one of them that matches an event in a single pass over its title and classes:
+
+* the plain strings are looked for together with an Aho-Corasick automaton, once over the lowercased text and once over
+  the text as it is for the case sensitive ones,
+* the regular expressions are tried together with one expression that records which of them matched.
+
+The and, or and not matchers are then worked out from the bits that were set. Most events set one of few combinations,
+so the tags of each combination are only worked out once.
+
+Most events also share their title and classes with many others, so the tags of each title and set of classes are kept
+too, in a :py:class:`TagCache`. :py:func:`compiled` keeps the compiled matchers, and so their caches, for each set of
+matchers that are alike, so that later reports with the same matchers find the tags of most events already worked out.
+
+When a report has more titles that haven't been tagged before than that, :py:func:`in_parallel` matches them in a pool
+of processes instead.
+"""
+from __future__ import annotations
+
+import collections
+import concurrent.futures.process
+import hashlib
+import itertools
+import multiprocessing
+import os
+import re
+import threading
+from typing import *
+
+import timetracker.common
+from timetracker.matchers import AndMatcher, ClassMatcher, NameTagger, NotMatcher, OrMatcher
+
+_CACHE_SIZE = 65536
+"The number of combinations of matching matchers to keep the tags of"
+TAG_CACHE_SIZE = timetracker.common.Config.get('tag_cache_size', 65536)
+"The number of titles, with their classes, to keep the tags of for each set of matchers"
+_COMPILED_SIZE = 8
+"The number of sets of matchers to keep compiled"
+PARALLEL_TITLES = timetracker.common.Config.get('parallel_tagging', 20000)
+"The number of titles, with their classes, that have to be tagged for a report before they are matched in processes"
+TAGGING_WORKERS = timetracker.common.Config.get('tagging_workers', None)
+"The number of processes to match titles in, one for each cpu by default"
+_CHUNK_SIZE = 2048
+"The number of titles to send to a process at a time"
+
+
+class Automaton:
+    """
+    An Aho-Corasick automaton, which finds every one of a set of strings that occurs in a text in one pass over it.
+    """
+
+    def __init__(self, needles: dict[str, int]):
+        """
+        :param needles: The strings to look for, each with the bits to set when it is found
+        """
+        self.always = needles.get('', 0)
+        "The bits of the empty string, which is found in every text"
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail = [0]
+        self.out = [0]
+        for needle, bits in needles.items():
+            state = 0
+            for ch in needle:
+                following = self.goto[state].get(ch)
+                if following is None:
+                    following = len(self.goto)
+                    self.goto[state][ch] = following
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(0)
+                state = following
+            self.out[state] |= bits
+        # Breadth first, so that the state a state falls back to is complete before it
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, following in self.goto[state].items():
+                queue.append(following)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                # The states one character deep fall back to the root
+                self.fail[following] = self.goto[fallback].get(ch, 0) if state else 0
+                self.out[following] |= self.out[self.fail[following]]
+
+    def search(self, text: str) -> int:
+        """
+        :return: The bits of all the strings that occur in the text
+        """
+        goto, fail, out = self.goto, self.fail, self.out
+        found = self.always
+        state = 0
+        for ch in text:
+            following = goto[state].get(ch)
+            while following is None and state:
+                state = fail[state]
+                following = goto[state].get(ch)
+            state = following or 0
+            found |= out[state]
+        return found
+
+
+class _Expressions:
+    """
+    Regular expressions that are tried at the start of a text together, as :py:meth:`re.Pattern.match` would.
+    """
+
+    def __init__(self, patterns: list[tuple[re.Pattern, int]]):
+        self.separate = []
+        combined = []
+        for pattern, bits in patterns:
+            # The numbers of their own groups would change, and flags can't be set part way through
+            if pattern.groups or pattern.flags != re.compile('').flags or not isinstance(pattern.pattern, str):
+                self.separate.append((pattern, bits))
+            else:
+                combined.append((pattern, bits))
+        self.combined = None
+        self.bits = [bits for _, bits in combined]
+        if combined:
+            try:
+                # Each lookahead sets an empty group when its expression matches, and is skipped when it doesn't
+                self.combined = re.compile(''.join(f'(?:(?=(?:{p.pattern}))()|)' for p, _ in combined))
+            except re.error:
+                self.separate.extend(combined)
+                self.bits = []
+
+    def search(self, text: str) -> int:
+        found = 0
+        if self.combined is not None:
+            for group, bits in zip(self.combined.match(text).groups(), self.bits):
+                if group is not None:
+                    found |= bits
+        for pattern, bits in self.separate:
+            if pattern.match(text):
+                found |= bits
+        return found
+
+
+class _Text:
+    """
+    What is looked for in one form of one part of an event, such as its lowercased title.
+    """
+
+    def __init__(self):
+        self.needles: dict[str, int] = {}
+        self.patterns: list[tuple[re.Pattern, int]] = []
+        self.automaton = self.expressions = None
+
+    def add(self, needle: Union[str, re.Pattern], bits: int) -> None:
+        if isinstance(needle, re.Pattern):
+            self.patterns.append((needle, bits))
+        else:
+            self.needles[needle] = self.needles.get(needle, 0) | bits
+
+    def build(self) -> None:
+        self.automaton = Automaton(self.needles)
+        self.expressions = _Expressions(self.patterns)
+
+    def search(self, text: str) -> int:
+        return self.automaton.search(text) | self.expressions.search(text)
+
+
+class TagCache:
+    """
+    A bounded, least recently used mapping of the titles and classes of events to their tags, which is safe to share
+    between threads.
+
+    :ivar hits: The number of lookups that found tags
+    :ivar misses: The number of lookups that didn't
+    """
+
+    def __init__(self, maxsize: int = TAG_CACHE_SIZE):
+        """
+        :param maxsize: The number of titles to keep before discarding the least recently used one
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tags: OrderedDict[tuple[str, frozenset[str]], tuple[str, ...]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    def get(self, key: tuple[str, frozenset[str]]) -> Optional[tuple[str, ...]]:
+        """
+        :param key: The title and the names of the classes of an event
+        :return: The tags, if they are kept
+        """
+        with self._lock:
+            tags = self._tags.get(key)
+            if tags is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._tags.move_to_end(key)
+            return tags
+
+    def put(self, key: tuple[str, frozenset[str]], tags: tuple[str, ...]) -> None:
+        with self._lock:
+            self._tags[key] = tags
+            if len(self._tags) > self.maxsize:
+                self._tags.popitem(last=False)
+
+    def info(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._tags), 'maxsize': self.maxsize}
+
+
+class CompiledMatchers:
+    """
+    A list of matchers, as given to :py:func:`timetracker.report.process_events`, ready to tag many events.
+    """
+
+    def __init__(self, matchers: list):
+        """
+        :param matchers: The matchers, of the types :py:func:`timetracker.report.from_json` makes
+        :raises TypeError: If there are matchers of other types, which have to be asked one by one
+        """
+        self.matchers = matchers
+        self.bits: list[int] = []
+        """
+        The bit of each name and class matcher, in the order they come in walking the tree, so that matchers that tag
+        alike get the same bits however the matcher objects are shared between them
+        """
+        # By whether the text is the title or a class, and whether it is lowercased
+        self.texts: dict[tuple[str, bool], _Text] = collections.defaultdict(_Text)
+        for m in matchers:
+            self._add(m)
+        for text in self.texts.values():
+            text.build()
+        self.cache: dict[int, list[str]] = {}
+        self.titles = TagCache()
+        "The tags of the titles and classes seen before"
+
+    def _add(self, matcher) -> None:
+        kind = type(matcher)
+        if kind in (AndMatcher, OrMatcher, NotMatcher):
+            for m in matcher.matcher:
+                self._add(m)
+            return
+        if kind not in (NameTagger, ClassMatcher):
+            raise TypeError(f"Can't compile a {kind.__name__}")
+        bit = 1 << len(self.bits)
+        self.bits.append(bit)
+        fold = not matcher.case_sensitive
+        part = 'name' if kind is NameTagger else 'class'
+        for needle in _needles(matcher.matcher):
+            if isinstance(needle, str):
+                self.texts[part, fold].add(needle.lower() if fold else needle, bit)
+            elif isinstance(needle, re.Pattern):
+                # Titles are lowercased before the expressions are tried on them, classes aren't
+                self.texts[part, fold and part == 'name'].add(needle, bit)
+            else:
+                raise TypeError(f"Can't compile a match on {needle!r}")
+
+    def hits(self, event) -> int:
+        """
+        :param event: A :py:class:`timetracker.models.WindowEvent` or :py:class:`timetracker.archive.ArchivedEvent`
+        :return: The bits of the name and class matchers that match the event
+        """
+        found = 0
+        name = None
+        classes = None
+        for (part, fold), text in self.texts.items():
+            if part == 'name':
+                if name is None:
+                    name = event.window_name or ''
+                found |= text.search(name.lower() if fold else name)
+            else:
+                if classes is None:
+                    classes = [c.name for c in event.classes]
+                for c in classes:
+                    found |= text.search(c.lower() if fold else c)
+        return found
+
+    def tags(self, event) -> list[str]:
+        """
+        :return: The tags of the event, in the same order as asking each matcher would give them
+        """
+        key = event.window_name or '', frozenset(c.name for c in event.classes)
+        tags = self.titles.get(key)
+        if tags is None:
+            tags = tuple(self._tags(self.hits(event)))
+            self.titles.put(key, tags)
+        return list(tags)
+
+    def _tags(self, found: int) -> list[str]:
+        "The tags of an event that matched the given name and class matchers"
+        tags = self.cache.get(found)
+        if tags is None:
+            if len(self.cache) >= _CACHE_SIZE:
+                self.cache.clear()
+            tags = []
+            bits = iter(self.bits)
+            for m in self.matchers:
+                matches, t = self._evaluate(m, found, bits)
+                if matches and t:
+                    tags.extend(t)
+            if not tags:
+                tags.append('unlabelled')
+            self.cache[found] = tags
+        return tags
+
+    def _evaluate(self, matcher, found: int, bits: Iterator[int]) -> tuple[bool, Optional[list[str]]]:
+        """
+        The same as the matcher's `matches`, for an event that matched the given name and class matchers.
+
+        :param bits: The bits of the name and class matchers from this one on, in the order they were added
+        """
+        kind = type(matcher)
+        if kind is AndMatcher:
+            results = [self._evaluate(m, found, bits) for m in matcher.matcher]
+            tags = matcher.tags.copy()
+            for matches, t in results:
+                if matches and t is not None:
+                    tags.extend(t)
+            return all(matches for matches, _ in results), tags
+        if kind is OrMatcher:
+            results = [self._evaluate(m, found, bits) for m in matcher.matcher]
+            tags = matcher.tags.copy()
+            for matches, t in results:
+                if matches:
+                    tags.extend(t or [])
+            return any(matches for matches, _ in results), tags
+        if kind is NotMatcher:
+            # Every submatcher is evaluated, to take its bits
+            results = [self._evaluate(m, found, bits) for m in matcher.matcher]
+            return not any(matches for matches, _ in results), matcher.tags
+        return bool(found & next(bits)), matcher.tags
+
+
+def _needles(matcher) -> Iterator[Union[str, re.Pattern]]:
+    if isinstance(matcher, list):
+        for i in matcher:
+            yield from _needles(i)
+    else:
+        yield matcher
+
+
+def _shape(matcher) -> tuple:
+    "Everything about a matcher that decides which events it matches and the tags it gives them"
+    kind = type(matcher)
+    if kind not in (AndMatcher, OrMatcher, NotMatcher, NameTagger, ClassMatcher):
+        raise TypeError(f"Can't compile a {kind.__name__}")
+    tags = tuple(matcher.tags or ())
+    if kind in (AndMatcher, OrMatcher, NotMatcher):
+        return kind.__name__, tags, tuple(_shape(m) for m in matcher.matcher)
+    return kind.__name__, tags, matcher.case_sensitive, tuple(
+        (i.pattern, i.flags) if isinstance(i, re.Pattern) else i for i in _needles(matcher.matcher))
+
+
+def fingerprint(matchers: list) -> str:
+    """
+    :return: A digest of the matchers, which is the same for matchers that tag every event alike
+    :raises TypeError: If there are matchers that can't be compiled
+    """
+    return hashlib.sha1(repr([_shape(m) for m in matchers]).encode('utf-8')).hexdigest()
+
+
+_compiled: OrderedDict[str, CompiledMatchers] = collections.OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def compiled(matchers: list) -> CompiledMatchers:
+    """
+    Compile matchers, or find them compiled already, along with the tags of the events they were used on.
+
+    :param matchers: The matchers, of the types :py:func:`timetracker.report.from_json` makes
+    :raises TypeError: If there are matchers of other types
+    """
+    key = fingerprint(matchers)
+    with _compiled_lock:
+        c = _compiled.get(key)
+        if c is not None:
+            _compiled.move_to_end(key)
+            return c
+    c = CompiledMatchers(matchers)
+    with _compiled_lock:
+        c = _compiled.setdefault(key, c)
+        if len(_compiled) > _COMPILED_SIZE:
+            _compiled.popitem(last=False)
+    return c
+
+
+class _Class(NamedTuple):
+    name: str
+
+
+class Title(NamedTuple):
+    "A title and its classes, which the matchers can be asked about in place of an event"
+    window_name: str
+    classes: list[_Class]
+
+    @staticmethod
+    def of(key: tuple[str, Iterable[str]]) -> Title:
+        """
+        :param key: A title and the names of its classes
+        """
+        return Title(key[0], [_Class(c) for c in key[1]])
+
+
+def _hits(matchers: list, keys: list[tuple[str, tuple[str, ...]]]) -> list[int]:
+    "The bits of the matchers that match each title and its classes, worked out in one of the processes"
+    c = compiled(matchers)
+    return [c.hits(Title.of(key)) for key in keys]
+
+
+_pool: Optional[tuple[int, concurrent.futures.ProcessPoolExecutor]] = None
+_pool_lock = threading.Lock()
+
+
+def _processes(workers: int) -> concurrent.futures.ProcessPoolExecutor:
+    "The pool of processes, which is kept for the next reports"
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool[0] != workers:
+            if _pool is not None:
+                _pool[1].shutdown(wait=False)
+            # Spawned rather than forked, since reports are made on the threads of the report server
+            _pool = workers, concurrent.futures.ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool[1]
+
+
+def _discard(pool: concurrent.futures.ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[1] is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def in_parallel(matchers: CompiledMatchers, events: list, workers: Optional[int] = TAGGING_WORKERS,
+                threshold: int = PARALLEL_TITLES, chunk_size: int = _CHUNK_SIZE) -> list[tuple[Any, list[str]]]:
+    """
+    Tag events like :py:func:`timetracker.report.process_events`, matching the titles and classes that haven't been
+    tagged before in a pool of processes.
+
+    Only the titles and the names of the classes are sent to the processes, and only the bits of the matchers that
+    matched come back, the tags are worked out from those and kept here.
+
+    :param matchers: The compiled matchers
+    :param events: The events to tag
+    :param workers: The number of processes, None for one for each cpu
+    :param threshold: The fewest titles to use the processes for, fewer are matched here
+    :param chunk_size: The number of titles to send to a process at a time
+    :return: Each event with its tags, in the same order
+    """
+    keys = [(e.window_name or '', frozenset(c.name for c in e.classes)) for e in events]
+    tags = {}
+    missing = []
+    for key in dict.fromkeys(keys):
+        found = matchers.titles.get(key)
+        if found is None:
+            missing.append(key)
+        else:
+            tags[key] = found
+    workers = workers or os.cpu_count() or 1
+    if missing and len(missing) >= threshold and workers > 1:
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        pool = _processes(workers)
+        try:
+            results = pool.map(_hits, itertools.repeat(matchers.matchers),
+                               [[(title, tuple(classes)) for title, classes in chunk] for chunk in chunks])
+            for chunk, hits in zip(chunks, results):
+                for key, found in zip(chunk, hits):
+                    tags[key] = tuple(matchers._tags(found))
+                    matchers.titles.put(key, tags[key])
+        except concurrent.futures.process.BrokenProcessPool:
+            # The rest are matched here, and a new pool is started next time
+            _discard(pool)
+    for key in missing:
+        if key not in tags:
+            tags[key] = tuple(matchers._tags(matchers.hits(Title.of(key))))
+            matchers.titles.put(key, tags[key])
+    return [(e, list(tags[key])) for e, key in zip(events, keys)]
@@ -0,0 +1,120 @@
+"""
+Brings databases made by older versions of the tracker up to date.
+
+The schema version of a database is kept in its `SchemaVersion` table. Each entry of :py:data:`MIGRATIONS` moves a
+database one version forward, and :py:func:`migrate` applies the ones a database hasn't had yet, each in its own
+transaction along with the new version number. A new database is created from the models as they are and starts at the
+latest version. Tables that don't exist at all are created from the models before migrating too, so a migration must
+tolerate finding a table already in its latest form.
+
+Migrations only use plain SQL that sqlite and SQLCipher share. Changes to the models should come with a migration that
+makes the same change to existing databases.
+"""
+from __future__ import annotations
+
+from typing import *
+
+import sqlalchemy
+
+import timetracker.models as models
+
+VERSION_TABLE = 'SchemaVersion'
+
+
+def _columns(connection: sqlalchemy.engine.Connection, table: str) -> set[str]:
+    return {i['name'] for i in sqlalchemy.inspect(connection).get_columns(table)}
+
+
+def _add_column(connection: sqlalchemy.engine.Connection, table: str, column: str, kind: str) -> None:
+    if column not in _columns(connection, table):
+        connection.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {kind}')
+
+
+def _create_index(connection: sqlalchemy.engine.Connection, name: str, table: str, columns: list[str]) -> None:
+    columns = ', '.join(f'"{i}"' for i in columns)
+    connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({columns})')
+
+
+def session_boundaries(connection: sqlalchemy.engine.Connection) -> None:
+    "Record when sessions end and how many samples they took"
+    _add_column(connection, 'Session', 'end', 'DATETIME')
+    _add_column(connection, 'Session', 'samples', 'INTEGER')
+
+
+def event_indexes(connection: sqlalchemy.engine.Connection) -> None:
+    "Index events by time, title and session, and event classes by class"
+    _create_index(connection, 'ix_WindowEvent_time', 'WindowEvent', ['time_start', 'time_end'])
+    if 'window_name' in _columns(connection, 'WindowEvent'):
+        _create_index(connection, 'ix_WindowEvent_window_name', 'WindowEvent', ['window_name', 'time_start'])
+    _create_index(connection, 'ix_WindowEvent_session_id', 'WindowEvent', ['session_id'])
+    _create_index(connection, 'ix_EventClass_class_id', 'EventClass', ['class_id'])
+    connection.exec_driver_sql('ANALYZE')
+
+
+def window_titles(connection: sqlalchemy.engine.Connection) -> None:
+    "Store each window title once, in WindowTitle, and refer to it from the events"
+    if 'window_name' not in _columns(connection, 'WindowEvent'):
+        return
+    _add_column(connection, 'WindowEvent', 'title_id', 'INTEGER REFERENCES "WindowTitle" (id)')
+    connection.exec_driver_sql('INSERT OR IGNORE INTO "WindowTitle" (name) '
+                               'SELECT window_name FROM "WindowEvent" WHERE window_name IS NOT NULL ORDER BY id')
+    connection.exec_driver_sql('UPDATE "WindowEvent" SET title_id = '
+                               '(SELECT id FROM "WindowTitle" WHERE "WindowTitle".name = "WindowEvent".window_name)')
+    # The search index was over the events' titles, it is made again over the titles themselves
+    for trigger in ['insert', 'delete', 'update']:
+        connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS "WindowEventTitle_{trigger}"')
+    connection.exec_driver_sql('DROP TABLE IF EXISTS "WindowEventTitle"')
+    connection.exec_driver_sql('DROP INDEX IF EXISTS "ix_WindowEvent_window_name"')
+    _create_index(connection, 'ix_WindowEvent_title_id', 'WindowEvent', ['title_id', 'time_start'])
+    library = tuple(map(int, connection.exec_driver_sql('SELECT sqlite_version()').scalar().split('.')[:2]))
+    if library >= (3, 35):
+        connection.exec_driver_sql('ALTER TABLE "WindowEvent" DROP COLUMN window_name')
+    else:
+        # Older libraries, as some SQLCipher builds have, can't drop columns, so the titles are only emptied
+        connection.exec_driver_sql('UPDATE "WindowEvent" SET window_name = NULL')
+
+
+MIGRATIONS: list[Callable[[sqlalchemy.engine.Connection], None]] = [
+    session_boundaries,
+    event_indexes,
+    window_titles,
+]
+"The migrations in the order they are applied, the schema version of a database is the number of them it has had"
+
+
+def version(connection: sqlalchemy.engine.Connection) -> int:
+    """
+    :param connection: A connection to the database
+    :return: The number of migrations the database has had
+    """
+    connection.exec_driver_sql(f'CREATE TABLE IF NOT EXISTS "{VERSION_TABLE}" (version INTEGER NOT NULL)')
+    current = connection.exec_driver_sql(f'SELECT max(version) FROM "{VERSION_TABLE}"').scalar()
+    return current or 0
+
+
+def migrate(bind: sqlalchemy.engine.Engine, target: int = len(MIGRATIONS), verbose: bool = True) -> int:
+    """
+    Create the missing tables and apply the migrations the database hasn't had yet.
+
+    :param bind: The engine of the database
+    :param target: The version to migrate up to, the latest by default
+    :param verbose: Whether to print the migrations as they are applied
+    :return: The number of migrations applied
+    """
+    inspector = sqlalchemy.inspect(bind)
+    fresh = not any(inspector.has_table(i) for i in models.Base.metadata.tables)
+    models.Base.metadata.create_all(bind)
+    with bind.begin() as connection:
+        current = version(connection)
+        if fresh:
+            # The tables were just made as the models describe them, there is nothing to migrate
+            connection.exec_driver_sql(f'INSERT INTO "{VERSION_TABLE}" (version) VALUES ({len(MIGRATIONS)})')
+            return 0
+    for n in range(current, target):
+        with bind.begin() as connection:
+            if verbose:
+                print(f"Migrating the database to version {n + 1}: {MIGRATIONS[n].__doc__}")
+            MIGRATIONS[n](connection)
+            connection.exec_driver_sql(f'DELETE FROM "{VERSION_TABLE}"')
+            connection.exec_driver_sql(f'INSERT INTO "{VERSION_TABLE}" (version) VALUES ({n + 1})')
+    return max(0, target - current)
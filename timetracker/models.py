@@ -1,33 +1,180 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
+import operator
 import os
+import threading
 import time
+import weakref
+from collections import OrderedDict
 from functools import cached_property
+from typing import *
 
 import sqlalchemy.orm
-from sqlalchemy import create_engine, Column, Integer, DateTime as DT, ForeignKey, String, Float
+import sqlalchemy.pool
+from sqlalchemy import create_engine, Column, Integer, DateTime as DT, ForeignKey, String, Float, Index
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship, scoped_session
 
-backend = 'sqlite'
-tail, prefix = '', ''
+import timetracker.common
+
+DATABASE = 'timetracker.db'
+_DERIVE_KEY = timetracker.common.Config.get('derive_key', True)
+"Whether to derive the key of an encrypted database once, rather than on every connection"
+_KDF_ALGORITHM = os.getenv('TIMETRACKER_KDF_ALGORITHM', 'sha1')
+"The hash SQLCipher derives keys with, sha1 for databases made with SQLCipher 3's defaults"
+
 try:
     import pysqlcipher3
 
-    print("Encryption is available")
-    backend += '+pysqlcipher'
-    key = os.getenv('TIMETRACKER_PASSWORD', None)
-    if key:
-        print("Key found, using encryption")
-        encryption = os.getenv("TIMETRACKER_CIPHER", "aes-256")
-        kdf_iter = os.getenv("TIMETRACKER_KDF", "64000")
-        tail = f"?cipher={encryption}&kdf_iter={kdf_iter}"
-        prefix = f"{key}@/"
+    _ENCRYPTION = True
 except ImportError:
-    pass
+    _ENCRYPTION = False
+
+
+def derive_key(passphrase: str, path: str, kdf_iter: int, cipher: str = 'aes-256') -> Optional[str]:
+    """
+    Derive the raw key of an existing encrypted database from its passphrase, the way SQLCipher does.
+
+    Connections given the raw key skip deriving it, which is what makes opening an encrypted database slow. The key is
+    checked by opening the database with it, as a different version of SQLCipher may derive it differently, see
+    `TIMETRACKER_KDF_ALGORITHM`.
+
+    :param passphrase: The passphrase of the database
+    :param path: The database file, its salt is at the start of it
+    :param kdf_iter: The number of iterations of the key derivation
+    :param cipher: The cipher of the database
+    :return: The key in hex, or None if there is no database yet or the key doesn't open it
+    """
+    try:
+        with open(path, 'rb') as f:
+            salt = f.read(16)
+    except FileNotFoundError:
+        return None
+    if len(salt) < 16:
+        return None
+    key = hashlib.pbkdf2_hmac(_KDF_ALGORITHM, passphrase.encode(), salt, kdf_iter, 32).hex()
+    from pysqlcipher3 import dbapi2
+    connection = dbapi2.connect(path)
+    try:
+        connection.execute(f'PRAGMA key = "x\'{key}\'"')
+        connection.execute(f'PRAGMA cipher = "{cipher}"')
+        connection.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        return key
+    except dbapi2.DatabaseError:
+        return None
+    finally:
+        connection.close()
+
+
+def database_url(encrypted: bool = _ENCRYPTION, path: str = DATABASE) -> tuple[sqlalchemy.engine.URL, dict]:
+    """
+    Work out how to connect to the database, encrypted if SQLCipher is available and a key is given in the environment.
+
+    The key is either the passphrase in `TIMETRACKER_PASSWORD`, or the raw key in hex in `TIMETRACKER_RAW_KEY`. The
+    cipher and the iterations of the key derivation are taken from `TIMETRACKER_CIPHER` and `TIMETRACKER_KDF`.
+
+    :param encrypted: Whether SQLCipher is available
+    :param path: The database file
+    :return: The url of the database and the other arguments to create its engine with
+    """
+    url = sqlalchemy.engine.URL.create('sqlite', database=path)
+    # Every session opens the database again, which is cheap once the key of an encrypted one has been derived, and
+    # keeps each connection on the thread that opened it
+    options = {'poolclass': sqlalchemy.pool.NullPool}
+    if not encrypted:
+        return url, options
+    url = url.set(drivername='sqlite+pysqlcipher')
+    key, raw_key = os.getenv('TIMETRACKER_PASSWORD', None), os.getenv('TIMETRACKER_RAW_KEY', None)
+    if not key and not raw_key:
+        return url, options
+    print("Key found, using encryption")
+    cipher, kdf_iter = os.getenv("TIMETRACKER_CIPHER", "aes-256"), os.getenv("TIMETRACKER_KDF", "64000")
+    if not raw_key and _DERIVE_KEY:
+        raw_key = derive_key(key, path, int(kdf_iter), cipher)
+    url = url.set(password=f"x'{raw_key}'" if raw_key else key, query={'cipher': cipher, 'kdf_iter': kdf_iter})
+    return url, options
+
+
+PRAGMA_PROFILES: dict[str, dict[str, Union[int, str]]] = {
+    'tracker': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'mmap_size': 64 << 20, 'cache_size': -8192,
+                'temp_store': 'MEMORY', 'busy_timeout': 5000},
+    'report': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'mmap_size': 256 << 20, 'cache_size': -32768,
+               'temp_store': 'MEMORY', 'busy_timeout': 10000},
+}
+"""
+The pragmas each kind of process sets on its connections, before the `sqlite_pragmas` setting is applied over them.
+
+With the write ahead log the report server can read while the tracker writes, and synchronous=NORMAL only syncs the log
+at checkpoints rather than at every commit. The tracker writes small batches, while reports read a lot of the database,
+so reports get the larger caches.
+"""
+_PRAGMA_SETTINGS = timetracker.common.Config.get('sqlite_pragmas', None) or {}
+"The pragmas to change from those of the profiles, by profile, such as `{\"tracker\": {\"synchronous\": \"FULL\"}}`"
+_profiles: MutableMapping[sqlalchemy.engine.Engine, str] = weakref.WeakKeyDictionary()
+
+
+def pragmas(role: str) -> dict[str, Union[int, str]]:
+    """
+    :param role: The name of a profile in :py:data:`PRAGMA_PROFILES`
+    :return: The pragmas of the profile with the ones configured for it in the `sqlite_pragmas` setting applied over them
+    """
+    return {**PRAGMA_PROFILES[role], **_PRAGMA_SETTINGS.get(role, {})}
+
+
+def use_profile(bind: sqlalchemy.engine.Engine, role: str) -> None:
+    """
+    Set the pragmas of a profile on every connection an engine makes from now on.
+
+    The connections the engine already has are closed, so that none are left without the profile.
+
+    :param bind: An engine of a sqlite or SQLCipher database
+    :param role: The name of a profile in :py:data:`PRAGMA_PROFILES`
+    """
+    if bind not in _profiles:
+        @sqlalchemy.event.listens_for(bind, 'connect')
+        def _apply_profile(dbapi_connection, connection_record) -> None:
+            # SQLCipher's dialect sets the key before this, as it has to come before any other statement
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas(_profiles[bind]).items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+            cursor.close()
+    _profiles[bind] = role
+    bind.dispose()
+
+
+_engine: Optional[sqlalchemy.engine.Engine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> sqlalchemy.engine.Engine:
+    """
+    The engine of the database, made the first time it is needed rather than when the models are imported, so that the
+    processes that only tag titles never derive the key of an encrypted database.
+
+    :return: The engine, with the tracker's pragmas unless another profile has been set on it since
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            if _ENCRYPTION:
+                print("Encryption is available")
+            url, options = database_url()
+            _engine = create_engine(url, **options)
+            use_profile(_engine, 'tracker')
+        return _engine
 
-engine = create_engine(f'{backend}://{prefix}/timetracker.db{tail}')
-session = scoped_session(sessionmaker(bind=engine))
+
+def __getattr__(name: str):
+    # `engine` is made on first use, see get_engine
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_sessions = sessionmaker()
+session = scoped_session(lambda: _sessions(bind=get_engine()))
 Base = declarative_base()
 
 
@@ -39,8 +186,27 @@ class SessionObject(Base):
     id = Column(Integer, primary_key=True)
     date = Column(DT)
     "The time when the session started"
+    end = Column(DT)
+    "The end of the last sample of the session, set when the session is closed"
+    samples = Column(Integer, default=0)
+    "The number of samples taken during the session, set when the session is closed"
     events = relationship('WindowEvent', back_populates='session')
 
+    @staticmethod
+    def start(ses: sqlalchemy.orm.Session, id: int) -> SessionObject:
+        """
+        Record the start of a session, or find the record if it has already started.
+
+        :param ses: The sqlalchemy session to add the record to
+        :param id: The id of the session
+        :return: The persistent or pending session object
+        """
+        obj = ses.get(SessionObject, id)
+        if obj is None:
+            obj = SessionObject(id=id, date=datetime.datetime.now(), samples=0)
+            ses.add(obj)
+        return obj
+
     @staticmethod
     def collect_within_time(ses, td: datetime.timedelta) -> list[SessionObject]:
         return ses.query(SessionObject).where(SessionObject.date >= datetime.datetime.now() - td)
@@ -52,12 +218,123 @@ class WindowClass(Base):
     id = Column(Integer, primary_key=True)
     name = Column(Integer, unique=True)
 
+    @staticmethod
+    def lookup(ses: sqlalchemy.orm.Session, name: str) -> WindowClass:
+        """
+        Find the class with the given name, creating it if it has not been seen before.
+
+        :param ses: The sqlalchemy session to query and add the class to
+        :param name: The name of the window class
+        :return: The persistent or pending class object
+        """
+        for i in ses.query(WindowClass).where(WindowClass.name == name):
+            return i
+        wclass = WindowClass(name=name)
+        ses.add(wclass)
+        return wclass
+
+
+class WindowTitle(Base):
+    "The titles of the windows seen before, each stored once however many events it has"
+    __tablename__ = 'WindowTitle'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+    @staticmethod
+    def lookup(ses: sqlalchemy.orm.Session, name: str) -> WindowTitle:
+        """
+        Find the title with the given text, creating it if it has not been seen before.
+
+        :param ses: The sqlalchemy session to query and add the title to
+        :param name: The text of the title
+        :return: The persistent or pending title object
+        """
+        with ses.no_autoflush:
+            for i in ses.query(WindowTitle).where(WindowTitle.name == name):
+                return i
+        title = WindowTitle(name=name)
+        ses.add(title)
+        return title
+
+
+class WindowClassCache:
+    """
+    A bounded, least recently used mapping of class names to the `WindowClass` rows of a single session.
+
+    Keeps a long-running session from querying for the same handful of classes over and over. Classes created since
+    the last commit are forgotten if the transaction is rolled back, as their rows no longer exist.
+
+    :ivar rows: The cached classes, from least to most recently used
+    """
+    model = WindowClass
+    "The kind of row cached, which has a `name` and a `lookup` like :py:meth:`WindowClass.lookup`"
+    rows: OrderedDict[str, WindowClass]
+
+    def __init__(self, maxsize: int = 1024):
+        """
+        :param maxsize: The number of classes to keep before discarding the least recently used one
+        """
+        self.maxsize = maxsize
+        self.rows = OrderedDict()
+        self._uncommitted = set()
+
+    def preload(self, ses: sqlalchemy.orm.Session) -> None:
+        """
+        Fill the cache with the most recently created classes.
+
+        :param ses: The session the cached rows will belong to
+        """
+        for i in reversed(ses.query(self.model).order_by(self.model.id.desc()).limit(self.maxsize).all()):
+            self.rows[i.name] = i
+
+    def lookup(self, ses: sqlalchemy.orm.Session, name: str) -> WindowClass:
+        """
+        Get the class with the given name, only querying for it if it is not cached.
+
+        :param ses: The session the cached rows belong to
+        :param name: The name of the window class
+        :return: The persistent or pending class object
+        """
+        wclass = self.rows.get(name)
+        if wclass is not None:
+            self.rows.move_to_end(name)
+            return wclass
+        wclass = self.model.lookup(ses, name)
+        if sqlalchemy.inspect(wclass).pending:
+            self._uncommitted.add(name)
+        self.rows[name] = wclass
+        if len(self.rows) > self.maxsize:
+            self._uncommitted.discard(self.rows.popitem(last=False)[0])
+        return wclass
+
+    def commit(self) -> None:
+        """
+        Mark every cached class as saved, call this after the session commits.
+        """
+        self._uncommitted.clear()
+
+    def rollback(self) -> None:
+        """
+        Forget the classes created since the last commit, call this after the session rolls back.
+        """
+        for i in self._uncommitted:
+            self.rows.pop(i, None)
+        self._uncommitted.clear()
+
+
+class WindowTitleCache(WindowClassCache):
+    """
+    A :py:class:`WindowClassCache` of `WindowTitle` rows.
+    """
+    model = WindowTitle
+
 
 class EventClass(Base):
     "The association between `WindowEvent` and `WindowClass`"
     __tablename__ = 'EventClass'
     event_id = Column(Integer, ForeignKey('WindowEvent.id', ondelete='cascade'), primary_key=True)
     class_id = Column(Integer, ForeignKey('WindowClass.id'), primary_key=True)
+    __table_args__ = (Index('ix_EventClass_class_id', 'class_id'),)
 
 
 class WindowEvent(Base):
@@ -65,12 +342,15 @@ class WindowEvent(Base):
     A single measurement of usage duration of a single window.
     """
     __tablename__ = 'WindowEvent'
+    __table_args__ = (Index('ix_WindowEvent_time', 'time_start', 'time_end'),
+                      Index('ix_WindowEvent_title_id', 'title_id', 'time_start'),
+                      Index('ix_WindowEvent_session_id', 'session_id'))
     id = Column(Integer, primary_key=True)
     "The id"
     session_id = Column(Integer, ForeignKey('Session.id'), nullable=False)
     "The id of the session this event was recorded during. used anywhere yet."
-    window_name = Column(String)
-    "The title of the focused window during the measurement"
+    title_id = Column(Integer, ForeignKey('WindowTitle.id'))
+    "The id of the title of the focused window during the measurement"
     window_id = Column(Integer)
     "The id of the window during the measurement"
     time_start = Column(DT)
@@ -81,11 +361,36 @@ class WindowEvent(Base):
     "Relationship with the session"
     classes = relationship('WindowClass', secondary='EventClass', backref='events', lazy='joined')
     "The list of associated classes."
+    title = relationship('WindowTitle', lazy='joined')
+    "The title of the focused window during the measurement"
     mouse_motion = Column(Float, default=0)
     "The number of pixels that the mouse pointer has traversed"
     keystrokes = Column(Integer, default=0)
     "The number of keypresses recorded"
 
+    @hybrid_property
+    def window_name(self) -> Optional[str]:
+        """
+        The title of the focused window during the measurement.
+
+        Setting it on an event that isn't in a session yet creates a new `WindowTitle`, which is swapped for the
+        existing one with the same text when the event is flushed.
+        In queries it is a subquery for each event, join :py:attr:`title` instead when filtering many events by it.
+        """
+        return self.title.name if self.title is not None else None
+
+    @window_name.setter
+    def window_name(self, name: Optional[str]) -> None:
+        if name is None:
+            self.title = None
+        elif self.title is None or self.title.name != name:
+            ses = sqlalchemy.orm.object_session(self)
+            self.title = WindowTitle.lookup(ses, name) if ses is not None else WindowTitle(name=name)
+
+    @window_name.expression
+    def window_name(cls):
+        return sqlalchemy.select(WindowTitle.name).where(WindowTitle.id == cls.title_id).scalar_subquery()
+
     def should_merge(self, b: WindowEvent, threshold: int):
         return b.window_name == self.window_name and \
                (b.time_start - self.time_end).total_seconds() < threshold
@@ -96,31 +401,93 @@ class WindowEvent(Base):
         self.mouse_motion = (self.mouse_motion or 0.0) + (b.mouse_motion or 0.0)
 
     @staticmethod
-    def merge_within(ses: sqlalchemy.orm.Session, threshold: float) -> int:
+    def start_of_recent_days(ses: sqlalchemy.orm.Session, days: int) -> Optional[datetime.datetime]:
+        """
+        Find where the most recent days with events begin, reading back from the latest event.
+
+        :param ses: The sqlalchemy session object to make the query in
+        :param days: The number of days with events to include
+        :return: The midnight at the start of the earliest of those days, or None if there are no more days than that
+        """
+        seen = []
+        for start, in ses.query(WindowEvent.time_start).order_by(WindowEvent.time_start.desc()).yield_per(1000):
+            if not seen or start.date() != seen[-1]:
+                if len(seen) == days:
+                    return datetime.datetime.combine(seen[-1], datetime.time())
+                seen.append(start.date())
+        return None
+
+    @staticmethod
+    def merge_within(ses: sqlalchemy.orm.Session, threshold: float, chunk_size: int = 10000,
+                     incremental: bool = True, until: Optional[datetime.datetime] = None) -> int:
         """
         Merge all mostly identical events within threshold seconds of each other.
 
+        Events are read in order of their start in chunks of plain rows, and each chunk's changes are written with a
+        handful of statements and committed along with how far the merge got. The next incremental merge with the same
+        threshold continues from there, rather than going over the whole history again.
+
         :param ses: The sqlalchemy session object to make the queries and changes in
         :param threshold: The number of seconds apart two otherwise identical events may be to be merged
+        :param chunk_size: The number of events to read at once
+        :param incremental: Whether to start from where the last merge with this threshold stopped
+        :param until: Leave the events starting from this on alone, such as the one a running tracker is extending
         :return: The number of events removed in the consolidation process
         """
-        idx = 0
+        table = WindowEvent.__table__
+        watermark = ses.get(MergeWatermark, threshold) or MergeWatermark(threshold=threshold)
+        columns = [table.c.id, table.c.title_id, table.c.time_start, table.c.time_end, table.c.keystrokes,
+                   table.c.mouse_motion]
+        position = (watermark.time_start, watermark.event_id) if incremental and watermark.time_start else None
+        # The event the last merge stopped at is read again, as the events after it may be merged into it
+        after = operator.ge
+        current = None
+        dirty = False
         deletions = 0
-        with ses.begin() as s:
-            l = list(ses.query(WindowEvent).order_by(WindowEvent.time_start))
-            while idx < len(l) - 1:
-                a = l[idx]
-                b = l[idx + 1]
-
-                delete = a.should_merge(b, threshold)
-                if delete:
-                    a.merge(b, threshold)
-                    del l[idx + 1]
-                    ses.delete(b)
-                    deletions += 1
+        while True:
+            query = sqlalchemy.select(*columns).order_by(table.c.time_start, table.c.id).limit(chunk_size)
+            if position:
+                query = query.where(sqlalchemy.or_(table.c.time_start > position[0],
+                                                   sqlalchemy.and_(table.c.time_start == position[0],
+                                                                   after(table.c.id, position[1]))))
+            if until is not None:
+                query = query.where(table.c.time_start < until)
+            rows = ses.execute(query).all()
+            updates, deleted = [], []
+            for row in rows:
+                if current is not None and row.title_id == current['title_id'] and \
+                        (row.time_start - current['time_end']).total_seconds() < threshold:
+                    current['time_end'] = row.time_end
+                    current['keystrokes'] = (current['keystrokes'] or 0) + (row.keystrokes or 0)
+                    current['mouse_motion'] = (current['mouse_motion'] or 0.0) + (row.mouse_motion or 0.0)
+                    deleted.append(row.id)
+                    dirty = True
                 else:
-                    idx += 1
-        return deletions
+                    if dirty:
+                        updates.append(current)
+                    current, dirty = dict(row._mapping), False
+            if current is not None and dirty:
+                # It may yet grow, but is written as it stands along with the watermark
+                updates.append(dict(current))
+            if updates:
+                ses.execute(table.update().where(table.c.id == sqlalchemy.bindparam('event_id')).values(
+                    time_end=sqlalchemy.bindparam('time_end'), keystrokes=sqlalchemy.bindparam('keystrokes'),
+                    mouse_motion=sqlalchemy.bindparam('mouse_motion')),
+                    [{'event_id': i['id'], 'time_end': i['time_end'], 'keystrokes': i['keystrokes'],
+                      'mouse_motion': i['mouse_motion']} for i in updates])
+            for i in range(0, len(deleted), 500):
+                ids = deleted[i:i + 500]
+                ses.execute(EventClass.__table__.delete().where(EventClass.__table__.c.event_id.in_(ids)))
+                ses.execute(EventTag.__table__.delete().where(EventTag.__table__.c.event_id.in_(ids)))
+                ses.execute(table.delete().where(table.c.id.in_(ids)))
+            deletions += len(deleted)
+            if current is not None:
+                watermark.time_start, watermark.event_id = current['time_start'], current['id']
+                ses.add(watermark)
+            ses.commit()
+            if len(rows) < chunk_size:
+                return deletions
+            position, after = (rows[-1].time_start, rows[-1].id), operator.gt
 
     @cached_property
     def date_of(self) -> tuple[int, int, int]:
@@ -138,10 +505,135 @@ class WindowEvent(Base):
         return self.time_end - self.time_start
 
 
+class MergeWatermark(Base):
+    """
+    How far :py:meth:`WindowEvent.merge_within` has got with a threshold
+    """
+    __tablename__ = 'MergeWatermark'
+    threshold = Column(Float, primary_key=True)
+    "The threshold of the merge"
+    time_start = Column(DT)
+    "The start of the last event the merge reached, which later events may still be merged into"
+    event_id = Column(Integer)
+    "The id of that event"
+
+
+class JournalSegment(Base):
+    """
+    A journal segment that has been folded into the `WindowEvent` table, see :py:mod:`timetracker.journal`
+    """
+    __tablename__ = 'JournalSegment'
+    id = Column(Integer, primary_key=True)
+    "The number of the segment"
+
+
+class Rollup(Base):
+    """
+    The totals of the events in an hour, day or month with a tag or window class, see :py:mod:`timetracker.rollup`
+    """
+    __tablename__ = 'Rollup'
+    kind = Column(String, primary_key=True)
+    "Either 'tag' or 'class'"
+    period = Column(String, primary_key=True)
+    "Either 'hour', 'day' or 'month'"
+    bucket = Column(DT, primary_key=True)
+    "The start of the period"
+    key = Column(String, primary_key=True)
+    "The tag or the name of the class"
+    duration = Column(Float, nullable=False)
+    "The number of seconds of the events within the period"
+    keystrokes = Column(Integer, nullable=False)
+    "The keystrokes of the events starting within the period"
+    mouse_motion = Column(Float, nullable=False)
+    "The mouse motion of the events starting within the period"
+    events = Column(Integer, nullable=False)
+    "The number of events starting within the period"
+
+
+class RollupState(Base):
+    """
+    How far the rollups of a kind have got, and what they were computed with
+    """
+    __tablename__ = 'RollupState'
+    kind = Column(String, primary_key=True)
+    version = Column(String)
+    "A digest of the matchers the tags were found with"
+    time_start = Column(DT)
+    "The start of the last event rolled up"
+    event_id = Column(Integer)
+    "The id of that event"
+    clip = Column(DT)
+    "Where the rollups were cleared from, the parts after it of the events that started before it are still to be added"
+
+
+class Tag(Base):
+    "The tags the matchers have given events, each stored once"
+    __tablename__ = 'Tag'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class EventTag(Base):
+    """
+    A tag of an event, from the matchers of the :py:class:`TagState`, see :py:mod:`timetracker.tagging`
+    """
+    __tablename__ = 'EventTag'
+    event_id = Column(Integer, ForeignKey('WindowEvent.id', ondelete='cascade'), primary_key=True)
+    tag_id = Column(Integer, ForeignKey('Tag.id'), primary_key=True)
+    __table_args__ = (Index('ix_EventTag_tag_id', 'tag_id'),)
+
+
+class TagState(Base):
+    """
+    What the events in `EventTag` were tagged with, and how far the tagging has got
+    """
+    __tablename__ = 'TagState'
+    version = Column(String, primary_key=True)
+    "A digest of the matchers, see :py:func:`timetracker.matching.fingerprint`"
+    event_id = Column(Integer, nullable=False)
+    "The id of the last event tagged, the events after it are still to be tagged"
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'before_flush')
+def _intern_titles(ses: sqlalchemy.orm.Session, context, instances) -> None:
+    """
+    Make the events that were given the text of a title refer to the stored title with that text, if there is one.
+    """
+    new = [i for i in ses.new if isinstance(i, WindowTitle)]
+    if not new:
+        return
+    with ses.no_autoflush:
+        known = {i.name: i for i in ses.query(WindowTitle).where(WindowTitle.name.in_({i.name for i in new}))}
+    replaced = {}
+    for title in new:
+        kept = known.setdefault(title.name, title)
+        if kept is not title:
+            replaced[title] = kept
+    if not replaced:
+        return
+    for event in list(ses.new) + list(ses.dirty):
+        if isinstance(event, WindowEvent) and event.title in replaced:
+            event.title = replaced[event.title]
+    for title in replaced:
+        ses.expunge(title)
+
+
 current_time = time.monotonic_ns()
+"The id of the session of this process"
 
 
-def session_object():
-    for i in session.query(SessionObject).where(SessionObject.id == current_time):
-        return i
-    return SessionObject(id=current_time)
+def create_tables(bind: Optional[sqlalchemy.engine.Engine] = None) -> None:
+    """
+    Create the tables that don't exist yet and bring the existing ones up to date, see :py:mod:`timetracker.migrations`.
+
+    On sqlite this also sets up the index :py:mod:`timetracker.search` uses.
+
+    :param bind: The engine of the database, the usual one by default
+    """
+    from timetracker.migrations import migrate
+    bind = bind or get_engine()
+    migrate(bind)
+    if bind.dialect.name == 'sqlite':
+        from timetracker.search import create_title_index
+        with bind.begin() as connection:
+            create_title_index(connection)
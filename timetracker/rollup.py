@@ -0,0 +1,343 @@
+"""
+Totals of the time, keystrokes and mouse motion spent on each tag and window class, by hour, day and month.
+
+Summaries over months or years would otherwise have to tag every event of them on every request. Instead,
+:py:func:`update` adds the events that were written since it last ran to the totals in the `Rollup` table, and
+:py:func:`totals` reads them back, which for a year by month is a few rows per tag.
+
+Each kind of rollup keeps its own place in the events, in `RollupState`. The tag rollups also keep a digest of the
+matchers the tags came from, and are computed again from the start when the matchers change. Events that are changed
+after being rolled up, as merging does, have to be followed by :py:func:`invalidate`.
+
+An event's time is split between the hours it covers, while its keystrokes and motion count towards the hour it starts
+in. The event a running tracker is extending, the latest one, is left for later.
+"""
+from __future__ import annotations
+
+import collections
+import datetime
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import *
+
+import sqlalchemy
+import sqlalchemy.orm
+from sqlalchemy.dialects.sqlite import insert
+
+import timetracker.archive as archive
+from timetracker.models import Rollup, RollupState, WindowEvent
+from timetracker.matching import compiled
+
+KINDS = ['tag', 'class']
+PERIODS = ['hour', 'day', 'month']
+_HOUR = datetime.timedelta(hours=1)
+_LONGEST_EVENT = datetime.timedelta(days=1)
+"How far before where the rollups were cleared from to look for events that reach past it"
+_lock = threading.Lock()
+
+
+class Total(NamedTuple):
+    bucket: datetime.datetime
+    "The start of the period"
+    key: str
+    "The tag or the name of the class"
+    duration: datetime.timedelta
+    keystrokes: int
+    mouse_motion: float
+    events: int
+
+    def as_json(self) -> dict:
+        return {'bucket': self.bucket.isoformat(), 'key': self.key, 'duration': self.duration.total_seconds(),
+                'keystrokes': self.keystrokes, 'mouse_motion': self.mouse_motion, 'events': self.events}
+
+
+def version(kind: str, matchers: list) -> str:
+    """
+    :return: A digest of what the rollups of a kind depend on, the matchers in the case of tags
+    """
+    if kind != 'tag':
+        return kind
+    return hashlib.sha1(json.dumps([m.as_json() for m in matchers], sort_keys=True).encode()).hexdigest()
+
+
+def _truncate(t: datetime.datetime, period: str) -> datetime.datetime:
+    t = t.replace(minute=0, second=0, microsecond=0)
+    if period == 'hour':
+        return t
+    t = t.replace(hour=0)
+    return t if period == 'day' else t.replace(day=1)
+
+
+def _buckets(t: datetime.datetime) -> tuple[tuple[str, datetime.datetime], ...]:
+    "The starts of the periods a time falls in"
+    hour = t.replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    return ('hour', hour), ('day', day), ('month', day.replace(day=1))
+
+
+def _hours(start: datetime.datetime, end: datetime.datetime) -> Iterator[tuple[datetime.datetime, float]]:
+    "The number of seconds between two times within each hour they cover"
+    t = start
+    while t < end:
+        hour = _truncate(t, 'hour')
+        until = min(end, hour + _HOUR)
+        yield hour, (until - t).total_seconds()
+        t = until
+
+
+class _Totals:
+    """
+    The totals of a chunk of events, before they are added to the table.
+    """
+
+    def __init__(self, kinds: list[str], matchers: list):
+        self.kinds = kinds
+        self.matchers = compiled(matchers) if 'tag' in kinds else None
+        self.rows = collections.defaultdict(lambda: [0.0, 0, 0.0, 0])
+
+    def keys(self, event) -> list[tuple[str, str]]:
+        keys = []
+        if 'class' in self.kinds:
+            keys.extend(('class', c.name) for c in {c.name: c for c in event.classes}.values())
+        if self.matchers is not None:
+            keys.extend(('tag', i) for i in set(self.matchers.tags(event)))
+        return keys
+
+    def add(self, event, clip: Optional[datetime.datetime] = None) -> None:
+        """
+        :param event: A :py:class:`timetracker.models.WindowEvent` or :py:class:`timetracker.archive.ArchivedEvent`
+        :param clip: Only add what happened from this time on
+        """
+        keys = self.keys(event)
+        if not keys:
+            return
+        start = event.time_start if clip is None else max(clip, event.time_start)
+        for hour, seconds in _hours(start, event.time_end):
+            for period, bucket in _buckets(hour):
+                for kind, key in keys:
+                    self.rows[kind, period, bucket, key][0] += seconds
+        if clip is None or event.time_start >= clip:
+            for period, bucket in _buckets(event.time_start):
+                for kind, key in keys:
+                    row = self.rows[kind, period, bucket, key]
+                    row[1] += event.keystrokes or 0
+                    row[2] += event.mouse_motion or 0.0
+                    row[3] += 1
+
+    def write(self, ses: sqlalchemy.orm.Session) -> None:
+        if not self.rows:
+            return
+        table = Rollup.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.kind, table.c.period, table.c.bucket, table.c.key],
+            set_={i: table.c[i] + statement.excluded[i] for i in ['duration', 'keystrokes', 'mouse_motion', 'events']})
+        ses.execute(statement, [{'kind': kind, 'period': period, 'bucket': bucket, 'key': key, 'duration': duration,
+                                 'keystrokes': keystrokes, 'mouse_motion': motion, 'events': events}
+                                for (kind, period, bucket, key), (duration, keystrokes, motion, events)
+                                in self.rows.items()])
+        self.rows.clear()
+
+
+def _after(position: Optional[tuple[datetime.datetime, int]]):
+    if position is None:
+        return sqlalchemy.true()
+    return sqlalchemy.or_(WindowEvent.time_start > position[0],
+                          sqlalchemy.and_(WindowEvent.time_start == position[0], WindowEvent.id > position[1]))
+
+
+def _chunks(ses: sqlalchemy.orm.Session, position: Optional[tuple[datetime.datetime, int]],
+            until: datetime.datetime, directory: Path, chunk_size: int) -> Iterator[list]:
+    """
+    The events after a position and before a time, in chunks, from the archives and then from the database.
+    """
+    if directory.exists():
+        for month in archive._months(directory):
+            if position is not None and archive._next_month(month) <= position[0].date():
+                continue
+            with archive.Archive(archive.archive_path(directory, month)) as a:
+                events = [e for e in a.between(position and position[0], until)
+                          if position is None or (e.time_start, e.id) > position]
+                for i in range(0, len(events), chunk_size):
+                    yield events[i:i + chunk_size]
+                del events
+    while True:
+        # The classes of a chunk are loaded by the ids of its events, joining them in would read all of EventClass
+        events = ses.query(WindowEvent).options(sqlalchemy.orm.selectinload(WindowEvent.classes)) \
+            .where(_after(position), WindowEvent.time_start < until) \
+            .order_by(WindowEvent.time_start, WindowEvent.id).limit(chunk_size).all()
+        if not events:
+            return
+        yield events
+        if len(events) < chunk_size:
+            return
+        position = events[-1].time_start, events[-1].id
+
+
+def _state(ses: sqlalchemy.orm.Session, kind: str, matchers: list) -> RollupState:
+    state = ses.get(RollupState, kind)
+    current = version(kind, matchers)
+    if state is None or state.version != current:
+        ses.execute(Rollup.__table__.delete().where(Rollup.__table__.c.kind == kind))
+        state = ses.merge(RollupState(kind=kind, version=current, time_start=None, event_id=None, clip=None))
+        ses.commit()
+    return state
+
+
+def _advance(ses: sqlalchemy.orm.Session, states: list[RollupState], totals: _Totals,
+             position: Optional[tuple[datetime.datetime, int]]) -> bool:
+    """
+    Add a chunk's totals and move the states on to a position, unless another process moved them first.
+
+    :return: Whether the totals were added
+    """
+    table = RollupState.__table__
+    for state in states:
+        # Moving the state first takes the write lock, so no one else can add the same events in the meantime
+        moved = ses.execute(table.update().where(
+            table.c.kind == state.kind, table.c.version == state.version, table.c.time_start.op('IS')(state.time_start),
+            table.c.event_id.op('IS')(state.event_id), table.c.clip.op('IS')(state.clip),
+        ).values(time_start=position and position[0], event_id=position and position[1], clip=None)).rowcount
+        if not moved:
+            ses.rollback()
+            return False
+    totals.write(ses)
+    ses.commit()
+    return True
+
+
+def _update(ses: sqlalchemy.orm.Session, states: list[RollupState], matchers: list, until: datetime.datetime,
+            directory: Path, chunk_size: int) -> tuple[int, bool]:
+    """
+    Bring the rollups of the kinds that have got equally far up to date together, reading the events once.
+
+    :return: The number of events added, and whether the rollups are up to date rather than having been moved on by
+             another process
+    """
+    n = 0
+    kinds = [i.kind for i in states]
+    position = (states[0].time_start, states[0].event_id) if states[0].time_start else None
+    if states[0].clip is not None:
+        totals = _Totals(kinds, matchers)
+        for e in _spanning(ses, states[0].clip, directory):
+            totals.add(e, states[0].clip)
+        if not _advance(ses, states, totals, position):
+            return n, False
+    for events in _chunks(ses, position, until, directory, chunk_size):
+        totals = _Totals(kinds, matchers)
+        for e in events:
+            totals.add(e)
+        position = events[-1].time_start, events[-1].id
+        for e in events:
+            if isinstance(e, WindowEvent):
+                ses.expunge(e)
+        if not _advance(ses, states, totals, position):
+            return n, False
+        n += len(events)
+    return n, True
+
+
+def update(ses: sqlalchemy.orm.Session, matchers: list, until: Optional[datetime.datetime] = None,
+           directory: Path = archive.ARCHIVE_DIR, chunk_size: int = 5000) -> int:
+    """
+    Add the events that have been written since the last update to the rollups.
+
+    :param ses: The session to query and write with
+    :param matchers: The matchers to tag the events with, see :py:mod:`timetracker.report`
+    :param until: Leave the events starting from this on for later, by default the latest event, which a running
+                  tracker may still be extending
+    :param directory: Where the archives are kept
+    :param chunk_size: The number of events to add at once
+    :return: The number of events added to the rollups of the kind that was furthest behind
+    """
+    if until is None:
+        until = ses.query(WindowEvent.time_start).order_by(WindowEvent.time_start.desc()).limit(1).scalar()
+        if until is None:
+            return 0
+    n = 0
+    with _lock:
+        done = False
+        while not done:
+            groups = collections.defaultdict(list)
+            for kind in KINDS:
+                state = _state(ses, kind, matchers)
+                groups[state.time_start, state.event_id, state.clip].append(state)
+            done = True
+            for states in groups.values():
+                added, finished = _update(ses, states, matchers, until, directory, chunk_size)
+                n = max(n, added)
+                if not finished:
+                    # Another process got there first, start again from where it got to
+                    done = False
+                    break
+    return n
+
+
+def _spanning(ses: sqlalchemy.orm.Session, clip: datetime.datetime, directory: Path) -> list:
+    "The events that start shortly before a time and end after it"
+    events = [e for e in ses.query(WindowEvent).where(WindowEvent.time_start >= clip - _LONGEST_EVENT,
+                                                      WindowEvent.time_start < clip, WindowEvent.time_end > clip)]
+    month = _truncate(clip - _LONGEST_EVENT, 'month').date()
+    for month in {month, _truncate(clip, 'month').date()}:
+        path = archive.archive_path(directory, month)
+        if path.exists():
+            a = archive.Archive(path)
+            events.extend(e for e in a.between(clip - _LONGEST_EVENT, clip) if e.time_end > clip)
+    return events
+
+
+def invalidate(ses: sqlalchemy.orm.Session, since: datetime.datetime) -> None:
+    """
+    Clear the rollups of the events that may have changed, so that the next update computes them again.
+
+    Whole months are cleared, from the one the time falls in on.
+
+    :param ses: The session to write with
+    :param since: The start of the earliest event that may have changed
+    """
+    clip = _truncate(since, 'month')
+    with _lock:
+        for state in ses.query(RollupState):
+            if state.time_start is None or state.time_start < clip:
+                continue
+            ses.execute(Rollup.__table__.delete().where(Rollup.__table__.c.kind == state.kind,
+                                                        Rollup.__table__.c.bucket >= clip))
+            # Events are read from after this, so every event from the start of the month on is added again
+            state.time_start, state.event_id = clip, 0
+            state.clip = clip if state.clip is None else min(clip, state.clip)
+        ses.commit()
+
+
+def totals(ses: sqlalchemy.orm.Session, kind: str, period: str, start: Optional[datetime.datetime] = None,
+           end: Optional[datetime.datetime] = None) -> list[Total]:
+    """
+    Read the rollups.
+
+    :param ses: The session to query with
+    :param kind: Either 'tag' or 'class'
+    :param period: Either 'hour', 'day', 'month' or 'year', years are added up from the months
+    :param start: The earliest period to include
+    :param end: Where to stop, exclusive
+    :return: The totals of each tag or class in each period, in order of the periods and then their keys
+    """
+    table = Rollup.__table__
+    query = sqlalchemy.select(table.c.bucket, table.c.key, table.c.duration, table.c.keystrokes,
+                              table.c.mouse_motion, table.c.events) \
+        .where(table.c.kind == kind, table.c.period == ('month' if period == 'year' else period)) \
+        .order_by(table.c.bucket, table.c.key)
+    if start is not None:
+        query = query.where(table.c.bucket >= start)
+    if end is not None:
+        query = query.where(table.c.bucket < end)
+    rows = ses.execute(query).all()
+    if period == 'year':
+        years = collections.defaultdict(lambda: [0.0, 0, 0.0, 0])
+        for bucket, key, *values in rows:
+            year = years[bucket.replace(month=1), key]
+            for i, value in enumerate(values):
+                year[i] += value
+        rows = [(bucket, key, *values) for (bucket, key), values in sorted(years.items())]
+    return [Total(bucket, key, datetime.timedelta(seconds=duration), keystrokes, motion, events)
+            for bucket, key, duration, keystrokes, motion, events in rows]
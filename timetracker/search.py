@@ -0,0 +1,166 @@
+"""
+Full text search over the titles of the windows that have been used.
+
+The titles are indexed by an FTS5 table over :py:class:`timetracker.models.WindowTitle` that triggers keep up to date as
+the tracker writes new titles. A search ranks each matching title once, and then only looks at the events with those
+titles instead of scanning all of them. Where the sqlite library lacks FTS5 the search scans the titles instead.
+"""
+from __future__ import annotations
+
+import datetime
+from typing import *
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import timetracker.common
+
+TITLE_INDEX = 'WindowTitleIndex'
+_RANGE_GAP = timetracker.common.Config.get('merge_threshold', 10)
+
+_SCHEMA = [
+    f'''CREATE VIRTUAL TABLE "{TITLE_INDEX}" USING fts5(name, content='WindowTitle', content_rowid='id')''',
+    f'''CREATE TRIGGER "{TITLE_INDEX}_insert" AFTER INSERT ON "WindowTitle" BEGIN
+        INSERT INTO "{TITLE_INDEX}"(rowid, name) VALUES (new.id, new.name);
+    END''',
+    f'''CREATE TRIGGER "{TITLE_INDEX}_delete" AFTER DELETE ON "WindowTitle" BEGIN
+        INSERT INTO "{TITLE_INDEX}"("{TITLE_INDEX}", rowid, name) VALUES ('delete', old.id, old.name);
+    END''',
+    f'''CREATE TRIGGER "{TITLE_INDEX}_update" AFTER UPDATE OF name ON "WindowTitle" BEGIN
+        INSERT INTO "{TITLE_INDEX}"("{TITLE_INDEX}", rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO "{TITLE_INDEX}"(rowid, name) VALUES (new.id, new.name);
+    END''',
+    f'''INSERT INTO "{TITLE_INDEX}"("{TITLE_INDEX}") VALUES ('rebuild')''',
+]
+
+
+class TitleRange(NamedTuple):
+    """
+    A stretch of time spent on windows with the same matching title.
+    """
+    window_name: str
+    time_start: datetime.datetime
+    time_end: datetime.datetime
+
+
+class DayMatches(NamedTuple):
+    """
+    The matches of a search on a single day.
+    """
+    day: datetime.date
+    rank: float
+    "How well the best match of the day matches, lower is better"
+    total: datetime.timedelta
+    "The time spent on matching windows over the day"
+    ranges: list[TitleRange]
+    "The matching time ranges, in order"
+
+    def as_json(self) -> dict:
+        return {'day': self.day.isoformat(), 'rank': self.rank, 'total': self.total.total_seconds(),
+                'ranges': [{'window_name': i.window_name, 'time_start': i.time_start.isoformat(),
+                            'time_end': i.time_end.isoformat()} for i in self.ranges]}
+
+
+def has_fts5(connection: sqlalchemy.engine.Connection) -> bool:
+    """
+    Whether the sqlite library can create FTS5 tables.
+    """
+    options = {i for i, in connection.exec_driver_sql('PRAGMA compile_options')}
+    return 'ENABLE_FTS5' in options
+
+
+def create_title_index(connection: sqlalchemy.engine.Connection) -> bool:
+    """
+    Create the title index over the `WindowTitle` table and the triggers that keep it up to date as titles are added,
+    renamed or removed, and index the titles already stored, unless that has been done already. Each title is indexed
+    once however many events have it.
+
+    :param connection: A connection to the database, in a transaction
+    :return: Whether the database has a title index
+    """
+    if index_exists(connection):
+        return True
+    if not has_fts5(connection):
+        return False
+    for statement in _SCHEMA:
+        connection.exec_driver_sql(statement)
+    return True
+
+
+def index_exists(connection: Union[sqlalchemy.engine.Connection, sqlalchemy.orm.Session]) -> bool:
+    return connection.execute(sqlalchemy.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                              {'name': TITLE_INDEX}).first() is not None
+
+
+def fts_query(text: str) -> str:
+    """
+    Turn what someone typed into an FTS5 query matching titles that contain all of its words.
+
+    Every word is quoted so that punctuation, as in `models.py` or `ABC-123`, is matched rather than parsed as query
+    syntax. A trailing `*` is kept to search for a prefix.
+
+    :param text: The words to search for
+    :return: The query
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*') and len(word) > 1
+        word = word.rstrip('*') if prefix else word
+        terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search_titles(ses: sqlalchemy.orm.Session, text: str, page: int = 0, per_page: int = 10) -> list[DayMatches]:
+    """
+    Find the days on which windows with matching titles were used.
+
+    Days are ranked by their best match, most recent first among equally good ones, and each comes with the time ranges
+    it contains, where consecutive events of the same window are joined together.
+
+    :param ses: The session to query with
+    :param text: The words to look for, see :py:func:`fts_query`
+    :param page: The number of the page of days to return, from 0
+    :param per_page: The number of days on a page
+    :return: The days on the page
+    """
+    if not text.split():
+        return []
+    if index_exists(ses):
+        matches = f'''SELECT "{TITLE_INDEX}".rowid AS title_id, "{TITLE_INDEX}".rank AS rank FROM "{TITLE_INDEX}"
+                      WHERE "{TITLE_INDEX}" MATCH :query'''
+        parameters = {'query': fts_query(text)}
+    else:
+        conditions = [f'name LIKE :word{n} ESCAPE \'\\\'' for n in range(len(text.split()))]
+        matches = f'SELECT id AS title_id, 0.0 AS rank FROM "WindowTitle" WHERE {" AND ".join(conditions)}'
+        parameters = {f'word{n}': '%' + i.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                      for n, i in enumerate(text.split())}
+    days = ses.execute(sqlalchemy.text(f'''
+        SELECT date(e.time_start) AS day, min(m.rank) AS rank,
+               sum(julianday(e.time_end) - julianday(e.time_start)) * 86400 AS seconds
+        FROM ({matches}) AS m JOIN "WindowEvent" AS e ON e.title_id = m.title_id
+        GROUP BY day ORDER BY rank, day DESC LIMIT :limit OFFSET :offset'''),
+                       {**parameters, 'limit': per_page, 'offset': page * per_page}).all()
+    if not days:
+        return []
+    events = ses.execute(sqlalchemy.text(f'''
+        SELECT date(e.time_start) AS day, t.name, e.time_start, e.time_end
+        FROM ({matches}) AS m JOIN "WindowEvent" AS e ON e.title_id = m.title_id
+        JOIN "WindowTitle" AS t ON t.id = m.title_id
+        WHERE date(e.time_start) IN ({', '.join(f':day{n}' for n in range(len(days)))})
+        ORDER BY e.time_start'''), {**parameters, **{f'day{n}': i.day for n, i in enumerate(days)}})
+    ranges = {i.day: [] for i in days}
+    for day, name, start, end in events:
+        start, end = _datetime(start), _datetime(end)
+        day_ranges = ranges[day]
+        if day_ranges and day_ranges[-1].window_name == name and \
+                (start - day_ranges[-1].time_end).total_seconds() < _RANGE_GAP:
+            day_ranges[-1] = day_ranges[-1]._replace(time_end=max(end, day_ranges[-1].time_end))
+        else:
+            day_ranges.append(TitleRange(name, start, end))
+    return [DayMatches(datetime.date.fromisoformat(i.day), i.rank,
+                       datetime.timedelta(seconds=round(i.seconds or 0, 3)), ranges[i.day]) for i in days]
+
+
+def _datetime(value: Union[str, datetime.datetime]) -> datetime.datetime:
+    # Textual queries get sqlite's stored strings rather than the dates the ORM would convert them to
+    return value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(value)
@@ -0,0 +1,290 @@
+"""
+The interfaces the tracker reads input and focus changes through, and sources that don't need a desktop.
+
+Besides the real sources in :py:mod:`timetracker.inputs` and :py:mod:`timetracker.focus`, the tracker can be fed from a
+recording with a :py:class:`Replayer`. Recordings are made from a running tracker with a :py:class:`Recorder`, or
+generated with :py:func:`synthetic`, which makes benchmarks of the tracking pipeline reproducible without an X session.
+
+Recordings are a small header followed by a stream of binary records, see :py:func:`write_records`.
+"""
+from __future__ import annotations
+
+import datetime
+import random
+import struct
+import time
+from typing import *
+
+from timetracker.focus import FocusState
+from timetracker.inputs import Accumulator
+from timetracker.stats import stats
+
+
+class InputSource(Protocol):
+    """
+    Something the tracker reads keyboard and pointer input from, such as :py:class:`timetracker.inputs.LibinputSource`
+    """
+
+    def fileno(self) -> int:
+        "The file descriptor that becomes readable when there is input"
+
+    def read(self, accumulator: Accumulator) -> int:
+        "Add the input that is ready to the accumulator without blocking, returning the number of events read"
+
+
+class FocusSource(Protocol):
+    """
+    Something that follows the focused window, such as :py:class:`timetracker.focus.FocusWatcher`
+    """
+    state: Optional[FocusState]
+
+
+class Motion(NamedTuple):
+    t: float
+    dx: float
+    dy: float
+
+
+class Keys(NamedTuple):
+    t: float
+    count: int
+
+
+class Focus(NamedTuple):
+    t: float
+    window_id: int
+    window_name: str
+    classes: frozenset[str]
+
+
+Record = Union[Motion, Keys, Focus]
+
+_MAGIC = b'TTRC'
+_HEADER = struct.Struct('<Bd')
+_VERSION = 1
+_RECORD = struct.Struct('<Bd')
+_MOTION = struct.Struct('<ff')
+_KEYS = struct.Struct('<H')
+_FOCUS = struct.Struct('<QH')
+_LENGTH = struct.Struct('<H')
+_COUNT = struct.Struct('<B')
+
+
+def write_header(f: BinaryIO, epoch: datetime.datetime) -> None:
+    """
+    Start a recording.
+
+    :param f: The file to write to
+    :param epoch: The wall clock time that time 0 of the records corresponds to
+    """
+    f.write(_MAGIC + _HEADER.pack(_VERSION, epoch.timestamp()))
+
+
+def write_record(f: BinaryIO, record: Record) -> None:
+    """
+    Append a record to a recording.
+
+    Every record starts with its kind and its time in seconds. Motion is followed by two 32 bit floats, keypresses by
+    a 16 bit count, and focus changes by the window id, its title and its classes as length prefixed utf-8 strings.
+    """
+    if isinstance(record, Motion):
+        f.write(_RECORD.pack(0, record.t) + _MOTION.pack(record.dx, record.dy))
+    elif isinstance(record, Keys):
+        f.write(_RECORD.pack(1, record.t) + _KEYS.pack(min(record.count, 0xffff)))
+    else:
+        name = record.window_name.encode('utf-8')[:0xffff]
+        classes = [i.encode('utf-8')[:0xffff] for i in sorted(record.classes)][:0xff]
+        f.write(b''.join([_RECORD.pack(2, record.t), _FOCUS.pack(record.window_id, len(name)), name,
+                          _COUNT.pack(len(classes)), *(_LENGTH.pack(len(i)) + i for i in classes)]))
+
+
+def write_records(f: BinaryIO, records: Iterable[Record], epoch: datetime.datetime) -> int:
+    """
+    Write a whole recording.
+
+    :param f: The file to write to
+    :param records: The records, in the order they happened
+    :param epoch: The wall clock time that time 0 of the records corresponds to
+    :return: The number of records written
+    """
+    write_header(f, epoch)
+    n = 0
+    for n, record in enumerate(records, 1):
+        write_record(f, record)
+    return n
+
+
+def read_records(f: BinaryIO) -> tuple[datetime.datetime, Iterator[Record]]:
+    """
+    Read a recording.
+
+    :param f: The file to read from
+    :return: The wall clock time that time 0 corresponds to, and the records, which are read as they are iterated over
+    """
+    if f.read(len(_MAGIC)) != _MAGIC:
+        raise ValueError("Not a timetracker recording")
+    version, epoch = _HEADER.unpack(f.read(_HEADER.size))
+    if version != _VERSION:
+        raise ValueError(f"Unsupported recording version {version}")
+
+    def records():
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            kind, t = _RECORD.unpack(head)
+            if kind == 0:
+                yield Motion(t, *_MOTION.unpack(f.read(_MOTION.size)))
+            elif kind == 1:
+                yield Keys(t, *_KEYS.unpack(f.read(_KEYS.size)))
+            elif kind == 2:
+                window_id, length = _FOCUS.unpack(f.read(_FOCUS.size))
+                name = f.read(length).decode('utf-8', 'replace')
+                classes = []
+                for _ in range(_COUNT.unpack(f.read(_COUNT.size))[0]):
+                    classes.append(f.read(_LENGTH.unpack(f.read(_LENGTH.size))[0]).decode('utf-8', 'replace'))
+                yield Focus(t, window_id, name, frozenset(classes))
+            else:
+                raise ValueError(f"Unknown record kind {kind}")
+
+    return datetime.datetime.fromtimestamp(epoch), records()
+
+
+class Recorder:
+    """
+    Records what a tracker sees while passing it on.
+
+    The recorder stands in for the tracker's accumulator when reading input, and is told about each new window the
+    tracker samples. Every record is stamped with the wall clock, in seconds from the epoch, so that input and focus
+    changes are replayed in the order they happened whatever clock the input source times its events by.
+    """
+
+    def __init__(self, f: BinaryIO, accumulator: Accumulator, epoch: datetime.datetime):
+        """
+        :param f: The file to record to
+        :param accumulator: The accumulator to pass input on to
+        :param epoch: The wall clock time that time 0 of the tracker's clock corresponds to
+        """
+        self.file = f
+        self.accumulator = accumulator
+        self.epoch = epoch
+        write_header(f, epoch)
+
+    def _since_epoch(self, when: datetime.datetime) -> float:
+        return (when - self.epoch).total_seconds()
+
+    def add_motion(self, dx: float, dy: float, t: float) -> None:
+        write_record(self.file, Motion(self._since_epoch(datetime.datetime.now()), dx, dy))
+        self.accumulator.add_motion(dx, dy, t)
+
+    def add_keys(self, count: int) -> None:
+        write_record(self.file, Keys(self._since_epoch(datetime.datetime.now()), count))
+        self.accumulator.add_keys(count)
+
+    def focus(self, window_id: int, window_name: str, classes: frozenset[str], since: datetime.datetime) -> None:
+        write_record(self.file, Focus(self._since_epoch(since), window_id, window_name, classes))
+
+
+class Replayer:
+    """
+    Feeds a recording to a tracker in place of its input and focus sources.
+
+    :ivar state: The focused window at the point the replay has reached
+    """
+    state: Optional[FocusState]
+
+    def __init__(self, records: Iterable[Record]):
+        """
+        :param records: The records to replay, in the order they happened
+        """
+        self.records = records
+        self.state = None
+
+    def replay(self, tracker, speed: Optional[float] = None) -> int:
+        """
+        Replay the records, taking the tracker's samples at the times they would have been taken.
+
+        The tracker should be using this replayer as its watcher and the recording's epoch as its own.
+
+        :param tracker: The :py:class:`timetracker.tracker.Tracker` to feed
+        :param speed: How many times faster than real time to replay, or None for as fast as possible
+        :return: The number of records replayed
+        """
+        accumulator = tracker.accumulator
+        interval = tracker.sample_interval
+        next_sample = None
+        start = wall = 0.0
+        count = pending = 0
+        for count, record in enumerate(self.records, 1):
+            t = record.t
+            if next_sample is None:
+                start, wall, next_sample = t, time.monotonic(), t + interval
+            while t >= next_sample:
+                stats.count('input_events', pending)
+                pending = 0
+                tracker.sample(next_sample)
+                next_sample += interval
+            if speed:
+                delay = wall + (t - start) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if isinstance(record, Motion):
+                accumulator.add_motion(record.dx, record.dy, t)
+            elif isinstance(record, Keys):
+                accumulator.add_keys(record.count)
+            else:
+                self.state = FocusState(record.window_id, record.window_name, record.classes,
+                                        tracker.to_datetime(t))
+                continue
+            tracker.last_input = t
+            pending += 1
+        if next_sample is not None:
+            stats.count('input_events', pending)
+            tracker.sample(next_sample)
+        return count
+
+
+_APPLICATIONS = [
+    ('{} - Emacs', ('emacs', 'Emacs'), ['timetracker/{}.py', 'notes.org', 'README.md', 'models.py']),
+    ('{} — Mozilla Firefox', ('Navigator', 'firefox'),
+     ['Stack Overflow', 'Reddit', 'Issue #{} · GitHub', 'Python documentation', 'Gmail']),
+    ('{}: ~/src', ('kitty', 'kitty'), ['vim', 'python -m pytest', 'git log', 'htop']),
+    ('{} - Telegram', ('telegram-desktop', 'TelegramDesktop'), ['Saved Messages', 'Group chat']),
+]
+
+
+def synthetic(hours: float, seed: int = 0, mouse_rate: float = 125.0) -> Iterator[Record]:
+    """
+    Generate a plausible recording of someone using their computer.
+
+    Focus moves between a handful of applications every minute or two, with bursts of typing and of mouse movement in
+    between, and the occasional break long enough for the tracker to notice the user is idle.
+
+    :param hours: The length of the recording in hours
+    :param seed: The seed of the random number generator, the same seed gives the same recording
+    :param mouse_rate: The number of motion events per second while the mouse moves
+    :return: The records, starting at time 0
+    """
+    rng = random.Random(seed)
+    end = hours * 3600
+    t = 0.0
+    window_ids = {}
+    while t < end:
+        if rng.random() < 0.02:
+            t += rng.uniform(180, 600)
+        title, classes, subjects = rng.choice(_APPLICATIONS)
+        name = title.format(rng.choice(subjects).format(rng.randint(1, 40)))
+        window_id = window_ids.setdefault(name, 0x1000000 + len(window_ids))
+        yield Focus(t, window_id, name, frozenset(classes))
+        focus_end = min(end, t + rng.expovariate(1 / 90))
+        while t < focus_end:
+            burst_end = min(focus_end, t + rng.uniform(0.5, 5))
+            if rng.random() < 0.5:
+                while t < burst_end:
+                    t += rng.expovariate(6)
+                    yield Keys(t, 1)
+            else:
+                while t < burst_end:
+                    t += 1 / mouse_rate
+                    yield Motion(t, rng.gauss(0, 4), rng.gauss(0, 4))
+            t += rng.expovariate(1 / 2)
@@ -0,0 +1,421 @@
+"""
+Tags events inside the database, by turning the matchers into SQL.
+
+Reports would otherwise load every event, with its title and classes, into objects just to hand them to
+:py:func:`timetracker.report.process_events`. :py:class:`SqlMatchers` instead makes a query that returns each event's
+columns along with its tags, or that adds up the time spent on each tag without returning the events at
+all:
+
+* name matchers look for their strings with ``instr`` in the lowercased titles, once for each title the events have,
+* class matchers do the same for each class, and an event has the class matches of any of its classes,
+* the and, or and not matchers combine those with ``AND``, ``OR`` and ``NOT``, once for each title and set of class
+  matches the events have, since the events that share them share their tags.
+
+Regular expressions, and strings sqlite can't lowercase, are passed to python functions that are registered on the
+connection before each query. The tags of an event are the same as :py:func:`timetracker.report.process_events` gives,
+though each only once, in the order they first appear in the matchers.
+"""
+from __future__ import annotations
+
+import datetime
+import functools
+import re
+import sqlite3
+from typing import *
+
+import sqlalchemy
+import sqlalchemy.orm
+from sqlalchemy import func
+
+from timetracker.matching import _needles
+from timetracker.models import EventClass, WindowClass, WindowEvent, WindowTitle
+from timetracker.report import AndMatcher, ClassMatcher, NameTagger, NotMatcher, OrMatcher
+
+_events = WindowEvent.__table__
+_MATERIALIZED = sqlite3.sqlite_version_info >= (3, 35, 0)
+"Whether sqlite can be told to work out the matches of each title once, rather than again wherever they are used"
+
+
+class TaggedEvent(NamedTuple):
+    """
+    The columns of an event that charts use, without loading the event itself.
+    """
+    id: int
+    window_name: str
+    time_start: datetime.datetime
+    time_end: datetime.datetime
+    keystrokes: int
+    mouse_motion: float
+
+    @property
+    def date_of(self) -> tuple[int, int, int]:
+        return self.time_start.year, self.time_start.month, self.time_start.day
+
+    def duration(self) -> datetime.timedelta:
+        return self.time_end - self.time_start
+
+
+def _lower(text: Optional[str]) -> Optional[str]:
+    return None if text is None else text.lower()
+
+
+@functools.lru_cache(maxsize=256)
+def _pattern(pattern: str, flags: int) -> re.Pattern:
+    return re.compile(pattern, flags)
+
+
+def _match(pattern: str, flags: int, text: Optional[str]) -> int:
+    return int(text is not None and _pattern(pattern, flags).match(text) is not None)
+
+
+def register_functions(connection: sqlalchemy.engine.Connection) -> None:
+    """
+    Make the python functions the queries of :py:class:`SqlMatchers` use available on a connection.
+
+    :param connection: The connection the queries will run on
+    """
+    for name, arity, f in [('tt_lower', 1, _lower), ('tt_match', 3, _match)]:
+        try:
+            connection.connection.create_function(name, arity, f, deterministic=True)
+        except (TypeError, NotImplementedError):
+            # Older sqlite libraries and bindings can't be told the function only depends on its arguments
+            connection.connection.create_function(name, arity, f)
+
+
+def _any(expressions: list) -> sqlalchemy.sql.ColumnElement:
+    return sqlalchemy.or_(*expressions) if expressions else sqlalchemy.false()
+
+
+def _needle(needle: Union[str, re.Pattern], text, fold: bool, title: bool) -> sqlalchemy.sql.ColumnElement:
+    "The expression that is true if a string or expression of a name or class matcher matches the text"
+    if isinstance(needle, str):
+        if not fold:
+            return func.instr(text, needle) > 0
+        if needle.isascii():
+            # sqlite only lowercases ascii letters, which is all an ascii needle needs short of a few odd letters, such
+            # as the kelvin sign, that python lowercases into ascii ones
+            return func.instr(func.lower(text), needle.lower()) > 0
+        return func.instr(func.tt_lower(text), needle.lower()) > 0
+    if isinstance(needle, re.Pattern) and isinstance(needle.pattern, str):
+        # Titles are lowercased before the expressions are tried on them, classes aren't
+        return func.tt_match(needle.pattern, needle.flags, func.tt_lower(text) if fold and title else text) == 1
+    raise TypeError(f"Can't translate a match on {needle!r} into sql")
+
+
+_TRUE = ('true',)
+_FALSE = ('false',)
+
+
+def _and(*nodes: tuple) -> tuple:
+    "Every one of the conditions, each a tuple naming its kind followed by what it is made of"
+    items = []
+    for n in nodes:
+        if n == _FALSE:
+            return _FALSE
+        for i in (n[1] if n[0] == 'and' else [n]):
+            if i != _TRUE and i not in items:
+                items.append(i)
+    return items[0] if len(items) == 1 else ('and', tuple(items)) if items else _TRUE
+
+
+def _or(*nodes: tuple) -> tuple:
+    "Any one of the conditions"
+    items = []
+    for n in nodes:
+        if n == _TRUE:
+            return _TRUE
+        for i in (n[1] if n[0] == 'or' else [n]):
+            if i != _FALSE and i not in items:
+                items.append(i)
+    return items[0] if len(items) == 1 else ('or', tuple(items)) if items else _FALSE
+
+
+def _not(node: tuple) -> tuple:
+    return {_TRUE: _FALSE, _FALSE: _TRUE}.get(node) or (node[1] if node[0] == 'not' else ('not', node))
+
+
+class SqlMatchers:
+    """
+    A list of matchers, as queries over the events.
+
+    The conditions for each tag are put together first, and then the parts of them that only depend on the title are
+    worked out for each title, so that the rest of each condition, which is worked out for each combination of title
+    and class matches, is small.
+    """
+
+    def __init__(self, matchers: list):
+        """
+        :param matchers: The matchers, of the types :py:func:`timetracker.report.from_json` makes
+        :raises TypeError: If there are matchers of other types, which have to be asked in python
+        """
+        self.names: list[NameTagger] = []
+        self.classes: list[ClassMatcher] = []
+        self._leaves: dict[int, tuple] = {}
+        conditions = {}
+        for m in matchers:
+            matches = self._matches(m)
+            for tag, condition in self._given(m).items():
+                self._merge(conditions, tag, _and(matches, condition))
+        self._merge(conditions, 'unlabelled', _not(_or(*conditions.values())))
+        self.conditions: dict[str, tuple] = conditions
+        "The condition for each tag, in the order the tags first appear in the matchers"
+        self.tags = list(conditions)
+        self.names_sql = [self._leaf_sql(m, WindowTitle.__table__.c.name, True) for m in self.names]
+        self.classes_sql = [self._leaf_sql(m, WindowClass.__table__.c.name, False) for m in self.classes]
+        # The parts of the conditions that only depend on titles, which are worked out once for each title
+        self.title_parts: dict[tuple, str] = {}
+        for condition in conditions.values():
+            self._title_parts(condition)
+
+    @staticmethod
+    def _merge(tags: dict, tag: str, condition: tuple) -> None:
+        "Add another way of getting a tag"
+        tags[tag] = _or(tags[tag], condition) if tag in tags else condition
+
+    def _leaf(self, matcher) -> tuple:
+        leaf = self._leaves.get(id(matcher))
+        if leaf is None:
+            kind = type(matcher)
+            if kind is NameTagger:
+                leaf = 'name', len(self.names)
+                self.names.append(matcher)
+            elif kind is ClassMatcher:
+                leaf = 'class', len(self.classes)
+                self.classes.append(matcher)
+            else:
+                raise TypeError(f"Can't translate a {kind.__name__} into sql")
+            self._leaves[id(matcher)] = leaf
+        return leaf
+
+    def _matches(self, matcher) -> tuple:
+        "The condition for the events a matcher matches"
+        kind = type(matcher)
+        if kind is AndMatcher:
+            return _and(*map(self._matches, matcher.matcher))
+        if kind is OrMatcher:
+            return _or(*map(self._matches, matcher.matcher))
+        if kind is NotMatcher:
+            return _not(_or(*map(self._matches, matcher.matcher)))
+        return self._leaf(matcher)
+
+    def _given(self, matcher) -> dict[str, tuple]:
+        "The tags a matcher gives the events it matches, each with what else must be true for the event to get it"
+        tags = {}
+        for t in matcher.tags or []:
+            self._merge(tags, t, _TRUE)
+        kind = type(matcher)
+        if kind is AndMatcher:
+            # Every submatcher matched if this did
+            for m in matcher.matcher:
+                for t, condition in self._given(m).items():
+                    self._merge(tags, t, condition)
+        elif kind is OrMatcher:
+            for m in matcher.matcher:
+                matches = self._matches(m)
+                for t, condition in self._given(m).items():
+                    self._merge(tags, t, _and(matches, condition))
+        return tags
+
+    @staticmethod
+    def _leaf_sql(matcher, text, title: bool) -> sqlalchemy.sql.ColumnElement:
+        return _any([_needle(needle, text, not matcher.case_sensitive, title) for needle in _needles(matcher.matcher)])
+
+    @staticmethod
+    def _only_titles(condition: tuple) -> bool:
+        if condition[0] in ('and', 'or'):
+            return all(map(SqlMatchers._only_titles, condition[1]))
+        if condition[0] == 'not':
+            return SqlMatchers._only_titles(condition[1])
+        return condition[0] != 'class'
+
+    def _title_parts(self, condition: tuple) -> None:
+        if condition in (_TRUE, _FALSE) or condition[0] == 'class':
+            return
+        if self._only_titles(condition):
+            self.title_parts.setdefault(condition, f'name{len(self.title_parts)}')
+        else:
+            for i in (condition[1:2] if condition[0] == 'not' else condition[1]):
+                self._title_parts(i)
+
+    def _without_title(self, condition: tuple) -> bool:
+        "Whether a condition that only depends on the title is true of events without one"
+        kind = condition[0]
+        if kind in ('true', 'false'):
+            return kind == 'true'
+        if kind == 'and':
+            return all(map(self._without_title, condition[1]))
+        if kind == 'or':
+            return any(map(self._without_title, condition[1]))
+        if kind == 'not':
+            return not self._without_title(condition[1])
+        m = self.names[condition[1]]
+        return bool(m.match_string(m.matcher, ''))
+
+    def _sql(self, condition: tuple, part: Callable[[tuple], Optional[sqlalchemy.sql.ColumnElement]]):
+        """
+        :param part: The expression of a part of a condition that is worked out elsewhere, or None to put it together
+                     from its own parts
+        """
+        kind = condition[0]
+        if kind == 'true':
+            return sqlalchemy.true()
+        if kind == 'false':
+            return sqlalchemy.false()
+        found = part(condition)
+        if found is not None:
+            return found
+        if kind == 'and':
+            return sqlalchemy.and_(*(self._sql(i, part) for i in condition[1]))
+        if kind == 'or':
+            return sqlalchemy.or_(*(self._sql(i, part) for i in condition[1]))
+        return sqlalchemy.not_(self._sql(condition[1], part))
+
+    def _select(self, columns: Callable[[Any], list], start: Optional[datetime.datetime],
+                end: Optional[datetime.datetime]) -> sqlalchemy.sql.Select:
+        """
+        Select from the events, along with their tags.
+
+        Events with the same title and the same class matches have the same tags, so the tags are worked out once for
+        each of those, as a string with a 1 or a 0 for each of :py:attr:`tags`, and joined back onto the events.
+
+        :param columns: Makes the columns to select from the tagged combinations, which have the ``name`` of the title
+                        and the ``tags``
+        """
+        events = _between(sqlalchemy.select(_events.c.id), start, end)
+        titles = WindowTitle.__table__
+        titles = sqlalchemy.select(titles.c.id, titles.c.name, *(
+            self._sql(condition, lambda c: self.names_sql[c[1]] if c[0] == 'name' else None).label(label)
+            for condition, label in self.title_parts.items()))
+        if start is not None or end is not None:
+            titles = titles.where(WindowTitle.__table__.c.id.in_(events.with_only_columns(_events.c.title_id)))
+        titles = _materialized(titles.cte('matched_titles'))
+        source = _events
+        if self.classes:
+            classes = WindowClass.__table__
+            classes = _materialized(sqlalchemy.select(classes.c.id, *(
+                e.label(f'class{n}') for n, e in enumerate(self.classes_sql))).cte('matched_classes'))
+            links = EventClass.__table__
+            # Which of the class matchers any of the classes of each event match
+            event_classes = _materialized(sqlalchemy.select(links.c.event_id, _flags(
+                func.max(classes.c[f'class{n}']) for n in range(len(self.classes))).label('class_key'))
+                .join(classes, classes.c.id == links.c.class_id)
+                .where(links.c.event_id.in_(events)).group_by(links.c.event_id).cte('event_classes'))
+            source = source.outerjoin(event_classes, event_classes.c.event_id == _events.c.id)
+            class_key = event_classes.c.class_key
+        else:
+            class_key = sqlalchemy.null()
+        combinations = _between(sqlalchemy.select(_events.c.title_id, class_key.label('class_key'))
+                                .select_from(source), start, end).distinct().subquery('combinations')
+        # Events without a title get what an empty title would
+        parts = {condition: func.coalesce(titles.c[label], int(self._without_title(condition))) == 1
+                 for condition, label in self.title_parts.items()}
+        parts.update({('class', n): func.substr(func.coalesce(combinations.c.class_key, ''), n + 1, 1) == '1'
+                      for n in range(len(self.classes))})
+        tagged = _materialized(sqlalchemy.select(
+            combinations.c.title_id, combinations.c.class_key, titles.c.name,
+            _flags(self._sql(condition, parts.get) for condition in self.conditions.values()).label('tags'))
+            .select_from(combinations.outerjoin(titles, titles.c.id == combinations.c.title_id))
+            .cte('tagged_combinations'))
+        source = source.join(tagged, sqlalchemy.and_(tagged.c.title_id.is_not_distinct_from(_events.c.title_id),
+                                                     tagged.c.class_key.is_not_distinct_from(class_key)))
+        return _between(sqlalchemy.select(*columns(tagged)).select_from(source), start, end)
+
+    def query(self, start: Optional[datetime.datetime] = None,
+              end: Optional[datetime.datetime] = None) -> sqlalchemy.sql.Select:
+        """
+        :param start: The earliest start of the events to select
+        :param end: Where to stop, exclusive
+        :return: The columns of :py:class:`TaggedEvent`, followed by the tags of the event as :py:meth:`tags_of` takes
+                 them, in order of start
+        """
+        return self._select(lambda tagged: [
+            _events.c.id, func.coalesce(tagged.c.name, '').label('window_name'), _events.c.time_start,
+            _events.c.time_end, _events.c.keystrokes, _events.c.mouse_motion, tagged.c.tags], start, end) \
+            .order_by(_events.c.time_start)
+
+    def totals(self, start: Optional[datetime.datetime] = None,
+               end: Optional[datetime.datetime] = None) -> sqlalchemy.sql.Select:
+        """
+        :param start: The earliest start of the events to add up
+        :param end: Where to stop, exclusive
+        :return: For each set of tags, as :py:meth:`tags_of` takes them, the number, seconds and keystrokes of the
+                 events with exactly those tags
+        """
+        seconds = (func.julianday(_events.c.time_end) - func.julianday(_events.c.time_start)) * 86400.0
+        return self._select(lambda tagged: [tagged.c.tags, func.count(), func.total(seconds),
+                                            func.total(_events.c.keystrokes)], start, end).group_by('tags')
+
+    def tags_of(self, flags: str) -> list[str]:
+        """
+        :param flags: The tags column of :py:meth:`query` or :py:meth:`totals`
+        :return: The tags it has
+        """
+        return [t for t, flag in zip(self.tags, flags) if flag == '1']
+
+
+def _flags(expressions: Iterable[sqlalchemy.sql.ColumnElement]) -> sqlalchemy.sql.ColumnElement:
+    "A string of a 1 for each of the expressions that is true, and a 0 for the others"
+    return functools.reduce(lambda a, b: a.concat(b), (
+        sqlalchemy.case((e, '1'), else_='0') for e in expressions))
+
+
+def _materialized(cte: sqlalchemy.sql.CTE) -> sqlalchemy.sql.CTE:
+    return cte.prefix_with('MATERIALIZED') if _MATERIALIZED else cte
+
+
+def _between(q: sqlalchemy.sql.Select, start: Optional[datetime.datetime],
+             end: Optional[datetime.datetime]) -> sqlalchemy.sql.Select:
+    if start is not None:
+        q = q.where(_events.c.time_start >= start)
+    if end is not None:
+        q = q.where(_events.c.time_start < end)
+    return q
+
+
+def tagged_events(ses: sqlalchemy.orm.Session, matchers: list, start: Optional[datetime.datetime] = None,
+                  end: Optional[datetime.datetime] = None) -> list[tuple[TaggedEvent, list[str]]]:
+    """
+    Tag the events of the database, like :py:func:`timetracker.report.process_events`, without loading them.
+
+    :param ses: The session to query with
+    :param matchers: The matchers, of the types :py:func:`timetracker.report.from_json` makes
+    :param start: The earliest start of the events to tag
+    :param end: Where to stop, exclusive
+    :return: Each event with its tags, in order of start
+    :raises TypeError: If there are matchers of other types
+    """
+    sql = SqlMatchers(matchers)
+    connection = ses.connection()
+    register_functions(connection)
+    tags = {}
+    r = []
+    for row in connection.execute(sql.query(start, end)):
+        flags = row[6]
+        if flags not in tags:
+            tags[flags] = sql.tags_of(flags)
+        # Each event gets its own list, as process_events gives
+        r.append((TaggedEvent(*row[:6]), tags[flags].copy()))
+    return r
+
+
+def tag_totals(ses: sqlalchemy.orm.Session, matchers: list, start: Optional[datetime.datetime] = None,
+               end: Optional[datetime.datetime] = None) -> dict[str, tuple[float, int]]:
+    """
+    Add up the time and keystrokes of the events with each tag, inside the database.
+
+    :param ses: The session to query with
+    :param matchers: The matchers, of the types :py:func:`timetracker.report.from_json` makes
+    :param start: The earliest start of the events to add up
+    :param end: Where to stop, exclusive
+    :return: The seconds and keystrokes of each tag that any of the events have
+    :raises TypeError: If there are matchers of other types
+    """
+    sql = SqlMatchers(matchers)
+    connection = ses.connection()
+    register_functions(connection)
+    totals = {}
+    for flags, _, seconds, keystrokes in connection.execute(sql.totals(start, end)):
+        for tag in sql.tags_of(flags):
+            before = totals.get(tag, (0.0, 0))
+            totals[tag] = (before[0] + seconds, before[1] + int(keystrokes))
+    return {tag: totals[tag] for tag in sql.tags if tag in totals}
@@ -0,0 +1,165 @@
+"""
+Counters and latency histograms describing how much work the tracker itself is doing.
+
+The tracker records into the module-level :py:data:`stats` and periodically writes it to a small json file, which
+``python -m timetracker stats`` reads back.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import *
+
+from xdg import xdg_cache_home
+
+import timetracker.common
+
+STATS_FILE = Path(timetracker.common.Config.get('stats_file', str(xdg_cache_home() / 'timetracker' / 'stats.json')))
+STATS_INTERVAL = timetracker.common.Config.get('stats_interval', 60)
+
+
+class Histogram:
+    """
+    A latency histogram with power of two buckets, in microseconds.
+
+    Bucket `k` counts the measurements from 2**(k-1) up to, but not including, 2**k microseconds.
+    """
+    __slots__ = ['count', 'total', 'max', 'buckets']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def record(self, seconds: float) -> None:
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile from the buckets.
+
+        :param q: The quantile, between 0 and 1
+        :return: The upper bound of the bucket the quantile falls into, in seconds
+        """
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= q * self.count:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def as_json(self) -> dict:
+        return {'count': self.count, 'total': self.total, 'max': self.max,
+                'buckets': {str(k): v for k, v in self.buckets.items()}}
+
+    @staticmethod
+    def from_json(obj: dict) -> Histogram:
+        h = Histogram()
+        h.count, h.total, h.max = obj['count'], obj['total'], obj['max']
+        h.buckets = {int(k): v for k, v in obj['buckets'].items()}
+        return h
+
+
+class Stats:
+    """
+    A set of named counters and histograms that may be updated from any thread.
+
+    :ivar counters: The number of times each thing has happened
+    :ivar histograms: How long each kind of operation has taken
+    """
+    counters: dict[str, int]
+    histograms: dict[str, Histogram]
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].record(seconds)
+
+    @contextmanager
+    def timed(self, name: str):
+        """
+        Record how long the body of the with statement takes.
+
+        :param name: The histogram to record it in
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def as_json(self) -> dict:
+        with self._lock:
+            return {'pid': os.getpid(), 'started': self.started, 'written': time.time(),
+                    'counters': dict(self.counters),
+                    'histograms': {k: v.as_json() for k, v in self.histograms.items()}}
+
+    def dump(self, path: Path = STATS_FILE) -> None:
+        """
+        Write the statistics to a file, replacing it in one step so that readers never see half of it.
+
+        :param path: The file to write
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.as_json(), f)
+        os.replace(tmp, path)
+
+
+stats = Stats()
+"The statistics of this process"
+
+
+def report(path: Path = STATS_FILE) -> str:
+    """
+    Describe the statistics written by a tracker.
+
+    :param path: The file the tracker writes its statistics to
+    :return: A human readable summary
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return f"No statistics at {path}, is the tracker running?"
+    return report_stats(data)
+
+
+def report_stats(data: dict) -> str:
+    """
+    Describe a set of statistics.
+
+    :param data: The statistics, as returned by :py:meth:`Stats.as_json`
+    :return: A human readable summary
+    """
+    lines = [f"Tracker {data['pid']}, up {data['written'] - data['started']:.0f} seconds, "
+             f"written {time.time() - data['written']:.0f} seconds ago"]
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f"{name:>24}: {value}")
+    for name, obj in sorted(data['histograms'].items()):
+        h = Histogram.from_json(obj)
+        lines.append(f"{name:>24}: {h.count} times, mean {1000 * h.total / max(h.count, 1):.3f}ms, "
+                     f"p50 {1000 * h.quantile(0.5):.3f}ms, p99 {1000 * h.quantile(0.99):.3f}ms, "
+                     f"max {1000 * h.max:.3f}ms")
+    return '\n'.join(lines)
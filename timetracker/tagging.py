@@ -0,0 +1,218 @@
+"""
+The tags of each event, kept in the `EventTag` table so that reports don't tag the same events again on every request.
+
+:py:func:`update` tags the events that were written since it last ran, going by their ids, and the report server runs it
+every `tagging_interval` seconds. :py:func:`tagged_events` reads the tags back for a report, joined onto the events, and
+only tags the events that haven't been tagged yet itself.
+
+The table holds the tags of one set of matchers, whose digest is kept in `TagState`. When the matchers change,
+:py:func:`update` clears the table and tags every event again, and until it has, reports with the new matchers tag the
+events in sqlite instead, see :py:mod:`timetracker.sqlmatching`. Events that are merged into others or archived have
+their tags removed along with them.
+"""
+from __future__ import annotations
+
+import datetime
+import threading
+from typing import *
+
+import sqlalchemy
+import sqlalchemy.orm
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+
+import timetracker.common
+import timetracker.sqlmatching as sqlmatching
+from timetracker.matching import Title, compiled, fingerprint
+from timetracker.models import EventClass, EventTag, Tag, TagState, WindowClass, WindowEvent, WindowTitle
+from timetracker.report import AndMatcher, OrMatcher
+from timetracker.sqlmatching import TaggedEvent
+
+INTERVAL = timetracker.common.Config.get('tagging_interval', 30)
+"The number of seconds the report server waits between tagging the new events"
+_SEPARATOR = '\x1f'
+"What the tags of an event are joined with when they are read back"
+_IN_LIMIT = 500
+_lock = threading.Lock()
+
+
+def _order(matchers: list) -> dict[str, int]:
+    "The position of each tag the matchers give, in the order they first appear in them"
+    tags = {}
+
+    def add(matcher) -> None:
+        for t in matcher.tags or []:
+            tags.setdefault(t, len(tags))
+        if type(matcher) in (AndMatcher, OrMatcher):
+            for m in matcher.matcher:
+                add(m)
+
+    for m in matchers:
+        add(m)
+    tags.setdefault('unlabelled', len(tags))
+    return tags
+
+
+def _arranged(order: dict[str, int], found: Iterable[str]) -> list[str]:
+    "Tags, each once in the order they first appear in the matchers"
+    return sorted(dict.fromkeys(found), key=lambda t: order.get(t, len(order)))
+
+
+def arrange(matchers: list, tagged: Iterable[tuple[Any, list[str]]]) -> list[tuple[Any, list[str]]]:
+    """
+    Put the tags of events tagged by :py:func:`timetracker.report.process_events`, such as archived ones, the way
+    :py:func:`tagged_events` gives them, so that reports made from both tag an event the same wherever it is kept.
+
+    :param matchers: The matchers the events were tagged with
+    :param tagged: Each event with its tags, in the order the matchers gave them and possibly more than once
+    :return: Each event with its tags, each once in the order they first appear in the matchers
+    """
+    order = _order(matchers)
+    known = {}
+    r = []
+    for event, found in tagged:
+        key = tuple(found)
+        if key not in known:
+            known[key] = _arranged(order, found)
+        r.append((event, known[key].copy()))
+    return r
+
+
+def _state(ses: sqlalchemy.orm.Session, version: str, chunk_size: int) -> int:
+    "The id of the last event tagged with the matchers of a digest, clearing the tags of any others"
+    table, links = TagState.__table__, EventTag.__table__
+    last = ses.execute(sqlalchemy.select(table.c.event_id).where(table.c.version == version)).scalar()
+    if last is not None:
+        return last
+    # Reports tag in sqlite from when the state is gone, so the old tags can be removed a chunk at a time, each in a
+    # transaction short enough not to hold up the tracker
+    ses.execute(table.delete())
+    ses.commit()
+    while True:
+        chunk = sqlalchemy.select(links.c.event_id).order_by(links.c.event_id).limit(chunk_size).scalar_subquery()
+        if not ses.execute(links.delete().where(links.c.event_id.in_(chunk))).rowcount:
+            break
+        ses.commit()
+    ses.execute(insert(table).on_conflict_do_nothing(), {'version': version, 'event_id': 0})
+    ses.commit()
+    return 0
+
+
+def _tag_ids(ses: sqlalchemy.orm.Session, names: Iterable[str], ids: dict[str, int]) -> dict[str, int]:
+    "The ids of tags, by name, adding the names that aren't stored yet"
+    table = Tag.__table__
+    missing = list({i for i in names if i not in ids})
+    for i in range(0, len(missing), _IN_LIMIT):
+        chunk = missing[i:i + _IN_LIMIT]
+        ses.execute(insert(table).on_conflict_do_nothing(), [{'name': name} for name in chunk])
+        ids.update(ses.execute(sqlalchemy.select(table.c.name, table.c.id).where(table.c.name.in_(chunk))).all())
+    return ids
+
+
+def update(ses: sqlalchemy.orm.Session, matchers: list, chunk_size: int = 5000) -> int:
+    """
+    Tag the events that have been written since the last update, or every event if the matchers have changed.
+
+    :param ses: The session to query and write with
+    :param matchers: The matchers to tag the events with, see :py:mod:`timetracker.report`
+    :param chunk_size: The number of events to tag at once
+    :return: The number of events tagged
+    :raises TypeError: If there are matchers that can't be compiled, whose tags aren't kept
+    """
+    version = fingerprint(matchers)
+    tagger = compiled(matchers)
+    table, events, titles = TagState.__table__, WindowEvent.__table__, WindowTitle.__table__
+    ids = {}
+    n = 0
+    with _lock:
+        last = _state(ses, version, chunk_size)
+        while True:
+            # Plain rows rather than events, with the classes of a chunk loaded by the ids of its events
+            rows = ses.execute(sqlalchemy.select(events.c.id, titles.c.name)
+                               .select_from(events.outerjoin(titles, titles.c.id == events.c.title_id))
+                               .where(events.c.id > last).order_by(events.c.id).limit(chunk_size)).all()
+            if not rows:
+                return n
+            classes = _classes(ses, [i.id for i in rows])
+            tags = [(event_id, dict.fromkeys(tagger.tags(Title.of((name, classes.get(event_id, ()))))))
+                    for event_id, name in rows]
+            # Only now is the write lock taken, by moving the state, so that no one else adds the same tags. Ending the
+            # reads first means the write sees what others committed while this chunk was being tagged
+            ses.rollback()
+            moved = ses.execute(table.update().where(table.c.version == version, table.c.event_id == last)
+                                .values(event_id=rows[-1].id)).rowcount
+            if not moved:
+                # Another process tagged them, or changed the matchers
+                ses.rollback()
+                return n
+            _tag_ids(ses, {t for _, found in tags for t in found}, ids)
+            ses.execute(insert(EventTag.__table__).on_conflict_do_nothing(),
+                        [{'event_id': event_id, 'tag_id': ids[t]} for event_id, found in tags for t in found])
+            ses.commit()
+            last = rows[-1].id
+            n += len(rows)
+
+
+def _classes(ses: sqlalchemy.orm.Session, ids: list[int]) -> dict[int, list[str]]:
+    "The names of the classes of events"
+    links, classes = EventClass.__table__, WindowClass.__table__
+    r = {}
+    for i in range(0, len(ids), _IN_LIMIT):
+        for event_id, name in ses.execute(sqlalchemy.select(links.c.event_id, classes.c.name)
+                                          .join(classes, classes.c.id == links.c.class_id)
+                                          .where(links.c.event_id.in_(ids[i:i + _IN_LIMIT]))):
+            r.setdefault(event_id, []).append(name)
+    return r
+
+
+def tagged_events(ses: sqlalchemy.orm.Session, matchers: list, start: Optional[datetime.datetime] = None,
+                  end: Optional[datetime.datetime] = None) -> list[tuple[TaggedEvent, list[str]]]:
+    """
+    Tag the events of the database, like :py:func:`timetracker.sqlmatching.tagged_events`, from the tags that are kept.
+
+    The events that haven't been tagged yet are tagged here, and all of them are tagged in sqlite if the tags kept are
+    of other matchers.
+
+    :param ses: The session to query with
+    :param matchers: The matchers, of the types :py:func:`timetracker.report.from_json` makes
+    :param start: The earliest start of the events to tag
+    :param end: Where to stop, exclusive
+    :return: Each event with its tags, each once in the order they first appear in the matchers, in order of start
+    :raises TypeError: If there are matchers of other types
+    """
+    state = TagState.__table__
+    version = fingerprint(matchers)
+    if ses.execute(sqlalchemy.select(state.c.event_id).where(state.c.version == version)).scalar() is None:
+        # The tags kept are of other matchers
+        return sqlmatching.tagged_events(ses, matchers, start, end)
+    events, titles, links, tags = WindowEvent.__table__, WindowTitle.__table__, EventTag.__table__, Tag.__table__
+    found = sqlalchemy.select(func.group_concat(tags.c.name, _SEPARATOR)) \
+        .select_from(links.join(tags, tags.c.id == links.c.tag_id)).where(links.c.event_id == events.c.id) \
+        .scalar_subquery()
+    query = sqlalchemy.select(events.c.id, func.coalesce(titles.c.name, '').label('window_name'), events.c.time_start,
+                              events.c.time_end, events.c.keystrokes, events.c.mouse_motion, found) \
+        .select_from(events.outerjoin(titles, titles.c.id == events.c.title_id)).order_by(events.c.time_start)
+    order = _order(matchers)
+    known = {}
+    r = []
+    untagged = []
+    if start is not None:
+        query = query.where(events.c.time_start >= start)
+    if end is not None:
+        query = query.where(events.c.time_start < end)
+    for row in ses.execute(query):
+        found = row[6]
+        if found is None:
+            untagged.append(len(r))
+            r.append((TaggedEvent(*row[:6]), None))
+            continue
+        if found not in known:
+            known[found] = _arranged(order, found.split(_SEPARATOR))
+        r.append((TaggedEvent(*row[:6]), known[found].copy()))
+    if untagged:
+        tagger = compiled(matchers)
+        classes = _classes(ses, [r[i][0].id for i in untagged])
+        for i in untagged:
+            event = r[i][0]
+            r[i] = event, _arranged(order, tagger.tags(Title.of((event.window_name, classes.get(event.id, [])))))
+    return r
@@ -1,48 +1,69 @@
 from __future__ import annotations
+import asyncio
+import re
+import signal
 import subprocess
 import sys
-from time import sleep
+import time
 from typing import *
 import datetime
+from functools import lru_cache
 
 import timetracker.common
-from timetracker.models import engine, session, Base, WindowClass, WindowEvent
 import timetracker.models as models
-
-import libinput
+from timetracker.focus import FocusWatcher, XpropWatcher
+from timetracker.inputs import Accumulator, LibinputSource
+from timetracker.journal import JournalWriter
+from timetracker.sources import FocusSource, InputSource, Recorder, Replayer, read_records
+from timetracker.stats import stats, STATS_INTERVAL
+from timetracker.writer import Sample, SampleWriter
 
 _IDLE_TIMES = timetracker.common.Config.get('idle_times', 30)
 _SAMPLE_INTERVAL = timetracker.common.Config.get('sample_interval', 4)
-
-Base.metadata.create_all(engine)
+_SAMPLER = timetracker.common.Config.get('sampler', 'events')
+"Either 'events', to follow the focused window through X events, or 'poll' to ask for it on every sample"
+_JOURNAL = timetracker.common.Config.get('journal', False)
+"Whether to append samples to a journal that is compacted into the database, rather than writing them directly"
 
 try:
     import Xlib
     import Xlib.display
 
     _HAS_XLIB = True
-    disp = Xlib.display.Display()
-    NET_WM_NAME = disp.intern_atom('_NET_WM_NAME')
-    NET_ACTIVE_WINDOW = disp.intern_atom('_NET_ACTIVE_WINDOW')
-    root = disp.screen().root
-
 except ImportError:
     _HAS_XLIB = False
 
 
-def GetEventClasses(wmclass: str) -> WindowClass:
-    wclass = session.query(WindowClass).where(WindowClass.name == wmclass)
-    if wclass is None:
-        wclass = WindowClass(name=wmclass)
-    else:
-        for i in wclass:
-            return i
-        wclass = WindowClass(name=wmclass)
-    return wclass
+@lru_cache(None)
+def _display():
+    """
+    Connect to the X server the first time it is polled, so that importing this module doesn't need one.
+
+    :return: The display, its root window, and the _NET_WM_NAME and _NET_ACTIVE_WINDOW atoms
+    """
+    disp = Xlib.display.Display()
+    return disp, disp.screen().root, disp.intern_atom('_NET_WM_NAME'), disp.intern_atom('_NET_ACTIVE_WINDOW')
 
 
-def GetActiveWindowTitle(last: Optional[WindowEvent]) -> WindowEvent:
-    if not _HAS_XLIB:
+def GetActiveWindowTitle(last: Optional[Sample], watcher=None, now: Optional[datetime.datetime] = None,
+                         interval: float = _SAMPLE_INTERVAL) -> Optional[Sample]:
+    """
+    Sample the focused window, continuing the last sample if the window has not changed.
+
+    :param last: The previous sample, if it may be continued
+    :param watcher: What follows the focused window, anything with a `state` like
+                    :py:class:`timetracker.focus.FocusWatcher`. The X server is polled if there isn't one
+    :param now: The time of the sample, the current time if None
+    :param interval: The number of seconds until the next sample
+    :return: The last sample or a new one, or None if no window can be seen yet
+    """
+    since = None
+    if watcher is not None:
+        state = watcher.state
+        if state is None:
+            return last
+        window_id, name, wclass, since = state
+    elif not _HAS_XLIB:
         v = subprocess.Popen(["xprop",
                               "-root",
                               "_NET_ACTIVE_WINDOW"],
@@ -53,11 +74,12 @@ def GetActiveWindowTitle(last: Optional[WindowEvent]) -> WindowEvent:
                                 stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE) \
             .communicate()[0].strip().split(b'"', 1)[-1][:-1].decode()
-        wclass = \
-            subprocess.Popen(['xprop', '-id', v, 'WM_CLASS'], stdout=subprocess.PIPE).communicate()[0].split(b'"', 1)[
-                -1].decode('utf-8')
+        wclass = set(re.findall(r'"([^"]*)"',
+                                subprocess.Popen(['xprop', '-id', v, 'WM_CLASS'],
+                                                 stdout=subprocess.PIPE).communicate()[0].decode('utf-8')))
         window_id = int(v, base=16)
     else:
+        disp, root, NET_WM_NAME, NET_ACTIVE_WINDOW = _display()
         while True:
             try:
                 window_id = root.get_full_property(
@@ -67,9 +89,9 @@ def GetActiveWindowTitle(last: Optional[WindowEvent]) -> WindowEvent:
                 if name:
                     name = name.value.decode()
                 else:
-                    print("Couldn't get window title atm, sleeping")
-                    sleep(_SAMPLE_INTERVAL)
-                    return GetActiveWindowTitle(last)
+                    # Sleeping here would hold up the tracker's event loop, which asks again on its next sample
+                    print("Couldn't get window title atm, trying again on the next sample")
+                    return None
                 if window:
                     wclass = set(window.get_wm_class())
                     break
@@ -77,18 +99,20 @@ def GetActiveWindowTitle(last: Optional[WindowEvent]) -> WindowEvent:
                 continue
 
         print(name, wclass, window)
-    wclass = list(map(lambda x: GetEventClasses(x), wclass))
-    now = datetime.datetime.now()
-    later = now + datetime.timedelta(seconds=_SAMPLE_INTERVAL)
+    now = now or datetime.datetime.now()
+    later = now + datetime.timedelta(seconds=interval)
     if last and last.window_id == window_id and last.window_name == name:
-        if (now - last.time_end).total_seconds() <= 3 * _SAMPLE_INTERVAL:
+        if (now - last.time_end).total_seconds() <= 3 * interval:
             last.time_end = later
             return last
+    if last and since and last.time_start <= since < last.time_end:
+        # The focus changed between samples, so the new window's time starts when that happened rather than now.
+        last.time_end = since
+        now = since
 
-    result = WindowEvent(window_name=name, window_id=window_id,
-                         time_start=now,
-                         time_end=later, session=models.session_object(),
-                         classes=wclass)
+    result = Sample(window_name=name, window_id=window_id, classes=wclass,
+                    time_start=now,
+                    time_end=later)
     return result
 
 
@@ -99,54 +123,197 @@ def GetMouseLocation() -> tuple[int, int]:
     return tuple(map(lambda x: int(x.split(':')[1]), raw))
 
 
-def track():
+class Tracker:
+    """
+    Samples the focused window on a timer, while input is read in batches as it arrives.
+
+    Input sources and the X connection are watched by an asyncio event loop, so nothing is done per input event other
+    than adding it to the accumulator.
+
+    Times are kept as seconds on the tracker's clock, which is :py:func:`time.monotonic` when tracking for real, and
+    are only used to schedule samples and to tell when the user is idle. When tracking for real the samples are dated
+    by the wall clock instead, since the monotonic clock stops while the machine is suspended, and the times of focus
+    changes are on the wall clock too.
+
+    :ivar last: The sample being extended, None while the user is idle
+    :ivar epoch: The date that time 0 on the tracker's clock corresponds to
+    :ivar wall_clock: Whether samples are dated by the wall clock, rather than from the tracker's clock as replays are
+    """
+    last: Optional[Sample]
+    epoch: datetime.datetime
+    wall_clock: bool
+
+    def __init__(self, source: Optional[InputSource], writer: SampleWriter, watcher: Optional[FocusSource] = None,
+                 sample_interval: float = _SAMPLE_INTERVAL, idle_times: int = _IDLE_TIMES,
+                 epoch: Optional[datetime.datetime] = None, record: Optional[BinaryIO] = None,
+                 verbose: bool = True):
+        """
+        :param source: Where input comes from, this may be None if it is fed by a
+                       :py:class:`timetracker.sources.Replayer` instead of being run
+        :param writer: Where finished samples go
+        :param watcher: What follows the focused window, the X server is polled on each sample if None
+        :param sample_interval: The number of seconds between samples
+        :param idle_times: The number of samples without input after which the user is considered idle
+        :param epoch: The date that time 0 on the tracker's clock corresponds to, which samples are then dated from. By
+                      default it matches :py:func:`time.monotonic` and samples are dated by the wall clock
+        :param record: A file to record the input and focus changes to
+        :param verbose: Whether to print what happens on every sample
+        """
+        self.source = source
+        self.writer = writer
+        self.watcher = watcher
+        self.sample_interval = sample_interval
+        self.idle_times = idle_times
+        self.epoch = epoch or datetime.datetime.now() - datetime.timedelta(seconds=time.monotonic())
+        self.wall_clock = epoch is None
+        self.verbose = verbose
+        self.accumulator = Accumulator()
+        self.recorder = Recorder(record, self.accumulator, self.epoch) if record else None
+        self.last = None
+        self.last_input = float('-inf')
+        self._loop = None
+
+    def to_datetime(self, t: float) -> datetime.datetime:
+        """
+        Convert a time on the tracker's clock to a date.
+        """
+        return self.epoch + datetime.timedelta(seconds=t)
+
+    async def run(self) -> None:
+        """
+        Track until cancelled.
+        """
+        self._loop = asyncio.get_running_loop()
+        fds = [self.source.fileno()]
+        self._loop.add_reader(fds[0], self.read_input)
+        if isinstance(self.watcher, FocusWatcher):
+            fds.append(self.watcher.display.fileno())
+            self._loop.add_reader(fds[1], self.watcher.pump)
+        next_stats = self._loop.time() + STATS_INTERVAL
+        try:
+            while True:
+                await asyncio.sleep(self.sample_interval)
+                self.sample(self._loop.time())
+                if self._loop.time() >= next_stats:
+                    next_stats += STATS_INTERVAL
+                    self._loop.run_in_executor(None, stats.dump)
+        finally:
+            for i in fds:
+                self._loop.remove_reader(i)
+
+    def read_input(self) -> None:
+        """
+        Read whatever input is ready, noting the time once for the whole batch.
+        """
+        count = self.source.read(self.recorder or self.accumulator)
+        if count:
+            self.last_input = self._loop.time()
+            stats.count('input_events', count)
+            stats.count('input_batches')
+
+    def sample(self, now: float) -> None:
+        """
+        Take a sample, or close the current one if there has been no input for long enough.
+
+        :param now: The time on the tracker's clock
+        """
+        idle = now - self.last_input
+        if idle >= self.sample_interval * self.idle_times:
+            if self.last:
+                if self.verbose:
+                    print(f"No movement for {idle} seconds")
+                self.last = None
+                stats.count('idle_transitions')
+            self.accumulator.take()
+            return
+        with stats.timed('window_query'):
+            date = datetime.datetime.now() if self.wall_clock else self.to_datetime(now)
+            current = GetActiveWindowTitle(self.last, self.watcher, date, self.sample_interval)
+        if current is None:
+            return
+        if self.last is not current:
+            if self.verbose:
+                print("New event")
+            stats.count('samples_new')
+            if self.last:
+                # Its end may have moved back to when the focus changed
+                self.writer.submit(self.last)
+            if self.recorder:
+                self.recorder.focus(current.window_id, current.window_name, current.classes, current.time_start)
+            self.last = current
+        else:
+            if self.verbose:
+                print("old event")
+            stats.count('samples_merged')
+        activity = self.accumulator.take()
+        self.last.mouse_motion = (self.last.mouse_motion or 0) + activity.motion
+        self.last.keystrokes = (self.last.keystrokes or 0) + activity.keys
+        self.writer.submit(self.last)
+        if self.verbose:
+            print(f"Accumulated {activity.motion} movement, {activity.keys} keys, peak speed {activity.peak_speed}, "
+                  f"{activity.active_seconds} seconds of motion")
+
+
+def track(record: Optional[str] = None):
     """
     Start tracking the window usage of the system.
+    :param record: The name of a file to record the input and focus changes to, for replaying later
     :return: None
     """
-    from math import sqrt
-    last = None
-
-    c = 0
-    context = libinput.LibInput(
-        context_type=libinput.constant.ContextType.UDEV)
-    context.assign_seat('seat0')
-    event = context.events
-    last_time = datetime.datetime.now() - datetime.timedelta(seconds=20)
-    accumulated_motion = 0
-    accumulated_keys = 0
-    # This part should probably be extracted to its own file which is only imported when the user is in the 'input' group
-    # The alternative is just sleeping for a few seconds and then running the old code that retrieves the mouse's position
-    # through xlib
-    for i in event:
-        if i.type.is_pointer() or i.type.is_keyboard:
-            elapsed = (datetime.datetime.now() - last_time).total_seconds()
-            if elapsed >= _SAMPLE_INTERVAL * _IDLE_TIMES and last:
-                print(f"No movement for {elapsed} seconds")
-                last = None
-                accumulated_keys = 0
-                accumulated_motion = 0
-            if i.type.is_pointer() and i.type == libinput.EventType.POINTER_MOTION and last:
-                if not last.mouse_motion:
-                    last.mouse_motion = 0.0
-                accumulated_motion += sqrt(sum(map(lambda x: x **
-                                           2, i.delta_unaccelerated)))
-            elif last and i.type == libinput.EventType.KEYBOARD_KEY and i.key_state == libinput.KeyState.PRESSED:
-                accumulated_keys += 1 + i.seat_key_count
-            # Debounce the command invocation, as this could get very expensive if it is called on each event
-            if elapsed >= _SAMPLE_INTERVAL:
-                current = GetActiveWindowTitle(last)
-                session.add(current)
-                last_time = datetime.datetime.now()
-                session.commit()
-                if last != current:
-                    print("New event")
-                    last = current
-                else:
-                    print("old event")
-                last.mouse_motion = (
-                    last.mouse_motion or 0) + accumulated_motion
-                last.keystrokes = (last.keystrokes or 0) + accumulated_keys
-                print(
-                    f"Accumulated {accumulated_motion} movement, {accumulated_keys} keys")
-                accumulated_keys, accumulated_motion = 0, 0
+    models.create_tables()
+    # Samples are committed in batches from another thread, make sure the last of them are written when we are asked
+    # to stop.
+    writer = JournalWriter() if _JOURNAL else SampleWriter()
+    writer.start()
+    watcher = None
+    if _SAMPLER == 'events':
+        if _HAS_XLIB:
+            watcher = FocusWatcher(Xlib.display.Display())
+        else:
+            watcher = XpropWatcher()
+            watcher.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGHUP, lambda signum, frame: sys.exit(0))
+    recording = open(record, 'wb') if record else None
+    try:
+        asyncio.run(Tracker(LibinputSource(), writer, watcher, record=recording).run())
+    finally:
+        if recording:
+            recording.close()
+        writer.close()
+        if isinstance(watcher, XpropWatcher):
+            watcher.close()
+        stats.dump()
+
+
+def replay(file: str, speed: Optional[float] = None, database: Optional[str] = None) -> None:
+    """
+    Track the input and focus changes of a recording instead of the ones happening now.
+
+    :param file: The recording, as written by `track(record=...)` or :py:func:`timetracker.sources.write_records`
+    :param speed: How many times faster than real time to replay, or None for as fast as possible
+    :param database: The sqlalchemy url of the database to write to, rather than the usual one
+    """
+    session_factory = models.session
+    if database:
+        import sqlalchemy
+        import sqlalchemy.orm
+        engine = sqlalchemy.create_engine(database)
+        session_factory = sqlalchemy.orm.sessionmaker(bind=engine)
+    else:
+        engine = models.engine
+    models.create_tables(engine)
+    writer = SampleWriter(session_factory)
+    writer.start()
+    with open(file, 'rb') as f:
+        epoch, records = read_records(f)
+        replayer = Replayer(records)
+        start = time.perf_counter()
+        try:
+            n = replayer.replay(Tracker(None, writer, replayer, epoch=epoch, verbose=False), speed)
+        finally:
+            writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {n} records in {elapsed:.2f} seconds, {n / elapsed:,.0f} records/s")
+    print(f"{stats.counters.get('samples_written', 0)} samples written in "
+          f"{stats.histograms['commit'].count if 'commit' in stats.histograms else 0} commits")
@@ -0,0 +1,328 @@
+"""
+Moves the history of events out of the database and back in, as json lines, csv or the archive format.
+
+Both directions stream the events in chunks, so that a history of millions of events takes the same memory as a few
+thousand. :py:func:`export_events` reads the events in order of their start, along with their titles and classes, with a
+few queries per chunk. :py:func:`import_events` writes them back a batch at a time:
+
+* titles and classes are looked up by name, and the ones that are new are added, for the whole batch at once,
+* events that are already in the database, by their window and start, are skipped,
+* the rest are inserted with a single statement, and their classes with another.
+
+The ids of sessions are only meaningful in the database they came from, so each session of the events imported gets a
+new session of its own, starting with its first event. An archive export is a directory with a file for each month, see
+:py:mod:`timetracker.archive`. Archives don't keep the sessions of events, which are imported into the session of the
+process importing them.
+"""
+from __future__ import annotations
+
+import csv
+import datetime
+import json
+from pathlib import Path
+from typing import *
+
+import sqlalchemy
+import sqlalchemy.orm
+from sqlalchemy.dialects.sqlite import insert
+
+import timetracker.archive as archive
+import timetracker.models as models
+from timetracker.models import EventClass, SessionObject, WindowClass, WindowEvent, WindowTitle
+
+FORMATS = ['jsonl', 'csv', 'tta']
+FIELDS = ['id', 'session_id', 'window_id', 'window_name', 'time_start', 'time_end', 'keystrokes', 'mouse_motion',
+          'classes']
+_IN_LIMIT = 500
+"The number of values to compare with at once, older sqlite libraries allow 999 parameters to a statement"
+_NAME_CACHE_SIZE = 100000
+
+
+class Record(NamedTuple):
+    """
+    An event as it is exported, which has what :py:func:`timetracker.archive.write_archive` needs too.
+    """
+    id: Optional[int]
+    session_id: Optional[int]
+    window_id: Optional[int]
+    window_name: str
+    time_start: datetime.datetime
+    time_end: datetime.datetime
+    keystrokes: int
+    mouse_motion: float
+    classes: list[archive.ArchivedClass]
+    title_id: Optional[int] = None
+
+    def as_json(self) -> dict:
+        return {'id': self.id, 'session_id': self.session_id, 'window_id': self.window_id,
+                'window_name': self.window_name, 'time_start': self.time_start.isoformat(),
+                'time_end': self.time_end.isoformat(), 'keystrokes': self.keystrokes, 'mouse_motion': self.mouse_motion,
+                'classes': [i.name for i in self.classes]}
+
+    @staticmethod
+    def from_json(obj: dict) -> Record:
+        return Record(obj.get('id'), obj.get('session_id'), obj.get('window_id'), obj.get('window_name') or '',
+                      datetime.datetime.fromisoformat(obj['time_start']),
+                      datetime.datetime.fromisoformat(obj['time_end']), obj.get('keystrokes') or 0,
+                      obj.get('mouse_motion') or 0.0, [archive.ArchivedClass(None, i) for i in obj.get('classes', [])])
+
+
+def format_of(path: str, format: Optional[str] = None) -> str:
+    """
+    :return: The format given, or else the one the name of the file suggests
+    """
+    if format:
+        return format
+    suffix = Path(path).suffix.lstrip('.')
+    if suffix in FORMATS:
+        return suffix
+    return 'tta' if Path(path).is_dir() else 'jsonl'
+
+
+def records(ses: sqlalchemy.orm.Session, since: Optional[datetime.datetime] = None,
+            until: Optional[datetime.datetime] = None, chunk_size: int = 5000) -> Iterator[Record]:
+    """
+    Read the events in order of their start, a chunk at a time.
+
+    :param ses: The session to query with
+    :param since: The earliest start of the events to read
+    :param until: Where to stop, exclusive
+    :param chunk_size: The number of events to read at once
+    """
+    table = WindowEvent.__table__
+    titles = WindowTitle.__table__
+    query = sqlalchemy.select(table.c.id, table.c.session_id, table.c.window_id, titles.c.name, table.c.time_start,
+                              table.c.time_end, table.c.keystrokes, table.c.mouse_motion, table.c.title_id) \
+        .select_from(table.outerjoin(titles, titles.c.id == table.c.title_id)) \
+        .order_by(table.c.time_start, table.c.id).limit(chunk_size)
+    if since is not None:
+        query = query.where(table.c.time_start >= since)
+    if until is not None:
+        query = query.where(table.c.time_start < until)
+    position = None
+    while True:
+        chunk = query
+        if position is not None:
+            chunk = chunk.where(sqlalchemy.or_(table.c.time_start > position[0], sqlalchemy.and_(
+                table.c.time_start == position[0], table.c.id > position[1])))
+        rows = ses.execute(chunk).all()
+        if not rows:
+            return
+        classes = {}
+        for i in range(0, len(rows), _IN_LIMIT):
+            for event_id, class_id, name in ses.execute(
+                    sqlalchemy.select(EventClass.__table__.c.event_id, WindowClass.__table__.c.id,
+                                      WindowClass.__table__.c.name)
+                            .join(WindowClass.__table__, WindowClass.__table__.c.id == EventClass.__table__.c.class_id)
+                            .where(EventClass.__table__.c.event_id.in_([r.id for r in rows[i:i + _IN_LIMIT]]))):
+                classes.setdefault(event_id, []).append(archive.ArchivedClass(class_id, name))
+        for r in rows:
+            yield Record(r.id, r.session_id, r.window_id, r.name or '', r.time_start, r.time_end, r.keystrokes or 0,
+                         r.mouse_motion or 0.0, classes.get(r.id, []), r.title_id)
+        if len(rows) < chunk_size:
+            return
+        position = rows[-1].time_start, rows[-1].id
+
+
+def export_events(ses: sqlalchemy.orm.Session, path: str, format: Optional[str] = None,
+                  since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+                  output: Optional[TextIO] = None) -> int:
+    """
+    Write the events to a file.
+
+    :param ses: The session to query with
+    :param path: The file, or for archives the directory, to write to
+    :param format: One of :py:data:`FORMATS`, by default the extension of the path
+    :param since: The earliest start of the events to export
+    :param until: Where to stop, exclusive
+    :param output: A stream to write the json lines or csv to instead of the path, such as stdout
+    :return: The number of events written
+    """
+    format = format_of(path, format)
+    n = 0
+    if format == 'tta':
+        month, events = None, []
+        for record in records(ses, since, until):
+            if month != record.time_start.date().replace(day=1) and events:
+                n += archive.write_archive(archive.archive_path(Path(path), month), events)
+                events = []
+            month = record.time_start.date().replace(day=1)
+            events.append(record)
+        if events:
+            n += archive.write_archive(archive.archive_path(Path(path), month), events)
+        return n
+    f = output or open(path, 'w', newline='')
+    try:
+        writer = csv.DictWriter(f, FIELDS) if format == 'csv' else None
+        if writer:
+            writer.writeheader()
+        for record in records(ses, since, until):
+            row = record.as_json()
+            if writer:
+                row['classes'] = json.dumps(row['classes'])
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(row) + '\n')
+            n += 1
+    finally:
+        if output is None:
+            f.close()
+    return n
+
+
+def read_records(path: str, format: Optional[str] = None, input: Optional[TextIO] = None) -> Iterator[Record]:
+    """
+    Read exported events.
+
+    :param path: The file, or for archives the directory or a single month's file
+    :param format: One of :py:data:`FORMATS`, by default the extension of the path
+    :param input: A stream to read the json lines or csv from instead of the path, such as stdin
+    """
+    format = format_of(path, format)
+    if format == 'tta':
+        files = sorted(Path(path).glob('*.tta')) if Path(path).is_dir() else [Path(path)]
+        for file in files:
+            with archive.Archive(file) as a:
+                for e in a:
+                    yield Record(e.id, None, e.window_id, e.window_name, e.time_start, e.time_end, e.keystrokes,
+                                 e.mouse_motion, [archive.ArchivedClass(None, c.name) for c in e.classes])
+        return
+    f = input or open(path, newline='')
+    try:
+        if format == 'csv':
+            for row in csv.DictReader(f):
+                yield Record.from_json({'id': row['id'] and int(row['id']),
+                                        'session_id': row['session_id'] and int(row['session_id']),
+                                        'window_id': row['window_id'] and int(row['window_id']),
+                                        'window_name': row['window_name'],
+                                        'time_start': row['time_start'], 'time_end': row['time_end'],
+                                        'keystrokes': int(row['keystrokes'] or 0),
+                                        'mouse_motion': float(row['mouse_motion'] or 0),
+                                        'classes': json.loads(row['classes'] or '[]')})
+        else:
+            for line in f:
+                if line.strip():
+                    yield Record.from_json(json.loads(line))
+    finally:
+        if input is None:
+            f.close()
+
+
+class _Names:
+    """
+    The ids of the titles or classes, by name, adding the names that aren't stored yet.
+    """
+
+    def __init__(self, table: sqlalchemy.Table):
+        self.table = table
+        self.ids = {}
+
+    def lookup(self, ses: sqlalchemy.orm.Session, names: Iterable[str]) -> dict[str, int]:
+        missing = list({i for i in names if i not in self.ids})
+        if len(self.ids) + len(missing) > _NAME_CACHE_SIZE:
+            self.ids.clear()
+            missing = list(set(names))
+        for i in range(0, len(missing), _IN_LIMIT):
+            chunk = missing[i:i + _IN_LIMIT]
+            ses.execute(insert(self.table).on_conflict_do_nothing(), [{'name': name} for name in chunk])
+            self.ids.update(ses.execute(sqlalchemy.select(self.table.c.name, self.table.c.id)
+                                        .where(self.table.c.name.in_(chunk))).all())
+        return self.ids
+
+
+def _existing(ses: sqlalchemy.orm.Session, batch: list[Record]) -> dict[tuple[Optional[int], datetime.datetime], int]:
+    "The ids of the events of the database with the same windows and starts as some of a batch"
+    table = WindowEvent.__table__
+    starts = list({i.time_start for i in batch})
+    found = {}
+    for i in range(0, len(starts), _IN_LIMIT):
+        for event_id, window_id, start in ses.execute(sqlalchemy.select(table.c.id, table.c.window_id,
+                                                                        table.c.time_start)
+                                                      .where(table.c.time_start.in_(starts[i:i + _IN_LIMIT]))):
+            found[window_id, start] = event_id
+    return found
+
+
+def _new_session(ses: sqlalchemy.orm.Session, date: datetime.datetime) -> int:
+    "Add a session for imported events, returning its id"
+    return ses.execute(SessionObject.__table__.insert().values(date=date, samples=0)).inserted_primary_key[0]
+
+
+def _bound_sessions(ses: sqlalchemy.orm.Session, ids: list[int]) -> None:
+    "Set the start and end of sessions from the events that were added to them"
+    table, events = SessionObject.__table__, WindowEvent.__table__
+    for i in range(0, len(ids), _IN_LIMIT):
+        ses.execute(table.update().where(table.c.id.in_(ids[i:i + _IN_LIMIT])).values(
+            date=sqlalchemy.select(sqlalchemy.func.min(events.c.time_start))
+            .where(events.c.session_id == table.c.id).scalar_subquery(),
+            end=sqlalchemy.select(sqlalchemy.func.max(events.c.time_end))
+            .where(events.c.session_id == table.c.id).scalar_subquery()))
+    ses.commit()
+
+
+def import_events(ses: sqlalchemy.orm.Session, events: Iterable[Record], batch_size: int = 5000) -> tuple[int, int]:
+    """
+    Add events to the database, skipping the ones it has already.
+
+    An event is already in the database if one with the same window id starts at the same time. The events of each
+    session they were exported from are added to a new session, and events without a session to the session of this
+    process.
+
+    :param ses: The session to write with
+    :param events: The events, see :py:func:`read_records`
+    :param batch_size: The number of events to add at once
+    :return: The number of events added and the number skipped
+    """
+    titles, classes = _Names(WindowTitle.__table__), _Names(WindowClass.__table__)
+    session_id = models.current_time
+    local = {}
+    "The new session of each session the events came from"
+    added = skipped = 0
+    earliest = None
+    batch = []
+    events = iter(events)
+    while True:
+        batch.clear()
+        for e in events:
+            batch.append(e)
+            if len(batch) == batch_size:
+                break
+        if not batch:
+            break
+        existing = _existing(ses, batch)
+        new, seen = [], set(existing)
+        for e in batch:
+            if (e.window_id, e.time_start) in seen:
+                skipped += 1
+                continue
+            seen.add((e.window_id, e.time_start))
+            new.append(e)
+        if new:
+            for e in new:
+                if e.session_id is not None and e.session_id not in local:
+                    local[e.session_id] = _new_session(ses, e.time_start)
+            if any(e.session_id is None for e in new):
+                ses.execute(insert(SessionObject.__table__).on_conflict_do_nothing(),
+                            {'id': session_id, 'date': datetime.datetime.now(), 'samples': 0})
+            title_ids = titles.lookup(ses, [e.window_name for e in new if e.window_name])
+            class_ids = classes.lookup(ses, [c.name for e in new for c in e.classes])
+            ses.execute(WindowEvent.__table__.insert(), [
+                {'session_id': local.get(e.session_id, session_id), 'window_id': e.window_id,
+                 'title_id': title_ids.get(e.window_name), 'time_start': e.time_start, 'time_end': e.time_end,
+                 'keystrokes': e.keystrokes, 'mouse_motion': e.mouse_motion} for e in new])
+            ids = _existing(ses, new)
+            links = {(ids[e.window_id, e.time_start], class_ids[c.name]) for e in new for c in e.classes}
+            if links:
+                ses.execute(EventClass.__table__.insert(), [{'event_id': event_id, 'class_id': class_id}
+                                                            for event_id, class_id in links])
+            start = min(e.time_start for e in new)
+            earliest = start if earliest is None else min(earliest, start)
+            added += len(new)
+        ses.commit()
+    if local:
+        _bound_sessions(ses, list(local.values()))
+    if earliest is not None:
+        # Totals that were kept of the time the events were added to are out of date
+        import timetracker.rollup as rollup
+        rollup.invalidate(ses, earliest)
+    return added, skipped
@@ -0,0 +1,284 @@
+"""
+Moves the database writes of the tracker off of the input loop.
+
+The tracker hands :py:class:`Sample` snapshots to a :py:class:`SampleWriter`, which turns them into
+:py:class:`timetracker.models.WindowEvent` rows and commits them in batches from a background thread, so that a slow
+disk never holds up input handling.
+"""
+from __future__ import annotations
+
+import datetime
+import itertools
+import queue
+import threading
+import time
+from typing import *
+
+import sqlalchemy.exc
+import sqlalchemy.orm
+
+import timetracker.common
+import timetracker.models as models
+from timetracker.models import SessionObject, WindowClassCache, WindowEvent, WindowTitleCache
+from timetracker.stats import stats
+
+_FLUSH_INTERVAL = timetracker.common.Config.get('flush_interval', 30)
+_FLUSH_SIZE = timetracker.common.Config.get('flush_size', 8)
+_CLASS_CACHE_SIZE = timetracker.common.Config.get('class_cache_size', 1024)
+_TITLE_CACHE_SIZE = timetracker.common.Config.get('title_cache_size', 1024)
+_WRITE_ATTEMPTS = timetracker.common.Config.get('write_attempts', 5)
+"The number of times a batch is tried before its samples are given up on"
+
+_keys = itertools.count()
+
+
+class Sample:
+    """
+    The state of the focused window over a measurement interval, independent of any database session.
+
+    Successive samples of the same window share a key, which the writer uses to update a single row.
+    """
+    __slots__ = ['key', 'window_name', 'window_id', 'classes', 'time_start', 'time_end', 'mouse_motion',
+                 'keystrokes']
+    key: int
+    window_name: str
+    window_id: int
+    classes: frozenset[str]
+    time_start: datetime.datetime
+    time_end: datetime.datetime
+    mouse_motion: float
+    keystrokes: int
+
+    def __init__(self, window_name: str, window_id: int, classes: Iterable[str], time_start: datetime.datetime,
+                 time_end: datetime.datetime, mouse_motion: float = 0.0, keystrokes: int = 0,
+                 key: Optional[int] = None):
+        self.key = next(_keys) if key is None else key
+        self.window_name = window_name
+        self.window_id = window_id
+        self.classes = frozenset(classes)
+        self.time_start = time_start
+        self.time_end = time_end
+        self.mouse_motion = mouse_motion
+        self.keystrokes = keystrokes
+
+    def snapshot(self) -> Sample:
+        """
+        Copy the sample so that it may be handed to another thread while this one keeps changing.
+
+        :return: The copy, sharing the same key
+        """
+        return Sample(self.window_name, self.window_id, self.classes, self.time_start, self.time_end,
+                      self.mouse_motion, self.keystrokes, key=self.key)
+
+
+_STOP = object()
+
+
+class SampleWriter(threading.Thread):
+    """
+    A background thread that commits samples in batches.
+
+    A batch is committed once it holds `flush_size` samples, or `flush_interval` seconds after its first sample
+    arrived, whichever comes first. A batch that can't be committed, say because the database is locked, is kept and
+    tried again with the next flush, and only given up on after `write_attempts` tries. Only the event still being
+    extended stays in the writer's session after a commit, the others are released so that a tracker running for days
+    doesn't hold on to every event it has written.
+
+    :ivar queue: The samples waiting to be written
+    :ivar classes: The window classes already known to the writer's session
+    :ivar titles: The window titles already known to the writer's session
+    :ivar tracker_session: The record of the tracker session the samples belong to, created when the thread starts
+    :ivar samples: The number of samples submitted during the tracker session
+    :ivar end: The end of the latest sample submitted during the tracker session
+    """
+    queue: queue.Queue
+    classes: WindowClassCache
+    titles: WindowTitleCache
+    tracker_session: Optional[SessionObject]
+    samples: int
+    end: Optional[datetime.datetime]
+
+    def __init__(self, session_factory: Callable[[], sqlalchemy.orm.Session] = models.session,
+                 flush_interval: float = _FLUSH_INTERVAL, flush_size: int = _FLUSH_SIZE,
+                 session_id: int = models.current_time):
+        """
+        :param session_factory: Called from the writer thread to get the session to write with
+        :param flush_interval: The longest time in seconds a sample may wait before being committed
+        :param flush_size: The number of samples that causes a commit regardless of the time
+        :param session_id: The id of the tracker session the samples are taken during
+        """
+        super().__init__(name='timetracker-writer', daemon=True)
+        self.queue = queue.Queue()
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, flush_size)
+        self.classes = WindowClassCache(_CLASS_CACHE_SIZE)
+        self.titles = WindowTitleCache(_TITLE_CACHE_SIZE)
+        self.session_id = session_id
+        self.tracker_session = None
+        self.samples = 0
+        self.end = None
+        self._open_key = None
+        self._open = None
+        self._closed = []
+        self._failures = 0
+
+    def submit(self, sample: Sample) -> None:
+        """
+        Queue the current state of a sample for writing, this never blocks.
+
+        :param sample: The sample, which is copied so the caller may continue updating it
+        """
+        self.queue.put(sample.snapshot())
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Commit everything submitted so far.
+
+        :param timeout: The number of seconds to wait for the commit, or None to wait indefinitely
+        :return: Whether the commit finished in time
+        """
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        """
+        Commit everything that is still queued and stop the thread.
+        """
+        self.queue.put(_STOP)
+        self.join()
+
+    def run(self) -> None:
+        ses = self._session()
+        self._batch(ses)
+        self._end_session(ses)
+        ses.close()
+
+    def _session(self) -> sqlalchemy.orm.Session:
+        ses = self.session_factory()
+        # Nothing else writes the rows this session holds on to, so there is no point in reloading them after each
+        # commit.
+        ses.expire_on_commit = False
+        self.classes.preload(ses)
+        self.titles.preload(ses)
+        try:
+            self.tracker_session = SessionObject.start(ses, self.session_id)
+            ses.commit()
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            # It is added again along with the first event
+            print(f"Unable to record the start of the session: {e}")
+            ses.rollback()
+        return ses
+
+    def _end_session(self, ses: sqlalchemy.orm.Session) -> None:
+        """
+        Record the end of the tracker session and the number of samples taken during it.
+        """
+        if self.tracker_session is None:
+            return
+        self.tracker_session.end = self.end
+        self.tracker_session.samples = (self.tracker_session.samples or 0) + self.samples
+        try:
+            ses.add(self.tracker_session)
+            ses.commit()
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            print(f"Unable to record the end of the session: {e}")
+            ses.rollback()
+
+    def _batch(self, ses: sqlalchemy.orm.Session) -> None:
+        """
+        Hand the queued samples to `_write` in batches until the writer is closed.
+        """
+        pending = []
+        deadline = 0.0
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()) if pending else None)
+            except queue.Empty:
+                self._write(ses, pending)
+                # What couldn't be written is tried again after another interval
+                deadline = time.monotonic() + self.flush_interval
+                continue
+            if item is _STOP:
+                while pending:
+                    self._write(ses, pending)
+                break
+            if isinstance(item, threading.Event):
+                self._write(ses, pending)
+                item.set()
+                continue
+            if not pending:
+                deadline = time.monotonic() + self.flush_interval
+            self.samples += 1
+            if self.end is None or item.time_end > self.end:
+                self.end = item.time_end
+            pending.append(item)
+            if len(pending) >= self.flush_size:
+                self._write(ses, pending)
+
+    def _write(self, ses: sqlalchemy.orm.Session, pending: list[Sample]) -> None:
+        """
+        Apply and commit a batch of samples in a single transaction, emptying the batch unless it couldn't be
+        committed and hasn't been tried `write_attempts` times yet.
+        """
+        if not pending:
+            return
+        # The event being extended was committed before this batch, and still is if the batch is rolled back
+        before = self._open_key, self._open
+        try:
+            with stats.timed('commit'):
+                for sample in pending:
+                    self._apply(ses, sample)
+                ses.commit()
+            self.classes.commit()
+            self.titles.commit()
+            self._release(ses, self._closed)
+            stats.count('samples_written', len(pending))
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            print(f"Unable to write {len(pending)} samples: {e}")
+            stats.count('commit_failures')
+            ses.rollback()
+            self.classes.rollback()
+            self.titles.rollback()
+            self._open_key, self._open = before
+            self._closed.clear()
+            self._failures += 1
+            if self._failures < _WRITE_ATTEMPTS:
+                return
+            print(f"Giving up on {len(pending)} samples after {self._failures} attempts")
+            stats.count('samples_dropped', len(pending))
+        self._failures = 0
+        pending.clear()
+
+    def _apply(self, ses: sqlalchemy.orm.Session, sample: Sample) -> None:
+        if sample.key != self._open_key:
+            if self._open is not None:
+                self._closed.append(self._open)
+            self._open = WindowEvent(title=self.titles.lookup(ses, sample.window_name or ''),
+                                     window_id=sample.window_id, time_start=sample.time_start,
+                                     classes=[self.classes.lookup(ses, i) for i in sorted(sample.classes)],
+                                     session=self.tracker_session)
+            self._open_key = sample.key
+            ses.add(self._open)
+        self._open.time_end = sample.time_end
+        self._open.mouse_motion = sample.mouse_motion
+        self._open.keystrokes = sample.keystrokes
+
+    def _release(self, ses: sqlalchemy.orm.Session, events: list[WindowEvent]) -> None:
+        """
+        Detach committed events from the session, emptying the list.
+
+        Adding an event also adds it to the `events` collections of its classes and tracker session wherever those
+        are loaded, which would keep it alive after being expunged, so those collections are unloaded as well.
+        """
+        owners = {self.tracker_session}
+        for event in events:
+            owners.update(event.classes)
+            owners.add(event.session)
+            ses.expunge(event)
+        for owner in owners:
+            if owner is not None and 'events' in sqlalchemy.inspect(owner).dict:
+                ses.expire(owner, ['events'])
+        stats.count('events_released', len(events))
+        events.clear()